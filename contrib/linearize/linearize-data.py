@@ -126,10 +126,14 @@ class BlockDataCopier:
 
     def read_xored(self, f, size):
         offset = f.tell()
-        data = bytearray(f.read(size))
-        for i in range(len(data)):
-            data[i] ^= self.xor_key[(i + offset) % len(self.xor_key)]
-        return bytes(data)
+        data = f.read(size)
+        if not data:
+            return data
+        shift = offset % len(self.xor_key)
+        key = self.xor_key[shift:] + self.xor_key[:shift]
+        stream = (key * (len(data) // len(key) + 1))[:len(data)]
+        # XOR the whole buffer at once as two big integers
+        return (int.from_bytes(data, 'little') ^ int.from_bytes(stream, 'little')).to_bytes(len(data), 'little')
 
     def writeBlock(self, inhdr, blk_hdr, rawblock):
         blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
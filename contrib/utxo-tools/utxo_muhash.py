@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Tool to compute the MuHash of a compact-serialized UTXO set.
+
+The input UTXO set can be generated by Bitcoin Core with the `dumptxoutset` RPC:
+$ bitcoin-cli dumptxoutset ~/utxos.dat latest
+
+The printed hash can be compared with the `muhash` field of
+`bitcoin-cli gettxoutsetinfo muhash` at the snapshot's block (this needs
+-coinstatsindex for blocks other than the tip), e.g. to check an assumeutxo
+snapshot offline.
+
+The coins are hashed by a pool of worker processes. Each worker folds a batch
+of coins into a partial MuHash, and the partial results are combined at the end.
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+import mmap
+import os
+import sys
+import time
+
+from utxo_to_sqlite import (
+    NET_MAGIC_BYTES,
+    UTXO_DUMP_MAGIC,
+    UTXO_DUMP_VERSION,
+    decompress_amount,
+    decompress_script,
+    read_compactsize,
+    read_varint,
+)
+
+PATH_BASE_CONTRIB_UTXO_TOOLS = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+PATH_BASE_TEST_FUNCTIONAL = os.path.abspath(os.path.join(PATH_BASE_CONTRIB_UTXO_TOOLS, "..", "..", "test", "functional"))
+sys.path.insert(0, PATH_BASE_TEST_FUNCTIONAL)
+
+from test_framework.crypto.muhash import MuHash3072 # noqa: E402
+from test_framework.messages import ser_compact_size # noqa: E402
+
+# Size of the snapshot metadata (magic bytes, version, network magic, block hash, UTXO count).
+HEADER_SIZE = 5 + 2 + 4 + 32 + 8
+# Number of coins per task handed to a worker.
+BATCH_SIZE = 4096
+
+
+def skip_varint(buf, pos):
+    """Return the position after the VarInt at pos."""
+    while buf[pos] & 0x80:
+        pos += 1
+    return pos + 1
+
+
+def read_varint_at(buf, pos):
+    """Return the VarInt at pos and the position after it."""
+    n = 0
+    while True:
+        dat = buf[pos]
+        pos += 1
+        n = (n << 7) | (dat & 0x7f)
+        if dat & 0x80:
+            n += 1
+        else:
+            return n, pos
+
+
+def read_compactsize_at(buf, pos):
+    """Return the CompactSize at pos and the position after it."""
+    n = buf[pos]
+    if n < 253:
+        return n, pos + 1
+    size = {253: 2, 254: 4, 255: 8}[n]
+    return int.from_bytes(buf[pos + 1:pos + 1 + size], "little"), pos + 1 + size
+
+
+def compressed_script_size(size):
+    """Return the number of bytes following a compressed script's size (see `ScriptCompression`)."""
+    if size in (0, 1):
+        return 20
+    if size < 6:
+        return 32
+    return size - 6
+
+
+def read_coin_batches(buf, num_utxos):
+    """Split the coins of a snapshot into batches of (txid, serialized coin) without decoding them.
+
+    The serialized coin is the compact-serialized output index and Coin."""
+    pos = HEADER_SIZE
+    batch = []
+    coins_left = num_utxos
+    try:
+        while coins_left > 0:
+            txid = bytes(buf[pos:pos + 32])
+            coins_per_hash, pos = read_compactsize_at(buf, pos + 32)
+            for _ in range(coins_per_hash):
+                start = pos
+                _, pos = read_compactsize_at(buf, pos)  # output index
+                pos = skip_varint(buf, pos)  # height and coinbase flag
+                pos = skip_varint(buf, pos)  # amount
+                size, pos = read_varint_at(buf, pos)
+                pos += compressed_script_size(size)
+                batch.append((txid, bytes(buf[start:pos])))
+                if len(batch) == BATCH_SIZE:
+                    yield batch
+                    batch = []
+            coins_left -= coins_per_hash
+    except IndexError:
+        pos = len(buf) + 1
+    if pos > len(buf):
+        raise ValueError("snapshot is truncated")
+    if pos < len(buf):
+        raise ValueError(f"snapshot has {len(buf) - pos} bytes of data after the last coin")
+    if batch:
+        yield batch
+
+
+def hash_coins(coins):
+    """Return the MuHash of a batch of coins, serialized like `TxOutSer` in the coinstats module."""
+    muhash = MuHash3072()
+    for txid, coin in coins:
+        f = BytesIO(coin)
+        prevout_index = read_compactsize(f)
+        code = read_varint(f)  # height * 2 + coinbase
+        amount = decompress_amount(read_varint(f))
+        scriptpubkey = decompress_script(f)
+        muhash.insert(txid + prevout_index.to_bytes(4, "little") + code.to_bytes(4, "little") +
+                      amount.to_bytes(8, "little", signed=True) + ser_compact_size(len(scriptpubkey)) + scriptpubkey)
+    return muhash
+
+
+def snapshot_muhash(buf, num_utxos, jobs, progress=None):
+    """Return the MuHash3072 of all coins of a snapshot, hashed by jobs worker processes.
+
+    progress, if given, is called with the number of coins hashed so far."""
+    muhash = MuHash3072()
+    done_coins = 0
+    batches = read_coin_batches(buf, num_utxos)
+    if jobs == 1:
+        for batch in batches:
+            muhash *= hash_coins(batch)
+            done_coins += len(batch)
+            if progress:
+                progress(done_coins)
+        return muhash
+    with ProcessPoolExecutor(jobs) as executor:
+        # Keep a bounded number of batches in flight, so the snapshot is not read ahead into memory.
+        pending = {}
+        for batch in batches:
+            if len(pending) >= 4 * jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    muhash *= future.result()
+                    done_coins += pending.pop(future)
+                if progress:
+                    progress(done_coins)
+            pending[executor.submit(hash_coins, batch)] = len(batch)
+        for future in pending:
+            muhash *= future.result()
+    return muhash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('infile', help='filename of compact-serialized UTXO set (input)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.infile):
+        print(f"Error: provided input file '{args.infile}' doesn't exist.")
+        sys.exit(1)
+    if args.jobs < 1:
+        print("Error: the number of jobs must be at least 1.")
+        sys.exit(1)
+
+    if os.path.getsize(args.infile) < HEADER_SIZE:
+        print(f"Error: provided input file '{args.infile}' is not an UTXO dump.")
+        sys.exit(1)
+    with open(args.infile, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic_bytes = buf[:5]
+    version = int.from_bytes(buf[5:7], 'little')
+    network_magic = buf[7:11]
+    block_hash = buf[11:43]
+    num_utxos = int.from_bytes(buf[43:51], 'little')
+    if magic_bytes != UTXO_DUMP_MAGIC:
+        print(f"Error: provided input file '{args.infile}' is not an UTXO dump.")
+        sys.exit(1)
+    if version != UTXO_DUMP_VERSION:
+        print(f"Error: provided input file '{args.infile}' has unknown UTXO dump version {version} "
+              f"(only version {UTXO_DUMP_VERSION} supported)")
+        sys.exit(1)
+    network_string = NET_MAGIC_BYTES.get(network_magic, f"unknown network ({network_magic.hex()})")
+    print(f"UTXO Snapshot for {network_string} at block hash "
+          f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
+
+    start_time = time.time()
+    last_report = [0]
+
+    def progress(done_coins):
+        if done_coins - last_report[0] >= 1024 * 1024:
+            last_report[0] = done_coins
+            elapsed = time.time() - start_time
+            print(f"{done_coins} coins hashed [{done_coins/num_utxos*100:.2f}%], " +
+                  f"{elapsed:.3f}s passed since start")
+
+    try:
+        muhash = snapshot_muhash(buf, num_utxos, args.jobs, progress)
+    except ValueError as e:
+        print(f"Error: provided input file '{args.infile}' is invalid: {e}")
+        sys.exit(1)
+    print(f"TOTAL: {num_utxos} coins hashed in {time.time() - start_time:.3f}s.")
+    print(f"muhash: {muhash.digest()[::-1].hex()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ The created database contains a table `utxos` with the following schema:
 (txid TEXT, vout INT, value INT, coinbase INT, height INT, scriptpubkey TEXT)
 """
 import argparse
+import functools
 import os
 import sqlite3
 import sys
@@ -90,6 +91,12 @@ def decompress_script(f):
         return f.read(size)
 
 
+# Many P2PK coins share the same few public keys, so remember recent
+# decompressions instead of computing a square root for every coin.
+DECOMPRESS_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=DECOMPRESS_CACHE_SIZE)
 def decompress_pubkey(compressed_pubkey):
     """Decompress pubkey by calculating y = sqrt(x^3 + 7) % p
        (see functions `secp256k1_eckey_pubkey_parse` and `secp256k1_ge_set_xo_var`).
@@ -186,6 +193,9 @@ def main():
     con.close()
 
     print(f"TOTAL: {num_utxos} coins written to {args.outfile}, snapshot height is {max_height}.")
+    if args.verbose:
+        cache_info = decompress_pubkey.cache_info()
+        print(f"Pubkey decompression cache: {cache_info.hits} hits, {cache_info.misses} misses")
     if f.read(1) != b'':  # EOF should be reached by now
         print(f"WARNING: input file {args.infile} has not reached EOF yet!")
         sys.exit(1)
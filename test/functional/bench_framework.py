@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Micro-benchmarks for the Python test framework.
+
+Times the parts of the test framework that functional test run time depends
+on: (de)serialization of every P2P message type, txid and merkle root
+computation on a synthetic 4 MB (weight) block, ECDSA and Schnorr signing and
+verification, the signature hash functions, taproot script trees,
+ChaCha20/Poly1305 and MuHash.
+
+Results are printed and can be written as JSON with --output. A previous JSON
+result can be passed with --baseline to compare against it; with
+--max-regression the script fails if any benchmark got slower than allowed,
+so it can be used to catch slowdowns.
+
+Examples:
+
+    bench_framework.py --output before.json
+    bench_framework.py --baseline before.json --filter 'sighash|key'
+"""
+
+import argparse
+from io import BytesIO
+import json
+import platform
+import re
+import sys
+import timeit
+
+from test_framework.blocktools import (
+    add_witness_commitment,
+    create_block,
+    create_coinbase,
+    get_legacy_sigopcount_block,
+)
+from test_framework.crypto.bip324_cipher import aead_chacha20_poly1305_encrypt
+from test_framework.crypto.chacha20 import FSChaCha20
+from test_framework.crypto.muhash import MuHash3072
+from test_framework.crypto.poly1305 import Poly1305
+from test_framework.key import (
+    ECKey,
+    compute_xonly_pubkey,
+    generate_privkey,
+    sign_schnorr,
+    verify_schnorr,
+    verify_schnorr_batch,
+)
+from test_framework.messages import (
+    CAddress,
+    CBlock,
+    CBlockHeader,
+    CInv,
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    HeaderAndShortIDs,
+    MSG_WITNESS_TX,
+    BlockTransactions,
+    BlockTransactionsRequest,
+    msg_block,
+    msg_cfcheckpt,
+    msg_cfheaders,
+    msg_cfilter,
+    msg_cmpctblock,
+    msg_filteradd,
+    msg_getcfcheckpt,
+    msg_getcfheaders,
+    msg_getcfilters,
+    msg_getdata,
+    msg_headers,
+    msg_inv,
+    msg_notfound,
+    msg_tx,
+    _CachedSerializable,
+)
+from test_framework.p2p import MESSAGEMAP
+from test_framework.script import (
+    CScript,
+    LegacySignatureHash,
+    OP_0,
+    OP_1,
+    SIGHASH_ALL,
+    SegwitV0SignatureHash,
+    SighashCache,
+    TaprootSignatureHash,
+    taproot_construct,
+    taproot_huffman_tree,
+)
+from test_framework.script_util import keyhash_to_p2pkh_script
+from test_framework.v2_p2p import EncryptedP2PState
+
+# Version of the JSON output format.
+RESULT_FORMAT_VERSION = 1
+# Block weight of the synthetic block (MAX_BLOCK_WEIGHT).
+BLOCK_WEIGHT = 4000000
+# Size of the buffers for the stream cipher, MAC and hash benchmarks.
+DATA_SIZE = 1 << 16
+# Size of the BIP324 packet contents for the v2 transport benchmarks.
+V2_PACKET_SIZE = 4 << 20
+# Constructor arguments for an empty message to deserialize into.
+EMPTY_MESSAGE_ARGS = {"filteradd": (b"",)}
+
+
+def make_tx(i, n_inputs=1, n_outputs=2):
+    """A P2WPKH-like transaction spending made-up outputs."""
+    tx = CTransaction()
+    for j in range(n_inputs):
+        tx.vin.append(CTxIn(COutPoint(i * n_inputs + j + 1, j)))
+        tx.wit.vtxinwit.append(CTxInWitness())
+        tx.wit.vtxinwit[-1].scriptWitness.stack = [bytes(72), bytes(33)]
+    for j in range(n_outputs):
+        tx.vout.append(CTxOut(1000 + j, CScript([OP_0, bytes(20)])))
+    return tx
+
+
+def make_block(weight):
+    """A block filled with transactions up to (roughly) the given weight."""
+    block = create_block(1, create_coinbase(1), 1600000000)
+    tx_weight = make_tx(0).get_weight()
+    block.vtx += [make_tx(i) for i in range(1, weight // tx_weight)]
+    add_witness_commitment(block)
+    return block
+
+
+def sample_messages(block):
+    """An instance of every P2P message type, with some content."""
+    compact = HeaderAndShortIDs()
+    compact.initialize_from_block(block, use_witness=True)
+    hashes = list(range(1, 2001))
+    invs = [CInv(MSG_WITNESS_TX, i) for i in range(1, 50001)]
+    # Messages that need constructor arguments.
+    messages = {
+        b"block": msg_block(block),
+        b"cfcheckpt": msg_cfcheckpt(0, block.hash_int, hashes[:1000]),
+        b"cfheaders": msg_cfheaders(0, block.hash_int, 0, hashes),
+        b"cfilter": msg_cfilter(0, block.hash_int, bytes(1000)),
+        b"cmpctblock": msg_cmpctblock(compact.to_p2p()),
+        b"filteradd": msg_filteradd(bytes(520)),
+        b"getcfcheckpt": msg_getcfcheckpt(0, block.hash_int),
+        b"getcfheaders": msg_getcfheaders(0, 0, block.hash_int),
+        b"getcfilters": msg_getcfilters(0, 0, block.hash_int),
+        b"getdata": msg_getdata(invs),
+        b"headers": msg_headers([CBlockHeader(block) for _ in range(2000)]),
+        b"inv": msg_inv(invs),
+        b"notfound": msg_notfound(invs),
+        b"tx": msg_tx(block.vtx[1]),
+    }
+    for msgtype, cls in MESSAGEMAP.items():
+        if msgtype not in messages:
+            messages[msgtype] = cls()
+    messages[b"addr"].addrs = [CAddress() for _ in range(1000)]
+    messages[b"addrv2"].addrs = [CAddress() for _ in range(1000)]
+    messages[b"getblocks"].locator.vHave = hashes[:101]
+    messages[b"getheaders"].locator.vHave = hashes[:101]
+    messages[b"getblocktxn"].block_txn_request = BlockTransactionsRequest(block.hash_int, list(range(0, len(block.vtx), 2)))
+    messages[b"blocktxn"].block_transactions = BlockTransactions(block.hash_int, block.vtx[::2])
+    assert messages.keys() == MESSAGEMAP.keys()
+    return {msgtype.decode(): messages[msgtype] for msgtype in MESSAGEMAP}
+
+
+def cached_objects(obj):
+    """Return every object with a serialization cache that is part of obj."""
+    found = []
+    seen = set()
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, (list, tuple)):
+            stack.extend(o)
+            continue
+        if id(o) in seen or not hasattr(type(o), "__slots__"):
+            continue
+        seen.add(id(o))
+        if isinstance(o, _CachedSerializable):
+            found.append(o)
+        for cls in type(o).__mro__:
+            stack.extend(getattr(o, name, None) for name in getattr(cls, "__slots__", ()) if not name.startswith("_"))
+    return found
+
+
+def uncached(func, obj):
+    """Wrap func to clear the serialization caches within obj before each call.
+
+    Messages cache their serialization, so without this a serialization
+    benchmark would only measure a cache lookup."""
+    objs = cached_objects(obj)
+
+    def run():
+        for o in objs:
+            o.reset_cache()
+        return func()
+    return run
+
+
+def deserializer(cls, args, data):
+    """Return a function that deserializes data into a new cls(*args)."""
+    def run():
+        cls(*args).deserialize(BytesIO(data))
+    return run
+
+
+def v2_state(initiating):
+    """Return a v2 transport state with the ciphers initialized from a fixed secret."""
+    state = EncryptedP2PState(initiating=initiating, net="regtest")
+    state.initialize_v2_transport(bytes(32))
+    return state
+
+
+def benchmarks(args):
+    """Yield (name, function, bytes processed per call or None)."""
+    weight = BLOCK_WEIGHT // (10 if args.quick else 1)
+    block = make_block(weight)
+    raw_block = block.serialize()
+
+    for msgtype, msg in sample_messages(block).items():
+        data = msg.serialize()
+
+        yield f"messages.serialize.{msgtype}", uncached(msg.serialize, msg), len(data)
+        yield f"messages.deserialize.{msgtype}", deserializer(type(msg), EMPTY_MESSAGE_ARGS.get(msgtype, ()), data), len(data)
+
+    txids = [tx.txid_int for tx in block.vtx]
+    yield "block.deserialize", lambda: CBlock().deserialize(BytesIO(raw_block)), len(raw_block)
+    yield "block.serialize", uncached(block.serialize, block), len(raw_block)
+    yield "block.txids", uncached(lambda: [tx.txid_int for tx in block.vtx], block), len(raw_block)
+    yield "block.sigops", lambda: get_legacy_sigopcount_block(block), None
+    yield "block.merkle_root", lambda: CBlock.get_merkle_root([txid.to_bytes(32, "little") for txid in txids]), None
+
+    msg = bytes(range(32))
+    key = ECKey()
+    key.generate()
+    pubkey = key.get_pubkey()
+    sig = key.sign_ecdsa(msg)
+    yield "key.ecdsa_sign", lambda: key.sign_ecdsa(msg), None
+    yield "key.ecdsa_verify", lambda: pubkey.verify_ecdsa(sig, msg), None
+    privkey = generate_privkey()
+    xonly, _ = compute_xonly_pubkey(privkey)
+    schnorr_sig = sign_schnorr(privkey, msg)
+    yield "key.schnorr_sign", lambda: sign_schnorr(privkey, msg), None
+    yield "key.schnorr_verify", lambda: verify_schnorr(xonly, schnorr_sig, msg), None
+    batch = []
+    for i in range(100):
+        batch_privkey = generate_privkey()
+        batch.append((compute_xonly_pubkey(batch_privkey)[0], sign_schnorr(batch_privkey, bytes([i]) * 32), bytes([i]) * 32))
+    yield "key.schnorr_verify_batch_100", lambda: verify_schnorr_batch(batch), None
+
+    # A transaction with many inputs, so that the cost of hashing the
+    # transaction for every input shows up.
+    tx = make_tx(0, n_inputs=100, n_outputs=100)
+    script = keyhash_to_p2pkh_script(bytes(20))
+    spent = [CTxOut(1000, CScript([OP_1, bytes(32)])) for _ in tx.vin]
+    yield "sighash.legacy", lambda: [LegacySignatureHash(script, tx, i, SIGHASH_ALL) for i in range(len(tx.vin))], None
+    yield "sighash.segwitv0", lambda: [SegwitV0SignatureHash(script, tx, i, SIGHASH_ALL, 1000) for i in range(len(tx.vin))], None
+    yield "sighash.taproot", lambda: [TaprootSignatureHash(tx, spent, SIGHASH_ALL, i) for i in range(len(tx.vin))], None
+
+    def legacy_cache():
+        cache = SighashCache(tx)
+        return [LegacySignatureHash(script, tx, i, SIGHASH_ALL, cache=cache) for i in range(len(tx.vin))]
+
+    def segwitv0_cache():
+        cache = SighashCache(tx)
+        return [SegwitV0SignatureHash(script, tx, i, SIGHASH_ALL, 1000, cache=cache) for i in range(len(tx.vin))]
+
+    def taproot_cache():
+        cache = SighashCache(tx, spent)
+        return [TaprootSignatureHash(tx, spent, SIGHASH_ALL, i, cache=cache) for i in range(len(tx.vin))]
+    yield "sighash.legacy_cache", legacy_cache, None
+    yield "sighash.segwitv0_cache", segwitv0_cache, None
+    yield "sighash.taproot_cache", taproot_cache, None
+
+    # Script trees with 1000 leaves, balanced and weighted by a Zipf distribution.
+    leaves = [(str(i), CScript([i])) for i in range(1000)]
+    huffman_tree = taproot_huffman_tree([(1 / (i + 1), leaf) for i, leaf in enumerate(leaves)])
+    yield "taproot.construct", lambda: taproot_construct(xonly, leaves), None
+    yield "taproot.construct_huffman", lambda: taproot_construct(xonly, huffman_tree), None
+
+    data = bytes(DATA_SIZE)
+    cipher = FSChaCha20(bytes(32))
+    yield "crypto.chacha20", lambda: cipher.crypt(data), len(data)
+    yield "crypto.poly1305", lambda: Poly1305(bytes(32)).tag(data), len(data)
+    yield "crypto.aead_chacha20_poly1305", lambda: aead_chacha20_poly1305_encrypt(bytes(32), bytes(12), b"", data), len(data)
+    elements = [i.to_bytes(32, "little") for i in range(100)]
+
+    def muhash_insert():
+        muhash = MuHash3072()
+        for element in elements:
+            muhash.insert(element)
+    yield "crypto.muhash_insert", muhash_insert, len(elements) * 32
+
+    contents = bytes(V2_PACKET_SIZE // (10 if args.quick else 1))
+    sender = v2_state(True)
+    packet = v2_state(True).v2_enc_packet(contents)
+
+    def receive_packet():
+        # A fresh receiver, so that every call decrypts the first packet.
+        length, received = v2_state(False).v2_receive_packet(packet)
+        assert length == len(packet) and received == contents
+    yield "v2.enc_packet", lambda: sender.v2_enc_packet(contents), len(contents)
+    yield "v2.receive_packet", receive_packet, len(contents)
+
+
+def measure(func, repeat):
+    """Return the best time per call of func and the number of calls per run."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number, number
+
+
+def compare(results, baseline):
+    """Print the change relative to the baseline and return the largest slowdown."""
+    worst = 0.0
+    print()
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["seconds"], result["seconds"]
+        change = (after / before - 1) * 100
+        worst = max(worst, change)
+        print(f"{name:<45} {before:>12.6g} {after:>12.6g} {change:>+7.1f}%")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name matches this regular expression")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing runs per benchmark; the best one is reported (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="use a block one tenth of the size, for a quick check that everything runs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare the results to a JSON file written with --output")
+    parser.add_argument("--max-regression", type=float, help="with --baseline, fail if a benchmark is more than this many percent slower")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)
+        if baseline.get("format") != RESULT_FORMAT_VERSION:
+            parser.error(f"{args.baseline} has an unsupported format")
+
+    pattern = re.compile(args.filter)
+    results = {}
+    for name, func, size in benchmarks(args):
+        if not pattern.search(name):
+            continue
+        seconds, number = measure(func, args.repeat)
+        results[name] = {"seconds": seconds, "number": number}
+        line = f"{name:<45} {seconds * 1e6:>14.1f} us"
+        if size is not None:
+            results[name]["bytes"] = size
+            line += f" {size / seconds / 1e6:>10.2f} MB/s"
+        print(line, flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump({
+                "format": RESULT_FORMAT_VERSION,
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "quick": args.quick,
+                "benchmarks": results,
+            }, f, indent=2)
+            f.write("\n")
+
+    if baseline is not None:
+        worst = compare(results, baseline["benchmarks"])
+        if args.max_regression is not None and worst > args.max_regression:
+            print(f"\nRegression of {worst:.1f}% exceeds the allowed {args.max_regression}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
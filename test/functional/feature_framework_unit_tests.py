@@ -16,17 +16,21 @@ from test_framework.test_framework import TEST_EXIT_PASSED, TEST_EXIT_FAILED
 # the output of `git grep unittest.TestCase ./test/functional/test_framework`
 TEST_FRAMEWORK_MODULES = [
     "address",
+    "blockfile",
+    "blockfilter",
     "crypto.bip324_cipher",
     "blocktools",
     "compressor",
     "crypto.chacha20",
     "crypto.ellswift",
+    "interpreter",
     "key",
     "messages",
     "crypto.muhash",
     "crypto.poly1305",
     "crypto.ripemd160",
     "crypto.secp256k1",
+    "crypto.siphash",
     "script",
     "script_util",
     "segwit_addr",
@@ -80,6 +80,7 @@ from test_framework.script import (
     SIGHASH_SINGLE,
     SIGHASH_ANYONECANPAY,
     SegwitV0SignatureMsg,
+    SighashCache,
     TaggedHash,
     TaprootSignatureMsg,
     is_op_success,
@@ -93,6 +94,10 @@ from test_framework.script_util import (
     script_to_p2sh_script,
     script_to_p2wsh_script,
 )
+from test_framework.interpreter import (
+    script_verify_flags,
+    verify_inputs,
+)
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import (
     assert_not_equal,
@@ -240,6 +245,7 @@ def default_sigmsg(ctx):
     idx = get(ctx, "idx")
     hashtype = get(ctx, "hashtype_actual")
     mode = get(ctx, "mode")
+    cache = get(ctx, "sighash_cache")
     if mode == "taproot":
         # BIP341 signature hash
         utxos = get(ctx, "utxos")
@@ -248,18 +254,18 @@ def default_sigmsg(ctx):
             codeseppos = get(ctx, "codeseppos")
             leaf_ver = get(ctx, "leafversion")
             script = get(ctx, "script_taproot")
-            return TaprootSignatureMsg(tx, utxos, hashtype, idx, scriptpath=True, leaf_script=script, leaf_ver=leaf_ver, codeseparator_pos=codeseppos, annex=annex)
+            return TaprootSignatureMsg(tx, utxos, hashtype, idx, scriptpath=True, leaf_script=script, leaf_ver=leaf_ver, codeseparator_pos=codeseppos, annex=annex, cache=cache)
         else:
-            return TaprootSignatureMsg(tx, utxos, hashtype, idx, scriptpath=False, annex=annex)
+            return TaprootSignatureMsg(tx, utxos, hashtype, idx, scriptpath=False, annex=annex, cache=cache)
     elif mode == "witv0":
         # BIP143 signature hash
         scriptcode = get(ctx, "scriptcode_suffix")
         utxos = get(ctx, "utxos")
-        return SegwitV0SignatureMsg(scriptcode, tx, idx, hashtype, utxos[idx].nValue)
+        return SegwitV0SignatureMsg(scriptcode, tx, idx, hashtype, utxos[idx].nValue, cache=cache)
     else:
         # Pre-segwit signature hash
         scriptcode = get(ctx, "scriptcode_suffix")
-        return LegacySignatureMsg(scriptcode, tx, idx, hashtype)[0]
+        return LegacySignatureMsg(scriptcode, tx, idx, hashtype, cache=cache)[0]
 
 def default_sighash(ctx):
     """Default expression for "sighash": depending on mode, compute tagged hash or dsha256 of sigmsg."""
@@ -445,6 +451,8 @@ DEFAULT_CONTEXT = {
     "inputs": [],
     # Use deterministic signing nonces
     "deterministic": False,
+    # The SighashCache for tx and utxos, shared by all inputs of tx (None to not use one).
+    "sighash_cache": None,
 
     # == Parameters to be set before evaluation: ==
     # - mode: what spending style to use ("taproot", "witv0", or "legacy").
@@ -576,12 +584,12 @@ def make_spender(comment, *, tap=None, witv0=False, script=None, pkh=None, p2sh=
 
     conf = {**conf, **kwargs}
 
-    def sat_fn(tx, idx, utxos, valid):
+    def sat_fn(tx, idx, utxos, valid, sighash_cache=None):
         if valid:
-            return spend(tx, idx, utxos, **conf)
+            return spend(tx, idx, utxos, sighash_cache=sighash_cache, **conf)
         else:
             assert failure is not None
-            return spend(tx, idx, utxos, **{**conf, **failure})
+            return spend(tx, idx, utxos, sighash_cache=sighash_cache, **{**conf, **failure})
 
     return Spender(script=spk, comment=comment, is_standard=standard, sat_function=sat_fn, err_msg=err_msg, sigops_weight=sigops_weight, no_fail=failure is None, need_vin_vout_mismatch=need_vin_vout_mismatch)
 
@@ -1604,12 +1612,14 @@ class TaprootTest(BitcoinTestFramework):
 
             # Precompute one satisfying and one failing scriptSig/witness for each input.
             input_data = []
+            spent_utxos = [utxo.output for utxo in input_utxos]
+            sighash_cache = SighashCache(tx, spent_utxos)
             for i in range(len(input_utxos)):
                 fn = input_utxos[i].spender.sat_function
                 fail = None
-                success = fn(tx, i, [utxo.output for utxo in input_utxos], True)
+                success = fn(tx, i, spent_utxos, True, sighash_cache)
                 if not input_utxos[i].spender.no_fail:
-                    fail = fn(tx, i, [utxo.output for utxo in input_utxos], False)
+                    fail = fn(tx, i, spent_utxos, False, sighash_cache)
                 input_data.append((fail, success))
                 if self.options.dump_tests:
                     dump_json_test(tx, input_utxos, i, success, fail)
@@ -1633,6 +1643,15 @@ class TaprootTest(BitcoinTestFramework):
                     and not (tx.version == 3 and tx.get_vsize() > TRUC_MAX_VSIZE)  # Topological standardness rules must be followed
                 )
                 msg = ','.join(utxo.spender.comment + ("*" if n == fail_input else "") for n, utxo in enumerate(input_utxos))
+                # Check the spends with the script interpreter first, so that a disagreement is
+                # reported for the offending input. The satisfying spends only need checking once.
+                if fail_input is None:
+                    errors = verify_inputs(tx, spent_utxos, script_verify_flags(TAPROOT_FLAGS))
+                    assert all(error is None for error in errors), "Valid spend rejected by the interpreter (%s): %s" % (errors, msg)
+                else:
+                    error, = verify_inputs(tx, spent_utxos, script_verify_flags(TAPROOT_FLAGS), [fail_input])
+                    assert error is not None, "Invalid spend accepted by the interpreter: " + msg
+                    assert expected_fail_msg is None or expected_fail_msg in error, "Missing error message '%s' from interpreter error '%s': %s" % (expected_fail_msg, error, msg)
                 if is_standard_tx:
                     node.sendrawtransaction(tx.serialize().hex(), 0)
                     assert node.getmempoolentry(tx.txid_hex) is not None, "Failed to accept into mempool: " + msg
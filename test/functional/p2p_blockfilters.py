@@ -8,6 +8,10 @@ Tests that a node configured with -blockfilterindex and -peerblockfilters signal
 NODE_COMPACT_FILTERS and can serve cfilters, cfheaders and cfcheckpts.
 """
 
+from test_framework.blockfilter import (
+    bip158_basic_filter,
+    bip158_relevant_scriptpubkeys,
+)
 from test_framework.messages import (
     FILTER_TYPE_BASIC,
     NODE_COMPACT_FILTERS,
@@ -176,6 +180,8 @@ class CompactFiltersTest(BitcoinTestFramework):
             assert_equal(cfilter.block_hash, int(block_hash, 16))
             computed_cfhash = uint256_from_str(hash256(cfilter.filter_data))
             assert_equal(computed_cfhash, cfhash)
+            spks = bip158_relevant_scriptpubkeys(self.nodes[0], block_hash)
+            assert_equal(cfilter.filter_data, bip158_basic_filter(spks, block_hash))
 
         self.log.info("Check that peers can fetch cfilters for stale blocks.")
         request = msg_getcfilters(
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Read the node's block (blk?????.dat) and undo (rev?????.dat) files.
+
+The files are memory-mapped, so only the parts that are actually read are
+loaded, and de-obfuscated (see -blocksxor) one record at a time."""
+from collections import namedtuple
+import mmap
+import os
+from pathlib import Path
+import tempfile
+import unittest
+
+from .blocktools import (
+    create_block,
+    create_coinbase,
+)
+from .messages import (
+    BLOCK_HEADER_SIZE,
+    CBlockHeader,
+    LazyBlock,
+    MAGIC_BYTES,
+    hash256,
+)
+from .util import util_xor
+
+# Every record starts with the network magic and the size of its data.
+RECORD_PREFIX_SIZE = 8
+# Undo records are followed by a checksum (hash of the block hash and the undo data).
+UNDO_CHECKSUM_SIZE = 32
+
+# A record of a block or undo file. offset is the position of the data (after
+# the magic and size), which is also the position stored in the block index.
+# header is the block header for block files and None for undo files.
+BlockFileRecord = namedtuple("BlockFileRecord", "offset magic size header")
+
+
+class BlockFile:
+    """A block or undo file of a node, mapped into memory.
+
+    xor_key is the key from the blocks directory's xor.dat (see
+    TestNode.read_xor_key()); pass None or an all-zero key for files that are
+    not obfuscated. Whether the file holds undo data is determined by its name."""
+
+    def __init__(self, path, xor_key=None):
+        self.path = Path(path)
+        self.undo = self.path.name.startswith("rev")
+        self.xor_key = xor_key if xor_key and any(xor_key) else None
+        with open(self.path, "rb") as f:
+            # Empty files cannot be mapped.
+            if os.fstat(f.fileno()).st_size == 0:
+                self._map = b""
+            else:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._map = b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._map)
+
+    def read(self, offset, size):
+        """Return size bytes of the file starting at offset, de-obfuscated."""
+        if offset < 0 or offset + size > len(self._map):
+            raise ValueError(f"read of {size} bytes at {offset} past the end of {self.path.name}")
+        data = self._map[offset:offset + size]
+        if self.xor_key is None:
+            return data
+        return util_xor(data, self.xor_key, offset=offset)
+
+    def records(self):
+        """Iterate over the records of the file, without reading their data.
+
+        Stops at the first record with a zero magic, which is where the
+        preallocated (zero-filled) part of the file starts."""
+        offset = 0
+        while offset + RECORD_PREFIX_SIZE <= len(self._map):
+            prefix = self.read(offset, RECORD_PREFIX_SIZE)
+            magic = prefix[:4]
+            if magic == bytes(4):
+                break
+            size = int.from_bytes(prefix[4:], "little")
+            offset += RECORD_PREFIX_SIZE
+            end = offset + size + (UNDO_CHECKSUM_SIZE if self.undo else 0)
+            if end > len(self._map):
+                raise ValueError(f"truncated record at {offset} in {self.path.name}")
+            header = None
+            if not self.undo:
+                header, _ = CBlockHeader.from_buffer(self.read(offset, BLOCK_HEADER_SIZE))
+            yield BlockFileRecord(offset, magic, size, header)
+            offset = end
+
+    def read_block(self, record):
+        """Return the block of a record (or at a data offset) as a LazyBlock.
+
+        The block holds a copy of its data, so it remains valid after the file
+        is closed."""
+        assert not self.undo
+        if not isinstance(record, BlockFileRecord):
+            prefix = self.read(record - RECORD_PREFIX_SIZE, RECORD_PREFIX_SIZE)
+            record = BlockFileRecord(record, prefix[:4], int.from_bytes(prefix[4:], "little"), None)
+        block, end = LazyBlock.from_buffer(self.read(record.offset, record.size))
+        if end != record.size:
+            raise ValueError(f"block at {record.offset} in {self.path.name} does not match its record size")
+        return block
+
+    def blocks(self):
+        """Iterate over the blocks of the file as LazyBlocks."""
+        for record in self.records():
+            yield self.read_block(record)
+
+
+def block_file_paths(blocks_path):
+    """Return the block files in a blocks directory, in order."""
+    return sorted(Path(blocks_path).glob("blk[0-9][0-9][0-9][0-9][0-9].dat"))
+
+
+def read_blocks(blocks_path, xor_key=None):
+    """Iterate over all blocks stored in a blocks directory, in file order.
+
+    Blocks are stored in the order they were received, which is not
+    necessarily the order of the chain."""
+    for path in block_file_paths(blocks_path):
+        with BlockFile(path, xor_key) as f:
+            yield from f.blocks()
+
+
+class TestFrameworkBlockFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.magic = MAGIC_BYTES["regtest"]
+
+    def write_file(self, name, records, xor_key, padding=0):
+        data = bytearray()
+        for payload, trailer in records:
+            data += self.magic + len(payload).to_bytes(4, "little") + payload + trailer
+        data += bytes(padding)
+        path = Path(self.tmpdir.name) / name
+        path.write_bytes(util_xor(data, xor_key, offset=0))
+        return path
+
+    def make_blocks(self, n):
+        blocks = []
+        prev = 1
+        for height in range(1, n + 1):
+            block = create_block(prev, create_coinbase(height), 1600000000 + height)
+            block.solve()
+            blocks.append(block)
+            prev = block.hash_int
+        return blocks
+
+    def test_util_xor(self):
+        data = bytes(range(20))
+        key = bytes.fromhex("0102030405060708")
+        for offset in range(10):
+            expected = bytes(b ^ key[(i + offset) % len(key)] for i, b in enumerate(data))
+            self.assertEqual(util_xor(data, key, offset=offset), expected)
+        self.assertEqual(util_xor(b"", key, offset=3), b"")
+
+    def test_block_file(self):
+        blocks = self.make_blocks(3)
+        for xor_key in (bytes(8), bytes.fromhex("a1b2c3d4e5f60718")):
+            path = self.write_file("blk00000.dat", [(b.serialize(), b"") for b in blocks], xor_key, padding=100)
+            with BlockFile(path, xor_key) as f:
+                records = list(f.records())
+                self.assertEqual([r.magic for r in records], [self.magic] * 3)
+                self.assertEqual([r.header.hash_hex for r in records], [b.hash_hex for b in blocks])
+                read = list(f.blocks())
+                self.assertEqual([b.serialize() for b in read], [b.serialize() for b in blocks])
+                # A block can also be read by its position in the block index.
+                self.assertEqual(f.read_block(records[1].offset).hash_hex, blocks[1].hash_hex)
+            self.assertEqual(read[2].vtx[0].txid_hex, blocks[2].vtx[0].txid_hex)
+            self.assertEqual([b.hash_hex for b in read_blocks(self.tmpdir.name, xor_key)], [b.hash_hex for b in blocks])
+
+    def test_undo_file(self):
+        xor_key = bytes.fromhex("0011223344556677")
+        undo = [(bytes([i]) * (i + 1), hash256(bytes([i]))) for i in range(4)]
+        path = self.write_file("rev00000.dat", undo, xor_key)
+        with BlockFile(path, xor_key) as f:
+            records = list(f.records())
+            self.assertEqual([(r.size, r.header) for r in records], [(i + 1, None) for i in range(4)])
+            self.assertEqual(f.read(records[3].offset, 4), bytes([3]) * 4)
+
+    def test_bad_files(self):
+        with BlockFile(self.write_file("blk00000.dat", [], bytes(8))) as f:
+            self.assertEqual(list(f.records()), [])
+        block = self.make_blocks(1)[0].serialize()
+        path = self.write_file("blk00001.dat", [(block[:-1], b"")], bytes(8))
+        path.write_bytes(path.read_bytes()[:-1])
+        with BlockFile(path) as f, self.assertRaises(ValueError):
+            list(f.records())
@@ -4,7 +4,13 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Helper routines relevant for compact block filters (BIP158).
 """
-from .crypto.siphash import siphash
+import unittest
+
+from .crypto.siphash import siphash, siphash_many
+from .messages import ser_compact_size
+
+# Golomb-Rice coding parameter of the basic filter type
+BASIC_FILTER_P = 19
 
 
 def bip158_basic_element_hash(script_pub_key, N, block_hash):
@@ -28,6 +34,37 @@ def bip158_basic_element_hash(script_pub_key, N, block_hash):
     return (siphash(k0, k1, script_pub_key) * (N * M)) >> 64
 
 
+def bip158_basic_element_hashes(script_pub_keys, N, block_hash):
+    """ Calculates the ranged hashes of many filter elements at once (see bip158_basic_element_hash).
+    """
+    M = 784931
+    block_hash_bytes = bytes.fromhex(block_hash)[::-1]
+    k0 = int.from_bytes(block_hash_bytes[0:8], 'little')
+    k1 = int.from_bytes(block_hash_bytes[8:16], 'little')
+    return [(h * (N * M)) >> 64 for h in siphash_many(k0, k1, list(script_pub_keys))]
+
+
+def bip158_basic_filter(script_pub_keys, block_hash):
+    """ Constructs the serialized basic filter of a block from its relevant scriptPubKeys
+    (see bip158_relevant_scriptpubkeys) as defined in BIP158:
+
+    'The sorted list of hashed values is then encoded into a compact bit stream using
+    Golomb-Rice coding. [...] The serialized filter is the number of items N encoded as a
+    CompactSize followed by the bit stream, padded with zeros to the next byte boundary.'
+    """
+    script_pub_keys = list(script_pub_keys)
+    N = len(script_pub_keys)
+    bits = []
+    last = 0
+    for value in sorted(bip158_basic_element_hashes(script_pub_keys, N, block_hash)):
+        delta = value - last
+        last = value
+        bits.append("1" * (delta >> BASIC_FILTER_P) + "0" + format(delta & ((1 << BASIC_FILTER_P) - 1), f"0{BASIC_FILTER_P}b"))
+    stream = "".join(bits)
+    stream += "0" * (-len(stream) % 8)
+    return ser_compact_size(N) + (int(stream, 2).to_bytes(len(stream) // 8, 'big') if stream else b"")
+
+
 def bip158_relevant_scriptpubkeys(node, block_hash):
     """ Determines the basic filter relevant scriptPubKeys as defined in BIP158:
 
@@ -47,3 +84,20 @@ def bip158_relevant_scriptpubkeys(node, block_hash):
             if o['scriptPubKey']['type'] != 'nulldata':
                 spks.add(bytes.fromhex(o['scriptPubKey']['hex']))
     return spks
+
+
+class TestFrameworkBlockFilter(unittest.TestCase):
+    def test_element_hashes(self):
+        block_hash = "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943"
+        spks = [bytes(range(length)) for length in range(60)] + [bytes([i]) * 22 for i in range(100)]
+        N = len(spks)
+        self.assertEqual(bip158_basic_element_hashes(spks, N, block_hash),
+                         [bip158_basic_element_hash(spk, N, block_hash) for spk in spks])
+
+    def test_basic_filter(self):
+        # Genesis block of testnet3, from src/test/data/blockfilters.json
+        block_hash = "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943"
+        coinbase_spk = bytes.fromhex("4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6"
+                                     "bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac")
+        self.assertEqual(bip158_basic_filter([coinbase_spk], block_hash).hex(), "019dfca8")
+        self.assertEqual(bip158_basic_filter([], block_hash), b"\x00")
@@ -5,7 +5,8 @@
 
 """Test-only implementation of ChaCha20 Poly1305 AEAD Construction in RFC 8439 and FSChaCha20Poly1305 for BIP 324
 
-It is designed for ease of understanding, not performance.
+The keystream is computed with chacha20_keystream and XORed as integers, and the tag
+over the padded AAD and ciphertext is computed without concatenating them.
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
@@ -13,33 +14,29 @@ anything but tests.
 
 import unittest
 
-from .chacha20 import chacha20_block, REKEY_INTERVAL
+from .chacha20 import chacha20_block, chacha20_keystream, REKEY_INTERVAL
 from .poly1305 import Poly1305
 
 
-def pad16(x):
-    if len(x) % 16 == 0:
-        return b''
-    return b'\x00' * (16 - (len(x) % 16))
+def _aead_keystream(key, nonce, msg_len):
+    """Return the Poly1305 key and the keystream for a message of msg_len bytes."""
+    keystream = chacha20_keystream(key, nonce, 0, 1 + (msg_len + 63) // 64)
+    return keystream[:32], keystream[64:64 + msg_len]
+
+
+def _xor(data, keystream):
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(keystream, 'little')).to_bytes(len(data), 'little')
 
 
 def aead_chacha20_poly1305_encrypt(key, nonce, aad, plaintext):
     """Encrypt a plaintext using ChaCha20Poly1305."""
     if plaintext is None:
         return None
-    ret = bytearray()
     msg_len = len(plaintext)
-    for i in range((msg_len + 63) // 64):
-        now = min(64, msg_len - 64 * i)
-        keystream = chacha20_block(key, nonce, i + 1)
-        for j in range(now):
-            ret.append(plaintext[j + 64 * i] ^ keystream[j])
-    poly1305 = Poly1305(chacha20_block(key, nonce, 0)[:32])
-    mac_data = aad + pad16(aad)
-    mac_data += ret + pad16(ret)
-    mac_data += len(aad).to_bytes(8, 'little') + msg_len.to_bytes(8, 'little')
-    ret += poly1305.tag(mac_data)
-    return bytes(ret)
+    poly1305_key, keystream = _aead_keystream(key, nonce, msg_len)
+    ret = _xor(plaintext, keystream)
+    lengths = len(aad).to_bytes(8, 'little') + msg_len.to_bytes(8, 'little')
+    return ret + Poly1305(poly1305_key).tag_padded(aad, ret, lengths)
 
 
 def aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext):
@@ -47,19 +44,13 @@ def aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext):
     if ciphertext is None or len(ciphertext) < 16:
         return None
     msg_len = len(ciphertext) - 16
-    poly1305 = Poly1305(chacha20_block(key, nonce, 0)[:32])
-    mac_data = aad + pad16(aad)
-    mac_data += ciphertext[:-16] + pad16(ciphertext[:-16])
-    mac_data += len(aad).to_bytes(8, 'little') + msg_len.to_bytes(8, 'little')
-    if ciphertext[-16:] != poly1305.tag(mac_data):
+    poly1305_key, keystream = _aead_keystream(key, nonce, msg_len)
+    # Authenticate the ciphertext without copying it.
+    ciphertext = memoryview(ciphertext)
+    lengths = len(aad).to_bytes(8, 'little') + msg_len.to_bytes(8, 'little')
+    if ciphertext[-16:] != Poly1305(poly1305_key).tag_padded(aad, ciphertext[:-16], lengths):
         return None
-    ret = bytearray()
-    for i in range((msg_len + 63) // 64):
-        now = min(64, msg_len - 64 * i)
-        keystream = chacha20_block(key, nonce, i + 1)
-        for j in range(now):
-            ret.append(ciphertext[j + 64 * i] ^ keystream[j])
-    return bytes(ret)
+    return _xor(ciphertext[:-16], keystream)
 
 
 class FSChaCha20Poly1305:
@@ -77,7 +68,8 @@ class FSChaCha20Poly1305:
             ret = aead_chacha20_poly1305_encrypt(self._key, nonce, aad, text)
         if (self._packet_counter + 1) % REKEY_INTERVAL == 0:
             rekey_nonce = b"\xFF\xFF\xFF\xFF" + nonce[4:]
-            self._key = aead_chacha20_poly1305_encrypt(self._key, rekey_nonce, b"", b"\x00" * 32)[:32]
+            # The new key is the encryption of 32 zero bytes, i.e. the start of the keystream.
+            self._key = chacha20_block(self._key, rekey_nonce, 1)[:32]
         self._packet_counter += 1
         return ret
 
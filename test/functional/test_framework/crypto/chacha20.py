@@ -5,12 +5,14 @@
 
 """Test-only implementation of ChaCha20 cipher and FSChaCha20 for BIP 324
 
-It is designed for ease of understanding, not performance.
+chacha20_block is designed for ease of understanding, not performance. For longer keystreams,
+chacha20_keystream computes many blocks at once (see its docstring).
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
 """
 
+from functools import lru_cache
 import unittest
 
 CHACHA20_INDICES = (
@@ -20,6 +22,8 @@ CHACHA20_INDICES = (
 
 CHACHA20_CONSTANTS = (0x61707865, 0x3320646e, 0x79622d32, 0x6b206574)
 REKEY_INTERVAL = 224 # packets
+# Maximum number of blocks chacha20_keystream computes in parallel.
+CHACHA20_MAX_LANES = 1024
 
 
 def rotl32(v, bits):
@@ -63,6 +67,68 @@ def chacha20_block(key, nonce, cnt):
     # Produce byte output
     return b''.join(state[i].to_bytes(4, 'little') for i in range(16))
 
+@lru_cache(maxsize=8)
+def _lane_constants(n):
+    """Return the constants for n 64-bit lanes: a 32-bit mask, a 1 and the lane index in every lane."""
+    mask = int.from_bytes(b'\xff\xff\xff\xff\x00\x00\x00\x00' * n, 'little')
+    ones = int.from_bytes(b'\x01\x00\x00\x00\x00\x00\x00\x00' * n, 'little')
+    indices = int.from_bytes(b''.join(i.to_bytes(8, 'little') for i in range(n)), 'little')
+    return mask, ones, indices
+
+
+def _chacha20_blocks(key, nonce, cnt, n):
+    """Compute n consecutive ChaCha20 blocks in parallel, starting at counter cnt.
+
+    Every state word is a single Python integer holding that word for all n blocks in
+    separate 64-bit lanes. The additions, XORs and rotations of the double rounds then
+    operate on all blocks at once; the spare upper 32 bits of each lane absorb carries
+    and rotated-out bits, which are masked off again."""
+    mask, ones, indices = _lane_constants(n)
+    init = [0] * 16
+    init[:4] = [c * ones for c in CHACHA20_CONSTANTS]
+    init[4:12] = [int.from_bytes(key[i:i+4], 'little') * ones for i in range(0, 32, 4)]
+    init[12] = cnt * ones + indices
+    init[13:16] = [int.from_bytes(nonce[i:i+4], 'little') * ones for i in range(0, 12, 4)]
+    s = list(init)
+    for _ in range(10):
+        for a, b, c, d in CHACHA20_INDICES:
+            s[a] = (s[a] + s[b]) & mask
+            t = s[d] ^ s[a]
+            s[d] = ((t << 16) | (t >> 16)) & mask
+            s[c] = (s[c] + s[d]) & mask
+            t = s[b] ^ s[c]
+            s[b] = ((t << 12) | (t >> 20)) & mask
+            s[a] = (s[a] + s[b]) & mask
+            t = s[d] ^ s[a]
+            s[d] = ((t << 8) | (t >> 24)) & mask
+            s[c] = (s[c] + s[d]) & mask
+            t = s[b] ^ s[c]
+            s[b] = ((t << 7) | (t >> 25)) & mask
+    # Add the initial values back, and interleave the words of all blocks into the output:
+    # byte j of word i of block k is at offset 64*k + 4*i + j.
+    out = bytearray(64 * n)
+    for i in range(16):
+        word = (((s[i] + init[i]) & mask)).to_bytes(8 * n, 'little')
+        for j in range(4):
+            out[4 * i + j::64] = word[j::8]
+    return bytes(out)
+
+
+def chacha20_keystream(key, nonce, cnt, nblocks):
+    """Compute nblocks consecutive ChaCha20 blocks (64 bytes each), starting at counter cnt.
+
+    Equivalent to concatenating chacha20_block(key, nonce, cnt + i) for i in range(nblocks), but
+    much faster for more than a few blocks."""
+    assert cnt + nblocks <= 2**32
+    out = []
+    while nblocks > 0:
+        n = min(nblocks, CHACHA20_MAX_LANES)
+        out.append(_chacha20_blocks(key, nonce, cnt, n))
+        cnt += n
+        nblocks -= n
+    return b''.join(out)
+
+
 class FSChaCha20:
     """Rekeying wrapper stream cipher around ChaCha20."""
     def __init__(self, initial_key, rekey_interval=REKEY_INTERVAL):
@@ -73,17 +139,18 @@ class FSChaCha20:
         self._keystream = b''
 
     def _get_keystream_bytes(self, nbytes):
-        while len(self._keystream) < nbytes:
+        if len(self._keystream) < nbytes:
             nonce = ((0).to_bytes(4, 'little') + (self._chunk_counter // self._rekey_interval).to_bytes(8, 'little'))
-            self._keystream += chacha20_block(self._key, nonce, self._block_counter)
-            self._block_counter += 1
+            nblocks = (nbytes - len(self._keystream) + 63) // 64
+            self._keystream += chacha20_keystream(self._key, nonce, self._block_counter, nblocks)
+            self._block_counter += nblocks
         ret = self._keystream[:nbytes]
         self._keystream = self._keystream[nbytes:]
         return ret
 
     def crypt(self, chunk):
         ks = self._get_keystream_bytes(len(chunk))
-        ret = bytes([ks[i] ^ chunk[i] for i in range(len(chunk))])
+        ret = (int.from_bytes(ks, 'little') ^ int.from_bytes(chunk, 'little')).to_bytes(len(chunk), 'little')
         if ((self._chunk_counter + 1) % self._rekey_interval) == 0:
             self._key = self._get_keystream_bytes(32)
             self._block_counter = 0
@@ -148,6 +215,21 @@ class TestFrameworkChacha(unittest.TestCase):
             keystream = chacha20_block(key, nonce_bytes, counter)
             self.assertEqual(hex_output, keystream.hex())
 
+    def test_chacha20_keystream(self):
+        """chacha20_keystream matches chacha20_block."""
+        for hex_key, nonce, counter, _ in CHACHA20_TESTS:
+            key = bytes.fromhex(hex_key)
+            nonce_bytes = nonce[0].to_bytes(4, 'little') + nonce[1].to_bytes(8, 'little')
+            for nblocks in (0, 1, 2, 7):
+                expected = b''.join(chacha20_block(key, nonce_bytes, counter + i) for i in range(nblocks))
+                self.assertEqual(chacha20_keystream(key, nonce_bytes, counter, nblocks), expected)
+        # Across the lane limit, and up to the maximum counter.
+        key = bytes(range(32))
+        nblocks = CHACHA20_MAX_LANES + 3
+        keystream = chacha20_keystream(key, bytes(12), 2**32 - nblocks, nblocks)
+        for i in (0, CHACHA20_MAX_LANES - 1, CHACHA20_MAX_LANES, nblocks - 1):
+            self.assertEqual(keystream[64 * i:64 * (i + 1)], chacha20_block(key, bytes(12), 2**32 - nblocks + i))
+
     def test_fschacha20(self):
         """FSChaCha20 test vectors."""
         for test_vector in FSCHACHA20_TESTS:
@@ -0,0 +1,196 @@
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Bindings for a shared libsecp256k1 library, using ctypes.
+
+The test framework can use these instead of the much slower pure-Python
+implementation in key.py (see key.load_libsecp256k1). The library is not
+built by default: bitcoind links libsecp256k1 statically. A shared library
+can be built with
+
+    cmake -B build-secp256k1 src/secp256k1 -DBUILD_SHARED_LIBS=ON
+    cmake --build build-secp256k1
+
+and passed in the LIBSECP256K1 environment variable. The library needs the
+extrakeys and schnorrsig modules, which are enabled by default.
+"""
+
+import ctypes
+import os
+from pathlib import Path
+
+# From secp256k1.h
+SECP256K1_CONTEXT_NONE = 1
+SECP256K1_EC_COMPRESSED = 258
+SECP256K1_EC_UNCOMPRESSED = 2
+# From secp256k1_schnorrsig.h
+SECP256K1_SCHNORRSIG_EXTRAPARAMS_MAGIC = bytes([0xda, 0x6f, 0xb3, 0x8c])
+
+# Library file names and the directories of a build directory they can be in.
+LIBRARY_NAMES = ("libsecp256k1.so", "libsecp256k1.dylib", "libsecp256k1.dll", "secp256k1.dll")
+LIBRARY_DIRS = ("lib", "src/secp256k1/lib", "src/secp256k1/src", "src/secp256k1/bin", "bin")
+
+
+# secp256k1_nonce_function: (nonce32, msg32, key32, algo16, data, attempt) -> int
+_NonceFunction = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p,
+                                  ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint)
+
+
+@_NonceFunction
+def _use_given_nonce(nonce32, _msg32, _key32, _algo16, data, attempt):
+    """Nonce function that returns the 32-byte nonce passed as data."""
+    if attempt:
+        # The nonce did not give a valid signature; there is no other to try.
+        return 0
+    ctypes.memmove(nonce32, data, 32)
+    return 1
+
+
+class _ExtraParams(ctypes.Structure):
+    _fields_ = [
+        ("magic", ctypes.c_ubyte * 4),
+        ("noncefp", ctypes.c_void_p),
+        ("ndata", ctypes.c_void_p),
+    ]
+
+
+def find_library(builddir=None):
+    """Return the path of a shared libsecp256k1, or None if there is none.
+
+    The LIBSECP256K1 environment variable takes precedence over a library
+    in the build directory."""
+    if "LIBSECP256K1" in os.environ:
+        return os.environ["LIBSECP256K1"] or None
+    if builddir is None:
+        return None
+    for directory in LIBRARY_DIRS:
+        for name in LIBRARY_NAMES:
+            path = Path(builddir) / directory / name
+            if path.exists():
+                return str(path)
+    return None
+
+
+class LibSecp256k1:
+    """A loaded libsecp256k1 library with a signing and verification context.
+
+    All arguments must be valid (e.g. secret keys in range, 32-byte message
+    hashes for ECDSA): an invalid argument makes the library abort the process.
+    key.py checks them before calling these methods."""
+
+    def __init__(self, path):
+        lib = ctypes.cdll.LoadLibrary(path)
+        lib.secp256k1_context_create.restype = ctypes.c_void_p
+        lib.secp256k1_context_create.argtypes = [ctypes.c_uint]
+        # All other functions used here take the context as first argument and
+        # return an int.
+        for name in (
+            "secp256k1_ec_pubkey_create",
+            "secp256k1_ec_pubkey_parse",
+            "secp256k1_ec_pubkey_serialize",
+            "secp256k1_ecdsa_sign",
+            "secp256k1_ecdsa_signature_normalize",
+            "secp256k1_ecdsa_signature_parse_compact",
+            "secp256k1_ecdsa_signature_serialize_der",
+            "secp256k1_ecdsa_verify",
+            "secp256k1_keypair_create",
+            "secp256k1_keypair_xonly_pub",
+            "secp256k1_schnorrsig_sign_custom",
+            "secp256k1_schnorrsig_verify",
+            "secp256k1_xonly_pubkey_from_pubkey",
+            "secp256k1_xonly_pubkey_parse",
+            "secp256k1_xonly_pubkey_serialize",
+            "secp256k1_xonly_pubkey_tweak_add",
+        ):
+            func = getattr(lib, name)
+            func.restype = ctypes.c_int
+            func.argtypes = None
+        self.lib = lib
+        self.ctx = ctypes.c_void_p(lib.secp256k1_context_create(SECP256K1_CONTEXT_NONE))
+        self.path = path
+
+    def pubkey_create(self, seckey, compressed):
+        """Return the serialized public key of a secret key."""
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_create(self.ctx, pubkey, seckey):
+            raise RuntimeError("secp256k1_ec_pubkey_create failed")
+        return self._serialize_pubkey(pubkey, compressed)
+
+    def _serialize_pubkey(self, pubkey, compressed):
+        out = ctypes.create_string_buffer(65)
+        outlen = ctypes.c_size_t(65)
+        flags = SECP256K1_EC_COMPRESSED if compressed else SECP256K1_EC_UNCOMPRESSED
+        self.lib.secp256k1_ec_pubkey_serialize(self.ctx, out, ctypes.byref(outlen), pubkey, flags)
+        return out.raw[:outlen.value]
+
+    def ecdsa_sign(self, seckey, msghash, nonce):
+        """Create a low-S DER-encoded ECDSA signature with the given 32-byte nonce."""
+        sig = ctypes.create_string_buffer(64)
+        nonce_buf = ctypes.create_string_buffer(nonce, 32)
+        if not self.lib.secp256k1_ecdsa_sign(self.ctx, sig, msghash, seckey, _use_given_nonce, nonce_buf):
+            raise RuntimeError("secp256k1_ecdsa_sign failed")
+        out = ctypes.create_string_buffer(72)
+        outlen = ctypes.c_size_t(72)
+        self.lib.secp256k1_ecdsa_signature_serialize_der(self.ctx, out, ctypes.byref(outlen), sig)
+        return out.raw[:outlen.value]
+
+    def ecdsa_verify(self, pubkey, r, s, msghash):
+        """Verify an ECDSA signature given by its (in range) r and s values.
+
+        High-S signatures are accepted too."""
+        pk = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_parse(self.ctx, pk, pubkey, ctypes.c_size_t(len(pubkey))):
+            return False
+        sig = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ecdsa_signature_parse_compact(self.ctx, sig, r.to_bytes(32, 'big') + s.to_bytes(32, 'big')):
+            return False
+        self.lib.secp256k1_ecdsa_signature_normalize(self.ctx, sig, sig)
+        return self.lib.secp256k1_ecdsa_verify(self.ctx, sig, msghash, pk) == 1
+
+    def _keypair(self, seckey):
+        keypair = ctypes.create_string_buffer(96)
+        if not self.lib.secp256k1_keypair_create(self.ctx, keypair, seckey):
+            raise RuntimeError("secp256k1_keypair_create failed")
+        return keypair
+
+    def xonly_pubkey(self, seckey):
+        """Return the x-only public key of a secret key and whether its Y coordinate is odd."""
+        xonly = ctypes.create_string_buffer(64)
+        parity = ctypes.c_int()
+        self.lib.secp256k1_keypair_xonly_pub(self.ctx, xonly, ctypes.byref(parity), self._keypair(seckey))
+        return self._serialize_xonly(xonly), parity.value == 1
+
+    def _serialize_xonly(self, xonly):
+        out = ctypes.create_string_buffer(32)
+        self.lib.secp256k1_xonly_pubkey_serialize(self.ctx, out, xonly)
+        return out.raw
+
+    def xonly_tweak_add(self, key, tweak):
+        """Tweak an x-only public key (see key.tweak_add_pubkey); None if that fails."""
+        xonly = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_xonly_pubkey_parse(self.ctx, xonly, key):
+            return None
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_xonly_pubkey_tweak_add(self.ctx, pubkey, xonly, tweak):
+            return None
+        parity = ctypes.c_int()
+        self.lib.secp256k1_xonly_pubkey_from_pubkey(self.ctx, xonly, ctypes.byref(parity), pubkey)
+        return self._serialize_xonly(xonly), parity.value == 1
+
+    def schnorr_sign(self, seckey, msg, aux):
+        """Create a BIP340 signature of a message of any length."""
+        params = _ExtraParams()
+        params.magic[:] = SECP256K1_SCHNORRSIG_EXTRAPARAMS_MAGIC
+        aux_buf = ctypes.create_string_buffer(aux, 32)
+        params.ndata = ctypes.cast(aux_buf, ctypes.c_void_p)
+        sig = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_schnorrsig_sign_custom(self.ctx, sig, msg, ctypes.c_size_t(len(msg)), self._keypair(seckey), ctypes.byref(params)):
+            raise RuntimeError("secp256k1_schnorrsig_sign_custom failed")
+        return sig.raw
+
+    def schnorr_verify(self, key, sig, msg):
+        """Verify a BIP340 signature."""
+        xonly = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_xonly_pubkey_parse(self.ctx, xonly, key):
+            return False
+        return self.lib.secp256k1_schnorrsig_verify(self.ctx, sig, msg, ctypes.c_size_t(len(msg)), xonly) == 1
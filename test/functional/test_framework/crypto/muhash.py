@@ -6,14 +6,11 @@
 import hashlib
 import unittest
 
-from .chacha20 import chacha20_block
+from .chacha20 import chacha20_keystream
 
 def data_to_num3072(data):
     """Hash a 32-byte array data to a 3072-bit number using 6 Chacha20 operations."""
-    bytes384 = b""
-    for counter in range(6):
-        bytes384 += chacha20_block(data, bytes(12), counter)
-    return int.from_bytes(bytes384, 'little')
+    return int.from_bytes(chacha20_keystream(data, bytes(12), 0, 6), 'little')
 
 class MuHash3072:
     """Class representing the MuHash3072 computation of a set.
@@ -38,6 +35,12 @@ class MuHash3072:
         data_hash = hashlib.sha256(data).digest()
         self.denominator = (self.denominator * data_to_num3072(data_hash)) % self.MODULUS
 
+    def __imul__(self, other):
+        """Combine with the set of another MuHash3072 computation (like operator*= in C++)."""
+        self.numerator = (self.numerator * other.numerator) % self.MODULUS
+        self.denominator = (self.denominator * other.denominator) % self.MODULUS
+        return self
+
     def digest(self):
         """Extract the final hash. Does not modify this object."""
         val = (self.numerator * pow(self.denominator, -1, self.MODULUS)) % self.MODULUS
@@ -53,3 +56,18 @@ class TestFrameworkMuhash(unittest.TestCase):
         finalized = muhash.digest()
         # This mirrors the result in the C++ MuHash3072 unit test
         self.assertEqual(finalized[::-1].hex(), "10d312b100cbd32ada024a6646e40d3482fcff103668d2625f10002a607d5863")
+
+    def test_muhash_combine(self):
+        elements = [bytes([i]) * 32 for i in range(5)]
+        muhash = MuHash3072()
+        for element in elements[:4]:
+            muhash.insert(element)
+        muhash.remove(elements[4])
+        partials = [MuHash3072(), MuHash3072()]
+        for i, element in enumerate(elements[:4]):
+            partials[i % 2].insert(element)
+        partials[1].remove(elements[4])
+        combined = MuHash3072()
+        for partial in partials:
+            combined *= partial
+        self.assertEqual(combined.digest(), muhash.digest())
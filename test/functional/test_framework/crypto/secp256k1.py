@@ -4,7 +4,9 @@
 
 """Test-only implementation of low-level secp256k1 field and group arithmetic
 
-It is designed for ease of understanding, not performance.
+It is designed for ease of understanding rather than performance, although scalar
+multiplication uses Jacobian coordinates and wNAF internally to keep signing and verification in
+tests reasonably fast.
 
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
@@ -13,8 +15,13 @@ Exports:
 * FE: class for secp256k1 field elements
 * GE: class for secp256k1 group elements
 * G: the secp256k1 generator point
+* H: the BIP341 NUMS point
 """
 
+import functools
+import os
+import random
+import tempfile
 import unittest
 from hashlib import sha256
 from test_framework.util import assert_not_equal
@@ -151,6 +158,166 @@ class FE:
         return f"FE(0x{int(self):x})"
 
 
+# Internally, scalar multiplication works on plain integers modulo FE.SIZE
+# instead of FE objects. Intermediate points use Jacobian coordinates: the tuple
+# (X, Y, Z) represents the affine point (X/Z^2, Y/Z^3), and Z = 0 is infinity.
+# This avoids the field inversion of every affine addition; only the final
+# result is converted back (see GE.mul). Points in affine form are (x, y)
+# tuples, or None for infinity.
+
+_P = FE.SIZE
+_INFINITY = (0, 1, 0)
+
+
+def _jacobian_double(p):
+    """Double a point in Jacobian coordinates."""
+    x, y, z = p
+    if z == 0 or y == 0:
+        return _INFINITY
+    yy = y * y % _P
+    s = 4 * x * yy % _P
+    m = 3 * x * x % _P
+    x3 = (m * m - 2 * s) % _P
+    return (x3, (m * (s - x3) - 8 * yy * yy) % _P, 2 * y * z % _P)
+
+
+def _jacobian_add_affine(p, q):
+    """Add a point in Jacobian coordinates and a (non-infinite) affine point."""
+    x1, y1, z1 = p
+    x2, y2 = q
+    if z1 == 0:
+        return (x2, y2, 1)
+    zz = z1 * z1 % _P
+    h = (x2 * zz - x1) % _P
+    r = (y2 * zz * z1 - y1) % _P
+    if h == 0:
+        return _jacobian_double(p) if r == 0 else _INFINITY
+    hh = h * h % _P
+    hhh = h * hh % _P
+    v = x1 * hh % _P
+    x3 = (r * r - hhh - 2 * v) % _P
+    return (x3, (r * (v - x3) - y1 * hhh) % _P, z1 * h % _P)
+
+
+def _jacobian_add(p, q):
+    """Add two points in Jacobian coordinates."""
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    if z1 == 0:
+        return q
+    if z2 == 0:
+        return p
+    z1z1 = z1 * z1 % _P
+    z2z2 = z2 * z2 % _P
+    u1 = x1 * z2z2 % _P
+    s1 = y1 * z2 * z2z2 % _P
+    h = (x2 * z1z1 - u1) % _P
+    r = (y2 * z1 * z1z1 - s1) % _P
+    if h == 0:
+        return _jacobian_double(p) if r == 0 else _INFINITY
+    hh = h * h % _P
+    hhh = h * hh % _P
+    v = u1 * hh % _P
+    x3 = (r * r - hhh - 2 * v) % _P
+    return (x3, (r * (v - x3) - s1 * hhh) % _P, z1 * z2 * h % _P)
+
+
+def _to_affine(p):
+    """Convert a point in Jacobian coordinates to affine coordinates."""
+    x, y, z = p
+    if z == 0:
+        return None
+    zinv = pow(z, -1, _P)
+    zinv2 = zinv * zinv % _P
+    return (x * zinv2 % _P, y * zinv2 * zinv % _P)
+
+
+def _batch_to_affine(points):
+    """Convert a list of points in Jacobian coordinates to affine coordinates.
+
+    Uses a single field inversion for all of them (Montgomery's trick)."""
+    # prefix[i] is the product of the (non-zero) Z coordinates of points[:i].
+    prefix = [1]
+    for _, _, z in points:
+        prefix.append(prefix[-1] * z % _P if z else prefix[-1])
+    inv = pow(prefix[-1], -1, _P)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        if z == 0:
+            continue
+        zinv = inv * prefix[i] % _P
+        inv = inv * z % _P
+        zinv2 = zinv * zinv % _P
+        result[i] = (x * zinv2 % _P, y * zinv2 * zinv % _P)
+    return result
+
+
+def _wnaf(a, w):
+    """Compute the width-w non-adjacent form of a non-negative integer.
+
+    Returns the digits from least to most significant. Every non-zero digit is
+    odd with absolute value below 2^(w-1), and is followed by at least w-1 zeros."""
+    digits = []
+    while a:
+        # Skip over all trailing zero bits at once.
+        zeros = (a & -a).bit_length() - 1
+        digits += [0] * zeros
+        a >>= zeros
+        d = a & ((1 << w) - 1)
+        if d >= 1 << (w - 1):
+            d -= 1 << w
+        digits.append(d)
+        a = (a - d) >> 1
+    return digits
+
+
+def _odd_multiples(points, w):
+    """Return the tables of odd multiples [p, 3p, 5p, ..., (2^(w-1)-1)p] of affine points.
+
+    For every point, returns the table and the table of the negated multiples.
+    All tables are converted to affine coordinates with a single inversion."""
+    n = 1 << (w - 2)
+    multiples = []
+    for x, y in points:
+        twice = _jacobian_double((x, y, 1))
+        multiples.append((x, y, 1))
+        for _ in range(n - 1):
+            multiples.append(_jacobian_add(multiples[-1], twice))
+    affine = _batch_to_affine(multiples)
+    tables = []
+    for i in range(0, len(affine), n):
+        table = affine[i:i + n]
+        tables.append((table, [(x, _P - y) for x, y in table]))
+    return tables
+
+
+# Number of recent lift_x results to remember. Tests parse the same few public
+# keys over and over, and every lift_x needs a square root (an exponentiation).
+LIFT_X_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=LIFT_X_CACHE_SIZE)
+def _lift_x(x):
+    """Return the affine point with x coordinate x (an integer below FE.SIZE) and even y, or None.
+
+    The results are immutable tuples, so they can be shared between callers;
+    GE._from_affine creates a new group element for every call."""
+    y = pow(x * x * x + 7, (_P + 1) // 4, _P)
+    if y * y % _P != (x * x * x + 7) % _P:
+        return None
+    if y & 1:
+        y = _P - y
+    return (x, y)
+
+
+# Window size for the wNAF of points that are only used for a single
+# multiplication (the table of odd multiples costs about 2^(w-2) additions).
+WNAF_WINDOW = 5
+# Window size for G, whose table is computed once and then reused.
+WNAF_WINDOW_G = 8
+
+
 class GE:
     """Objects of this class represent secp256k1 group elements (curve points or infinity)
 
@@ -184,6 +351,29 @@ class GE:
             self.x = fx
             self.y = fy
 
+    @staticmethod
+    def _from_affine(p):
+        """Construct a group element from an affine (x, y) tuple of integers (or None).
+
+        The coordinates must already be reduced and on the curve; unlike GE(x, y),
+        this does not check that."""
+        r = GE.__new__(GE)
+        if p is None:
+            r.infinity = True
+            return r
+        r.infinity = False
+        r.x = FE.__new__(FE)
+        r.x._num, r.x._den = p[0], 1
+        r.y = FE.__new__(FE)
+        r.y._num, r.y._den = p[1], 1
+        return r
+
+    def _to_affine(self):
+        """Convert this group element to an affine (x, y) tuple of integers (or None)."""
+        if self.infinity:
+            return None
+        return (int(self.x), int(self.y))
+
     def __add__(self, a):
         """Add two group elements together."""
         # Deal with infinity: a + infinity == infinity + a == a.
@@ -191,53 +381,84 @@ class GE:
             return a
         if a.infinity:
             return self
-        if self.x == a.x:
-            if self.y != a.y:
+        x1, y1 = self._to_affine()
+        x2, y2 = a._to_affine()
+        if x1 == x2:
+            if y1 != y2:
                 # A point added to its own negation is infinity.
-                assert self.y + a.y == 0
+                assert (y1 + y2) % _P == 0
                 return GE()
             else:
                 # For identical inputs, use the tangent (doubling formula).
-                lam = (3 * self.x**2) / (2 * self.y)
+                lam = 3 * x1 * x1 * pow(2 * y1, -1, _P)
         else:
             # For distinct inputs, use the line through both points (adding formula).
-            lam = (self.y - a.y) / (self.x - a.x)
+            lam = (y1 - y2) * pow(x1 - x2, -1, _P)
         # Determine point opposite to the intersection of that line with the curve.
-        x = lam**2 - (self.x + a.x)
-        y = lam * (self.x - x) - self.y
-        return GE(x, y)
+        x = (lam * lam - x1 - x2) % _P
+        y = (lam * (x1 - x) - y1) % _P
+        return GE._from_affine((x, y))
 
     @staticmethod
     def mul(*aps):
         """Compute a (batch) scalar group element multiplication.
 
         GE.mul((a1, p1), (a2, p2), (a3, p3)) is identical to a1*p1 + a2*p2 + a3*p3,
-        but more efficient."""
-        # Reduce all the scalars modulo order first (so we can deal with negatives etc).
-        naps = [(a % GE.ORDER, p) for a, p in aps]
+        but more efficient.
+
+        This uses Strauss' algorithm: the scalars are written in wNAF, and a
+        single chain of doublings is shared by all points, with an addition of a
+        precomputed odd multiple of a point for every non-zero digit."""
+        nafs = []
+        tables = []
+        points = []
+        for a, p in aps:
+            # Reduce all the scalars modulo order first (so we can deal with negatives etc).
+            a %= GE.ORDER
+            if a == 0 or p.infinity:
+                continue
+            if p is G:
+                nafs.append(_wnaf(a, WNAF_WINDOW_G))
+                tables.append(_g_odd_multiples())
+            else:
+                nafs.append(_wnaf(a, WNAF_WINDOW))
+                tables.append(None)
+                points.append(p._to_affine())
+        # Compute the tables of all other points at once.
+        point_tables = iter(_odd_multiples(points, WNAF_WINDOW))
+        tables = [table or next(point_tables) for table in tables]
+        # For every digit position, the multiples to add there.
+        adds = [[] for _ in range(max(map(len, nafs), default=0))]
+        for naf, (table, neg_table) in zip(nafs, tables):
+            for i, d in enumerate(naf):
+                if d > 0:
+                    adds[i].append(table[d >> 1])
+                elif d < 0:
+                    adds[i].append(neg_table[-d >> 1])
         # Start with point at infinity.
-        r = GE()
-        # Iterate over all bit positions, from high to low.
-        for i in range(255, -1, -1):
-            # Double what we have so far.
-            r = r + r
-            # Add then add the points for which the corresponding scalar bit is set.
-            for (a, p) in naps:
-                if (a >> i) & 1:
-                    r += p
-        return r
+        r = _INFINITY
+        # Iterate over all digit positions, from high to low.
+        for digit_adds in reversed(adds):
+            # Double what we have so far, then add the multiples for the non-zero digits.
+            r = _jacobian_double(r)
+            for q in digit_adds:
+                r = _jacobian_add_affine(r, q)
+        return GE._from_affine(_to_affine(r))
 
     def __rmul__(self, a):
         """Multiply an integer with a group element."""
-        if self == G:
+        if self is G:
             return FAST_G.mul(a)
+        if self is H:
+            return FAST_H.mul(a)
         return GE.mul((a, self))
 
     def __neg__(self):
         """Compute the negation of a group element."""
         if self.infinity:
             return self
-        return GE(self.x, -self.y)
+        x, y = self._to_affine()
+        return GE._from_affine((x, (_P - y) % _P))
 
     def to_bytes_compressed(self):
         """Convert a non-infinite group element to 33-byte compressed encoding."""
@@ -257,12 +478,15 @@ class GE:
     @staticmethod
     def lift_x(x):
         """Return group element with specified field element as x coordinate (and even y)."""
-        y = (FE(x)**3 + 7).sqrt()
-        if y is None:
+        p = _lift_x(int(FE(x)))
+        if p is None:
             return None
-        if not y.is_even():
-            y = -y
-        return GE(x, y)
+        return GE._from_affine(p)
+
+    @staticmethod
+    def lift_x_cache_info():
+        """Return the hits and misses of the cache of lift_x results (see functools.lru_cache)."""
+        return _lift_x.cache_info()
 
     @staticmethod
     def from_bytes(b):
@@ -274,20 +498,20 @@ class GE:
             x = FE.from_bytes(b[1:])
             if x is None:
                 return None
-            r = GE.lift_x(x)
-            if r is None:
+            p = _lift_x(int(x))
+            if p is None:
                 return None
             if b[0] == 3:
-                r = -r
-            return r
+                p = (p[0], _P - p[1])
+            return GE._from_affine(p)
         else:
             if b[0] != 4:
                 return None
             x = FE.from_bytes(b[1:33])
             y = FE.from_bytes(b[33:])
-            if y**2 != x**3 + 7:
+            if x is None or y is None or y**2 != x**3 + 7:
                 return None
-            return GE(x, y)
+            return GE._from_affine((int(x), int(y)))
 
     @staticmethod
     def from_bytes_xonly(b):
@@ -318,38 +542,265 @@ class GE:
 # The secp256k1 generator point
 G = GE.lift_x(0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798)
 
+_G_ODD_MULTIPLES = None
+
+
+def _g_odd_multiples():
+    """Return the (cached) tables of odd multiples of G for GE.mul."""
+    global _G_ODD_MULTIPLES
+    if _G_ODD_MULTIPLES is None:
+        _G_ODD_MULTIPLES = _odd_multiples([G._to_affine()], WNAF_WINDOW_G)[0]
+    return _G_ODD_MULTIPLES
+
 
 class FastGEMul:
     """Table for fast multiplication with a constant group element.
 
-    Speed up scalar multiplication with a fixed point P by using a precomputed lookup table with
-    its powers of 2:
+    Speed up scalar multiplication with a fixed point P by using a precomputed lookup table with,
+    for every window of w bits of the scalar, all multiples of P that the window can contribute:
 
-        table = [P, 2*P, 4*P, (2^3)*P, (2^4)*P, ..., (2^255)*P]
+        table[i] = [1*(2^(w*i))*P, 2*(2^(w*i))*P, ..., (2^w - 1)*(2^(w*i))*P]
 
-    During multiplication, the points corresponding to each bit set in the scalar are added up,
-    i.e. on average ~128 point additions take place.
-    """
+    During multiplication, one table entry is added for every non-zero window of the scalar, i.e.
+    at most 256/w point additions take place (32 for the default w = 8) and no doublings. The
+    table holds affine (x, y) tuples and the additions are done in Jacobian coordinates, so only
+    the result needs a field inversion.
 
-    def __init__(self, p):
-        self.table = [p]  # table[i] = (2^i) * p
-        for _ in range(255):
-            p = p + p
-            self.table.append(p)
+    The table is computed on first use. If FastGEMul.cache_dir is set (the test framework sets it
+    to its cache directory), it is stored there and loaded by later processes.
+    """
 
-    def mul(self, a):
-        result = GE()
+    # Directory to cache tables in, or None to not cache them.
+    cache_dir = None
+    # Version of the cache file format.
+    CACHE_VERSION = 1
+    CACHE_MAGIC = b"secpFGEM"
+
+    def __init__(self, p, window=8):
+        assert 1 <= window <= 16
+        self.p = p
+        self.window = window
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = self._load_table()
+            if self._table is None:
+                self._table = self._compute_table()
+                self._store_table()
+        return self._table
+
+    def _compute_table(self):
+        table = []
+        multiples = []
+        base = self.p._to_affine()
+        for _ in range((GE.ORDER.bit_length() + self.window - 1) // self.window):
+            row = [(base[0], base[1], 1)]
+            for _ in range((1 << self.window) - 2):
+                row.append(_jacobian_add_affine(row[-1], base))
+            multiples += row
+            base = _to_affine(_jacobian_add_affine(row[-1], base))
+        affine = _batch_to_affine(multiples)
+        row_size = (1 << self.window) - 1
+        for i in range(0, len(affine), row_size):
+            table.append(affine[i:i + row_size])
+        return table
+
+    def _cache_header(self):
+        return self.CACHE_MAGIC + bytes([self.CACHE_VERSION, self.window]) + self.p.to_bytes_uncompressed()
+
+    def _cache_path(self):
+        name = sha256(self._cache_header()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"secp256k1_fastgemul_v{self.CACHE_VERSION}_w{self.window}_{name}.dat")
+
+    def _load_table(self):
+        """Load the table from the cache, if present and intact (otherwise return None)."""
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        header = self._cache_header()
+        row_size = (1 << self.window) - 1
+        rows = (GE.ORDER.bit_length() + self.window - 1) // self.window
+        body = data[len(header):-32]
+        if (not data.startswith(header) or len(body) != rows * row_size * 64 or
+                sha256(data[:-32]).digest() != data[-32:]):
+            return None
+        points = [(int.from_bytes(body[i:i + 32], 'big'), int.from_bytes(body[i + 32:i + 64], 'big')) for i in range(0, len(body), 64)]
+        if points[0] != self.p._to_affine():
+            return None
+        return [points[i:i + row_size] for i in range(0, len(points), row_size)]
+
+    def _store_table(self):
+        """Write the table to the cache (if enabled); failures are ignored."""
+        if self.cache_dir is None:
+            return
+        data = bytearray(self._cache_header())
+        for row in self._table:
+            for x, y in row:
+                data += x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+        data += sha256(data).digest()
+        path = self._cache_path()
+        # Write to a temporary file first, so that concurrent test processes
+        # never see a partial file.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _mul_jacobian(self, a):
+        result = _INFINITY
         a = a % GE.ORDER
-        for bit in range(a.bit_length()):
-            if a & (1 << bit):
-                result += self.table[bit]
+        mask = (1 << self.window) - 1
+        for row in self.table:
+            if not a:
+                break
+            d = a & mask
+            if d:
+                result = _jacobian_add_affine(result, row[d - 1])
+            a >>= self.window
         return result
 
+    def mul(self, a):
+        return GE._from_affine(_to_affine(self._mul_jacobian(a)))
+
+    def mul_batch(self, scalars):
+        """Multiply P by each of a list of scalars.
+
+        The results are accumulated in affine coordinates, window by window for all scalars at
+        once, so that the field inversions of all additions of a window can be combined into a
+        single one (Montgomery's trick). This makes every addition cheaper than one in Jacobian
+        coordinates."""
+        scalars = [a % GE.ORDER for a in scalars]
+        results = [None] * len(scalars)
+        mask = (1 << self.window) - 1
+        for i, row in enumerate(self.table):
+            shift = i * self.window
+            # The additions to do in this window: (result index, point to add, x2 - x1).
+            adds = []
+            for j, a in enumerate(scalars):
+                d = (a >> shift) & mask
+                if not d:
+                    continue
+                q = row[d - 1]
+                r = results[j]
+                if r is None:
+                    results[j] = q
+                elif r[0] == q[0]:
+                    # Doubling or a result of infinity; rare enough to not batch.
+                    results[j] = _to_affine(_jacobian_add_affine((r[0], r[1], 1), q))
+                else:
+                    adds.append((j, q, (q[0] - r[0]) % _P))
+            # prefix[k] is the product of the x differences of adds[:k].
+            prefix = [1]
+            for _, _, dx in adds:
+                prefix.append(prefix[-1] * dx % _P)
+            inv = pow(prefix[-1], -1, _P)
+            for k in range(len(adds) - 1, -1, -1):
+                j, (x2, y2), dx = adds[k]
+                x1, y1 = results[j]
+                lam = (y2 - y1) * inv * prefix[k] % _P
+                inv = inv * dx % _P
+                x3 = (lam * lam - x1 - x2) % _P
+                results[j] = (x3, (lam * (x1 - x3) - y1) % _P)
+        return [GE._from_affine(r) for r in results]
+
 # Precomputed table with multiples of G for fast multiplication
 FAST_G = FastGEMul(G)
 
+# The NUMS point H from BIP341 (whose discrete logarithm is unknown), used as
+# internal key for script-path-only taproot outputs, with its own table.
+H = GE.from_bytes_xonly(bytes.fromhex("50929b74c1a04954b78b4b6035e97a5e078a5a0f28ec96d547bfee9ace803ac0"))
+FAST_H = FastGEMul(H)
+
 class TestFrameworkSecp256k1(unittest.TestCase):
     def test_H(self):
         H = sha256(G.to_bytes_uncompressed()).digest()
         assert GE.lift_x(FE.from_bytes(H)) is not None
         self.assertEqual(H.hex(), "50929b74c1a04954b78b4b6035e97a5e078a5a0f28ec96d547bfee9ace803ac0")
+
+    def test_mul(self):
+        def mul_reference(a, p):
+            # Plain double-and-add with affine additions.
+            r = GE()
+            for i in range(255, -1, -1):
+                r = r + r
+                if ((a % GE.ORDER) >> i) & 1:
+                    r = r + p
+            return r
+
+        def same(p, q):
+            return p.infinity == q.infinity and (p.infinity or (p.x == q.x and p.y == q.y))
+
+        P = GE.from_bytes_xonly(sha256(G.to_bytes_uncompressed()).digest())
+        scalars = [0, 1, 2, 3, GE.ORDER - 1, GE.ORDER, GE.ORDER + 1, -5, 2**255 + 1] + [random.randrange(GE.ORDER) for _ in range(5)]
+        for a in scalars:
+            for point in (G, P):
+                expected = mul_reference(a, point)
+                self.assertTrue(same(GE.mul((a, point)), expected))
+                self.assertTrue(same(a * point, expected))
+            self.assertTrue(same(GE.mul((a, G), (-a, G)), GE()))
+            self.assertTrue(same(GE.mul((a, G), (a, P), (1, GE())), mul_reference(a, G) + mul_reference(a, P)))
+        self.assertTrue(same(GE.mul(), GE()))
+        self.assertTrue(same(G + G, 2 * G))
+        self.assertTrue(same(P + (-P), GE()))
+        for window in (1, 4, 7):
+            self.assertTrue(same(FastGEMul(P, window).mul(12345), GE.mul((12345, P))))
+        for a in scalars:
+            self.assertTrue(same(a * H, GE.mul((a, H))))
+        for p, a in zip(FAST_G.mul_batch(scalars), scalars):
+            self.assertTrue(same(p, mul_reference(a, G)))
+        self.assertEqual(FAST_G.mul_batch([]), [])
+
+    def test_lift_x_cache(self):
+        P = GE.mul((54321, G))
+        encodings = (P.to_bytes_compressed(), (-P).to_bytes_compressed(), P.to_bytes_uncompressed())
+        expected = [P.to_bytes_uncompressed(), (-P).to_bytes_uncompressed(), P.to_bytes_uncompressed()]
+        before = GE.lift_x_cache_info()
+        for _ in range(3):
+            self.assertEqual([GE.from_bytes(encoding).to_bytes_uncompressed() for encoding in encodings], expected)
+            self.assertEqual(GE.from_bytes_xonly(P.to_bytes_xonly()).to_bytes_xonly(), P.to_bytes_xonly())
+        after = GE.lift_x_cache_info()
+        # A single square root for the x coordinate; the other compressed and
+        # x-only parses are cache hits (uncompressed ones need no square root).
+        self.assertEqual(after.misses - before.misses, 1)
+        self.assertEqual(after.hits - before.hits, 8)
+        # Returned points are separate objects, so changing one does not affect the cache.
+        Q = GE.from_bytes_xonly(P.to_bytes_xonly())
+        Q.y = -Q.y
+        self.assertNotEqual(GE.from_bytes_xonly(P.to_bytes_xonly()).y, Q.y)
+        self.assertIsNone(GE.from_bytes_xonly((5).to_bytes(32, 'big')))
+        self.assertIsNone(GE.lift_x(5))
+
+    def test_table_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            P = GE.mul((12345, G))
+            fast = FastGEMul(P, window=4)
+            fast.cache_dir = cache_dir
+            table = fast.table
+            path = fast._cache_path()
+            self.assertTrue(os.path.exists(path))
+            loaded = FastGEMul(P, window=4)
+            loaded.cache_dir = cache_dir
+            self.assertEqual(loaded._load_table(), table)
+            # A different window or point does not use the same file.
+            for other in (FastGEMul(P, window=5), FastGEMul(G, window=4)):
+                other.cache_dir = cache_dir
+                self.assertIsNone(other._load_table())
+            # A damaged file is ignored (and replaced).
+            with open(path, "r+b") as f:
+                f.seek(200)
+                f.write(b"\x00")
+            damaged = FastGEMul(P, window=4)
+            damaged.cache_dir = cache_dir
+            self.assertIsNone(damaged._load_table())
+            self.assertEqual(damaged.table, table)
+            self.assertIsNotNone(damaged._load_table())
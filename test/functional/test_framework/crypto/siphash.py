@@ -5,61 +5,155 @@
 """SipHash-2-4 implementation.
 
 This implements SipHash-2-4. For convenience, an interface taking 256-bit
-integers is provided in addition to the one accepting generic data.
+integers is provided in addition to the one accepting generic data, and
+siphash_many and siphash256_many hash many messages at once.
 """
+from functools import lru_cache
+import struct
+import unittest
 
-def rotl64(n, b):
-    return n >> (64 - b) | (n & ((1 << (64 - b)) - 1)) << b
 
+# Maximum number of messages the batch functions hash in parallel, and the minimum
+# for which that is faster than hashing them one by one.
+SIPHASH_MAX_LANES = 4096
+SIPHASH_MIN_LANES = 4
+# Length byte of the last word of a 32-byte message.
+_LENGTH_WORD_32 = bytes(7) + bytes([32])
 
-def siphash_round(v0, v1, v2, v3):
-    v0 = (v0 + v1) & ((1 << 64) - 1)
-    v1 = rotl64(v1, 13)
+
+def siphash_round(v0, v1, v2, v3, mask=(1 << 64) - 1):
+    """One SipRound. See _siphash_lanes for the use of mask."""
+    v0 = (v0 + v1) & mask
+    v1 = ((v1 << 13) | (v1 >> 51)) & mask
     v1 ^= v0
-    v0 = rotl64(v0, 32)
-    v2 = (v2 + v3) & ((1 << 64) - 1)
-    v3 = rotl64(v3, 16)
+    v0 = ((v0 << 32) | (v0 >> 32)) & mask
+    v2 = (v2 + v3) & mask
+    v3 = ((v3 << 16) | (v3 >> 48)) & mask
     v3 ^= v2
-    v0 = (v0 + v3) & ((1 << 64) - 1)
-    v3 = rotl64(v3, 21)
+    v0 = (v0 + v3) & mask
+    v3 = ((v3 << 21) | (v3 >> 43)) & mask
     v3 ^= v0
-    v2 = (v2 + v1) & ((1 << 64) - 1)
-    v1 = rotl64(v1, 17)
+    v2 = (v2 + v1) & mask
+    v1 = ((v1 << 17) | (v1 >> 47)) & mask
     v1 ^= v2
-    v2 = rotl64(v2, 32)
+    v2 = ((v2 << 32) | (v2 >> 32)) & mask
     return (v0, v1, v2, v3)
 
 
+def _siphash_words(k0, k1, words, ones=1, mask=(1 << 64) - 1):
+    """SipHash-2-4 of a message given as 64-bit words, the last one including the length byte."""
+    v0 = (0x736f6d6570736575 ^ k0) * ones
+    v1 = (0x646f72616e646f6d ^ k1) * ones
+    v2 = (0x6c7967656e657261 ^ k0) * ones
+    v3 = (0x7465646279746573 ^ k1) * ones
+    for m in words:
+        v3 ^= m
+        v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+        v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+        v0 ^= m
+    v2 ^= 0xff * ones
+    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3, mask)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
 def siphash(k0, k1, data):
     assert type(data) is bytes
-    v0 = 0x736f6d6570736575 ^ k0
-    v1 = 0x646f72616e646f6d ^ k1
-    v2 = 0x6c7967656e657261 ^ k0
-    v3 = 0x7465646279746573 ^ k1
-    c = 0
-    t = 0
-    for d in data:
-        t |= d << (8 * (c % 8))
-        c = (c + 1) & 0xff
-        if (c & 7) == 0:
-            v3 ^= t
-            v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-            v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-            v0 ^= t
-            t = 0
-    t = t | (c << 56)
-    v3 ^= t
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    v0 ^= t
-    v2 ^= 0xff
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
-    return v0 ^ v1 ^ v2 ^ v3
+    nwords = len(data) // 8
+    words = list(struct.unpack_from(f"<{nwords}Q", data))
+    words.append(int.from_bytes(data[8 * nwords:], 'little') | ((len(data) & 0xff) << 56))
+    return _siphash_words(k0, k1, words)
 
 
 def siphash256(k0, k1, num):
-    assert type(num) is int
-    return siphash(k0, k1, num.to_bytes(32, 'little'))
+    assert type(num) is int and 0 <= num < 2**256
+    mask = (1 << 64) - 1
+    return _siphash_words(k0, k1, (num & mask, (num >> 64) & mask, (num >> 128) & mask, num >> 192, 32 << 56))
+
+
+@lru_cache(maxsize=8)
+def _lane_constants(n):
+    """Return the constants for n 128-bit lanes: a 64-bit mask and a 1 in every lane."""
+    mask = int.from_bytes((b'\xff' * 8 + bytes(8)) * n, 'little')
+    ones = int.from_bytes((b'\x01' + bytes(15)) * n, 'little')
+    return mask, ones
+
+
+def _siphash_lanes(k0, k1, messages, nwords):
+    """SipHash-2-4 of many messages of nwords 64-bit words each, at once.
+
+    messages is the concatenation of the messages, each zero-padded with its length byte at the
+    end. Like chacha20._chacha20_blocks, every state word is a single integer holding that word
+    for all messages in separate lanes; the lanes are 128 bits wide, so that carries and
+    rotated-out bits land in the upper half of a lane and are masked off."""
+    n = len(messages) // (8 * nwords)
+    mask, ones = _lane_constants(n)
+    words = []
+    for j in range(nwords):
+        # Gather word j of every message.
+        buf = bytearray(16 * n)
+        for i in range(8):
+            buf[i::16] = messages[8 * j + i::8 * nwords]
+        words.append(int.from_bytes(buf, 'little'))
+    out = _siphash_words(k0, k1, words, ones, mask).to_bytes(16 * n, 'little')
+    result = bytearray(8 * n)
+    for i in range(8):
+        result[i::8] = out[i::16]
+    return list(struct.unpack(f"<{n}Q", result))
+
+
+def siphash_many(k0, k1, datas):
+    """Compute siphash(k0, k1, data) for every data in datas.
+
+    Messages with the same number of words are hashed in parallel."""
+    results = [0] * len(datas)
+    groups = {}
+    for index, data in enumerate(datas):
+        assert type(data) is bytes
+        groups.setdefault(len(data) // 8 + 1, []).append(index)
+    for nwords, indices in groups.items():
+        if len(indices) < SIPHASH_MIN_LANES:
+            for i in indices:
+                results[i] = siphash(k0, k1, datas[i])
+            continue
+        for start in range(0, len(indices), SIPHASH_MAX_LANES):
+            chunk = indices[start:start + SIPHASH_MAX_LANES]
+            messages = b''.join(datas[i] + bytes(7 - len(datas[i]) % 8) + bytes([len(datas[i]) & 0xff]) for i in chunk)
+            for i, result in zip(chunk, _siphash_lanes(k0, k1, messages, nwords)):
+                results[i] = result
+    return results
+
+
+def siphash256_many(k0, k1, nums):
+    """Compute siphash256(k0, k1, num) for every num in nums, in parallel."""
+    if len(nums) < SIPHASH_MIN_LANES:
+        return [siphash256(k0, k1, num) for num in nums]
+    results = []
+    for start in range(0, len(nums), SIPHASH_MAX_LANES):
+        messages = b''.join(num.to_bytes(32, 'little') + _LENGTH_WORD_32 for num in nums[start:start + SIPHASH_MAX_LANES])
+        results += _siphash_lanes(k0, k1, messages, 5)
+    return results
+
+
+class TestFrameworkSiphash(unittest.TestCase):
+    def test_siphash(self):
+        """Reference test vectors from the SipHash paper and its reference implementation."""
+        k0 = int.from_bytes(bytes(range(8)), 'little')
+        k1 = int.from_bytes(bytes(range(8, 16)), 'little')
+        self.assertEqual(siphash(k0, k1, bytes(range(15))), 0xa129ca6149be45e5)
+        self.assertEqual(siphash(k0, k1, b''), 0x726fdb47dd0e0e31)
+        self.assertEqual(siphash(k0, k1, bytes(range(8))), 0x93f5f5799a932462)
+        self.assertEqual(siphash256(k0, k1, int.from_bytes(bytes(range(32)), 'little')), siphash(k0, k1, bytes(range(32))))
+
+    def test_siphash_many(self):
+        """The batch functions match the single message ones."""
+        k0, k1 = 0x0706050403020100, 0x0f0e0d0c0b0a0908
+        datas = [bytes(range(length)) for length in range(70)] + [bytes([i]) * 32 for i in range(256)]
+        self.assertEqual(siphash_many(k0, k1, datas), [siphash(k0, k1, data) for data in datas])
+        nums = [((i * 0x9e3779b97f4a7c15) << (i % 193)) % 2**256 for i in range(SIPHASH_MAX_LANES + 5)]
+        nums.append(2**256 - 1)
+        self.assertEqual(siphash256_many(k0, k1, nums), [siphash256(k0, k1, num) for num in nums])
+        self.assertEqual(siphash256_many(k0, k1, []), [])
+        self.assertRaises(AssertionError, siphash256, k0, k1, 2**256)
@@ -0,0 +1,1351 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Script interpreter, a port of src/script/interpreter.cpp.
+
+Evaluates legacy, P2SH, segwit v0 and taproot (key path and tapscript) spends,
+so that transactions can be checked without a node. Failures raise a
+ScriptError whose message is the node's error string (ScriptErrorString), as
+it appears in reject reasons like "mandatory-script-verify-flag-failed (...)".
+
+verify_inputs() only takes picklable arguments and returns the result instead
+of raising, so it can also be mapped over a multiprocessing pool. Signature
+checks use key.py, which is much faster with a shared libsecp256k1 loaded
+(see key.load_libsecp256k1)."""
+
+import hashlib
+import unittest
+
+from .key import (
+    ECKey,
+    ECPubKey,
+    TaggedHash,
+    compute_xonly_pubkey,
+    sign_schnorr,
+    tweak_add_privkey,
+    tweak_add_pubkey,
+    verify_schnorr,
+)
+from .crypto.ripemd160 import ripemd160
+from .crypto.secp256k1 import GE
+from .messages import (
+    COutPoint,
+    CTransaction,
+    CTxIn,
+    CTxInWitness,
+    CTxOut,
+    SEQUENCE_FINAL,
+    hash256,
+    ser_compact_size,
+    ser_string,
+    sha256,
+)
+from .script import (
+    ANNEX_TAG,
+    CScript,
+    CScriptInvalidError,
+    LEAF_VERSION_TAPSCRIPT,
+    LOCKTIME_THRESHOLD,
+    LegacySignatureHash,
+    MAX_SCRIPT_ELEMENT_SIZE,
+    MAX_SCRIPT_SIZE,
+    OP_0,
+    OP_0NOTEQUAL,
+    OP_1,
+    OP_16,
+    OP_1ADD,
+    OP_1NEGATE,
+    OP_1SUB,
+    OP_2DIV,
+    OP_2DROP,
+    OP_2DUP,
+    OP_2MUL,
+    OP_2OVER,
+    OP_2ROT,
+    OP_2SWAP,
+    OP_3DUP,
+    OP_ABS,
+    OP_ADD,
+    OP_AND,
+    OP_BOOLAND,
+    OP_BOOLOR,
+    OP_CAT,
+    OP_CHECKLOCKTIMEVERIFY,
+    OP_CHECKMULTISIG,
+    OP_CHECKMULTISIGVERIFY,
+    OP_CHECKSEQUENCEVERIFY,
+    OP_CHECKSIG,
+    OP_CHECKSIGADD,
+    OP_CHECKSIGVERIFY,
+    OP_CODESEPARATOR,
+    OP_DEPTH,
+    OP_DIV,
+    OP_DROP,
+    OP_DUP,
+    OP_ELSE,
+    OP_ENDIF,
+    OP_EQUAL,
+    OP_EQUALVERIFY,
+    OP_FROMALTSTACK,
+    OP_GREATERTHAN,
+    OP_GREATERTHANOREQUAL,
+    OP_HASH160,
+    OP_HASH256,
+    OP_IF,
+    OP_IFDUP,
+    OP_INVERT,
+    OP_LEFT,
+    OP_LESSTHAN,
+    OP_LESSTHANOREQUAL,
+    OP_LSHIFT,
+    OP_MAX,
+    OP_MIN,
+    OP_MOD,
+    OP_MUL,
+    OP_NEGATE,
+    OP_NIP,
+    OP_NOP,
+    OP_NOP1,
+    OP_NOP10,
+    OP_NOP4,
+    OP_NOT,
+    OP_NOTIF,
+    OP_NUMEQUAL,
+    OP_NUMEQUALVERIFY,
+    OP_NUMNOTEQUAL,
+    OP_OR,
+    OP_OVER,
+    OP_PICK,
+    OP_PUSHDATA1,
+    OP_PUSHDATA2,
+    OP_PUSHDATA4,
+    OP_RETURN,
+    OP_RIGHT,
+    OP_RIPEMD160,
+    OP_ROLL,
+    OP_ROT,
+    OP_RSHIFT,
+    OP_SHA1,
+    OP_SHA256,
+    OP_SIZE,
+    OP_SUB,
+    OP_SUBSTR,
+    OP_SWAP,
+    OP_TOALTSTACK,
+    OP_TUCK,
+    OP_VERIFY,
+    OP_WITHIN,
+    OP_XOR,
+    SEQUENCE_LOCKTIME_DISABLE_FLAG,
+    SEQUENCE_LOCKTIME_MASK,
+    SEQUENCE_LOCKTIME_TYPE_FLAG,
+    SIGHASH_ALL,
+    SIGHASH_ANYONECANPAY,
+    SIGHASH_DEFAULT,
+    SIGHASH_NONE,
+    SIGHASH_SINGLE,
+    SegwitV0SignatureHash,
+    SighashCache,
+    TaprootSignatureHash,
+    FindAndDelete,
+    bn2vch,
+    hash160,
+    is_op_success,
+    taproot_construct,
+)
+
+MAX_OPS_PER_SCRIPT = 201
+MAX_PUBKEYS_PER_MULTISIG = 20
+MAX_STACK_SIZE = 1000
+VALIDATION_WEIGHT_PER_SIGOP_PASSED = 50
+VALIDATION_WEIGHT_OFFSET = 50
+TAPROOT_LEAF_MASK = 0xfe
+TAPROOT_CONTROL_BASE_SIZE = 33
+TAPROOT_CONTROL_NODE_SIZE = 32
+TAPROOT_CONTROL_MAX_NODE_COUNT = 128
+TAPROOT_CONTROL_MAX_SIZE = TAPROOT_CONTROL_BASE_SIZE + TAPROOT_CONTROL_NODE_SIZE * TAPROOT_CONTROL_MAX_NODE_COUNT
+
+# Script verification flags, in the order of script_verify_flag_name.
+SCRIPT_VERIFY_NONE = 0
+SCRIPT_VERIFY_P2SH = 1 << 0
+SCRIPT_VERIFY_STRICTENC = 1 << 1
+SCRIPT_VERIFY_DERSIG = 1 << 2
+SCRIPT_VERIFY_LOW_S = 1 << 3
+SCRIPT_VERIFY_NULLDUMMY = 1 << 4
+SCRIPT_VERIFY_SIGPUSHONLY = 1 << 5
+SCRIPT_VERIFY_MINIMALDATA = 1 << 6
+SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS = 1 << 7
+SCRIPT_VERIFY_CLEANSTACK = 1 << 8
+SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY = 1 << 9
+SCRIPT_VERIFY_CHECKSEQUENCEVERIFY = 1 << 10
+SCRIPT_VERIFY_WITNESS = 1 << 11
+SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_WITNESS_PROGRAM = 1 << 12
+SCRIPT_VERIFY_MINIMALIF = 1 << 13
+SCRIPT_VERIFY_NULLFAIL = 1 << 14
+SCRIPT_VERIFY_WITNESS_PUBKEYTYPE = 1 << 15
+SCRIPT_VERIFY_CONST_SCRIPTCODE = 1 << 16
+SCRIPT_VERIFY_TAPROOT = 1 << 17
+SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_TAPROOT_VERSION = 1 << 18
+SCRIPT_VERIFY_DISCOURAGE_OP_SUCCESS = 1 << 19
+SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_PUBKEYTYPE = 1 << 20
+
+# Flags for block validation and for the mempool (see src/policy/policy.h).
+MANDATORY_SCRIPT_VERIFY_FLAGS = (SCRIPT_VERIFY_P2SH | SCRIPT_VERIFY_DERSIG | SCRIPT_VERIFY_NULLDUMMY |
+                                 SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY | SCRIPT_VERIFY_CHECKSEQUENCEVERIFY |
+                                 SCRIPT_VERIFY_WITNESS | SCRIPT_VERIFY_TAPROOT)
+STANDARD_SCRIPT_VERIFY_FLAGS = (MANDATORY_SCRIPT_VERIFY_FLAGS | SCRIPT_VERIFY_STRICTENC | SCRIPT_VERIFY_MINIMALDATA |
+                                SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS | SCRIPT_VERIFY_CLEANSTACK |
+                                SCRIPT_VERIFY_MINIMALIF | SCRIPT_VERIFY_NULLFAIL | SCRIPT_VERIFY_LOW_S |
+                                SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_WITNESS_PROGRAM | SCRIPT_VERIFY_WITNESS_PUBKEYTYPE |
+                                SCRIPT_VERIFY_CONST_SCRIPTCODE | SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_TAPROOT_VERSION |
+                                SCRIPT_VERIFY_DISCOURAGE_OP_SUCCESS | SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_PUBKEYTYPE)
+
+# Error messages, as returned by ScriptErrorString.
+SCRIPT_ERR_UNKNOWN_ERROR = "unknown error"
+SCRIPT_ERR_EVAL_FALSE = "Script evaluated without error but finished with a false/empty top stack element"
+SCRIPT_ERR_OP_RETURN = "OP_RETURN was encountered"
+SCRIPT_ERR_SCRIPT_SIZE = "Script is too big"
+SCRIPT_ERR_PUSH_SIZE = "Push value size limit exceeded"
+SCRIPT_ERR_OP_COUNT = "Operation limit exceeded"
+SCRIPT_ERR_STACK_SIZE = "Stack size limit exceeded"
+SCRIPT_ERR_SIG_COUNT = "Signature count negative or greater than pubkey count"
+SCRIPT_ERR_PUBKEY_COUNT = "Pubkey count negative or limit exceeded"
+SCRIPT_ERR_VERIFY = "Script failed an OP_VERIFY operation"
+SCRIPT_ERR_EQUALVERIFY = "Script failed an OP_EQUALVERIFY operation"
+SCRIPT_ERR_CHECKMULTISIGVERIFY = "Script failed an OP_CHECKMULTISIGVERIFY operation"
+SCRIPT_ERR_CHECKSIGVERIFY = "Script failed an OP_CHECKSIGVERIFY operation"
+SCRIPT_ERR_NUMEQUALVERIFY = "Script failed an OP_NUMEQUALVERIFY operation"
+SCRIPT_ERR_BAD_OPCODE = "Opcode missing or not understood"
+SCRIPT_ERR_DISABLED_OPCODE = "Attempted to use a disabled opcode"
+SCRIPT_ERR_INVALID_STACK_OPERATION = "Operation not valid with the current stack size"
+SCRIPT_ERR_INVALID_ALTSTACK_OPERATION = "Operation not valid with the current altstack size"
+SCRIPT_ERR_UNBALANCED_CONDITIONAL = "Invalid OP_IF construction"
+SCRIPT_ERR_NEGATIVE_LOCKTIME = "Negative locktime"
+SCRIPT_ERR_UNSATISFIED_LOCKTIME = "Locktime requirement not satisfied"
+SCRIPT_ERR_SIG_HASHTYPE = "Signature hash type missing or not understood"
+SCRIPT_ERR_SIG_DER = "Non-canonical DER signature"
+SCRIPT_ERR_MINIMALDATA = "Data push larger than necessary"
+SCRIPT_ERR_SIG_PUSHONLY = "Only push operators allowed in signatures"
+SCRIPT_ERR_SIG_HIGH_S = "Non-canonical signature: S value is unnecessarily high"
+SCRIPT_ERR_SIG_NULLDUMMY = "Dummy CHECKMULTISIG argument must be zero"
+SCRIPT_ERR_PUBKEYTYPE = "Public key is neither compressed or uncompressed"
+SCRIPT_ERR_CLEANSTACK = "Stack size must be exactly one after execution"
+SCRIPT_ERR_MINIMALIF = "OP_IF/NOTIF argument must be minimal"
+SCRIPT_ERR_SIG_NULLFAIL = "Signature must be zero for failed CHECK(MULTI)SIG operation"
+SCRIPT_ERR_DISCOURAGE_UPGRADABLE_NOPS = "NOPx reserved for soft-fork upgrades"
+SCRIPT_ERR_DISCOURAGE_UPGRADABLE_WITNESS_PROGRAM = "Witness version reserved for soft-fork upgrades"
+SCRIPT_ERR_DISCOURAGE_UPGRADABLE_TAPROOT_VERSION = "Taproot version reserved for soft-fork upgrades"
+SCRIPT_ERR_DISCOURAGE_OP_SUCCESS = "OP_SUCCESSx reserved for soft-fork upgrades"
+SCRIPT_ERR_DISCOURAGE_UPGRADABLE_PUBKEYTYPE = "Public key version reserved for soft-fork upgrades"
+SCRIPT_ERR_WITNESS_PROGRAM_WRONG_LENGTH = "Witness program has incorrect length"
+SCRIPT_ERR_WITNESS_PROGRAM_WITNESS_EMPTY = "Witness program was passed an empty witness"
+SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH = "Witness program hash mismatch"
+SCRIPT_ERR_WITNESS_MALLEATED = "Witness requires empty scriptSig"
+SCRIPT_ERR_WITNESS_MALLEATED_P2SH = "Witness requires only-redeemscript scriptSig"
+SCRIPT_ERR_WITNESS_UNEXPECTED = "Witness provided for non-witness script"
+SCRIPT_ERR_WITNESS_PUBKEYTYPE = "Using non-compressed keys in segwit"
+SCRIPT_ERR_SCHNORR_SIG_SIZE = "Invalid Schnorr signature size"
+SCRIPT_ERR_SCHNORR_SIG_HASHTYPE = "Invalid Schnorr signature hash type"
+SCRIPT_ERR_SCHNORR_SIG = "Invalid Schnorr signature"
+SCRIPT_ERR_TAPROOT_WRONG_CONTROL_SIZE = "Invalid Taproot control block size"
+SCRIPT_ERR_TAPSCRIPT_VALIDATION_WEIGHT = "Too much signature validation relative to witness weight"
+SCRIPT_ERR_TAPSCRIPT_CHECKMULTISIG = "OP_CHECKMULTISIG(VERIFY) is not available in tapscript"
+SCRIPT_ERR_TAPSCRIPT_MINIMALIF = "OP_IF/NOTIF argument must be minimal in tapscript"
+SCRIPT_ERR_TAPSCRIPT_EMPTY_PUBKEY = "Empty public key in tapscript"
+SCRIPT_ERR_OP_CODESEPARATOR = "Using OP_CODESEPARATOR in non-witness script"
+SCRIPT_ERR_SIG_FINDANDDELETE = "Signature is found in scriptCode"
+
+# Signature versions (see SigVersion).
+SIGVERSION_BASE = 0
+SIGVERSION_WITNESS_V0 = 1
+SIGVERSION_TAPROOT = 2
+SIGVERSION_TAPSCRIPT = 3
+
+DISABLED_OPCODES = frozenset([OP_CAT, OP_SUBSTR, OP_LEFT, OP_RIGHT, OP_INVERT, OP_AND, OP_OR, OP_XOR,
+                              OP_2MUL, OP_2DIV, OP_MUL, OP_DIV, OP_MOD, OP_LSHIFT, OP_RSHIFT])
+
+_VCH_TRUE = b"\x01"
+_VCH_FALSE = b""
+
+
+class ScriptError(Exception):
+    """A script verification failure. The message is one of the SCRIPT_ERR_* strings."""
+    pass
+
+
+def script_verify_flags(names):
+    """Convert a comma-separated list of flag names (e.g. "P2SH,WITNESS") to flags."""
+    flags = SCRIPT_VERIFY_NONE
+    for name in names.split(","):
+        if name and name != "NONE":
+            flags |= globals()["SCRIPT_VERIFY_" + name]
+    return flags
+
+
+def cast_to_bool(vch):
+    """Interpret a stack element as a boolean (negative zero is false)."""
+    return len(vch) > 0 and (any(vch[:-1]) or (vch[-1] & 0x7f) != 0)
+
+
+def decode_script_num(vch, require_minimal, max_size=4):
+    """Decode a stack element as a number, like the CScriptNum constructor."""
+    if len(vch) > max_size:
+        raise ScriptError(SCRIPT_ERR_UNKNOWN_ERROR)  # script number overflow
+    if not vch:
+        return 0
+    # The most significant byte (excluding the sign bit) may only be zero if
+    # the sign bit would otherwise conflict with the byte before it.
+    if require_minimal and (vch[-1] & 0x7f) == 0 and (len(vch) <= 1 or (vch[-2] & 0x80) == 0):
+        raise ScriptError(SCRIPT_ERR_UNKNOWN_ERROR)  # non-minimally encoded script number
+    value = int.from_bytes(vch, "little")
+    if vch[-1] & 0x80:
+        return -(value & ~(0x80 << (8 * (len(vch) - 1))))
+    return value
+
+
+def check_minimal_push(data, opcode):
+    """Whether data was pushed with the smallest possible push opcode."""
+    if len(data) == 0:
+        return opcode == OP_0
+    if len(data) == 1 and 1 <= data[0] <= 16:
+        return False
+    if len(data) == 1 and data[0] == 0x81:
+        return False
+    if len(data) <= 75:
+        return opcode == len(data)
+    if len(data) <= 255:
+        return opcode == OP_PUSHDATA1
+    if len(data) <= 65535:
+        return opcode == OP_PUSHDATA2
+    return True
+
+
+def is_push_only(script):
+    """Whether a script consists of push opcodes (including OP_1NEGATE, OP_RESERVED and OP_1..OP_16) only."""
+    try:
+        return all(opcode <= OP_16 for opcode, _, _ in CScript(script).raw_iter())
+    except CScriptInvalidError:
+        return False
+
+
+def is_p2sh(script):
+    return len(script) == 23 and script[0] == OP_HASH160 and script[1] == 20 and script[22] == OP_EQUAL
+
+
+def witness_program(script):
+    """Return (version, program) of a witness program scriptPubKey, or None."""
+    if not CScript(script).IsWitnessProgram():
+        return None
+    return (0 if script[0] == OP_0 else script[0] - OP_1 + 1), bytes(script[2:])
+
+
+def _is_valid_signature_encoding(sig):
+    """Whether sig is a strictly DER-encoded signature followed by a hash type byte (BIP66)."""
+    if len(sig) < 9 or len(sig) > 73:
+        return False
+    if sig[0] != 0x30 or sig[1] != len(sig) - 3:
+        return False
+    len_r = sig[3]
+    if 5 + len_r >= len(sig):
+        return False
+    len_s = sig[5 + len_r]
+    if len_r + len_s + 7 != len(sig):
+        return False
+    if sig[2] != 0x02 or len_r == 0 or sig[4] & 0x80:
+        return False
+    if len_r > 1 and sig[4] == 0x00 and not sig[5] & 0x80:
+        return False
+    if sig[len_r + 4] != 0x02 or len_s == 0 or sig[len_r + 6] & 0x80:
+        return False
+    if len_s > 1 and sig[len_r + 6] == 0x00 and not sig[len_r + 7] & 0x80:
+        return False
+    return True
+
+
+def _parse_der_lax(sig):
+    """Parse a (possibly not strictly) DER-encoded signature like the node does.
+
+    Returns (r, s), which are 0 if out of range, or None if sig cannot be
+    parsed at all."""
+    pos = 0
+    n = len(sig)
+    if pos == n or sig[pos] != 0x30:
+        return None
+    pos += 1
+    if pos == n:
+        return None
+    lenbyte = sig[pos]
+    pos += 1
+    if lenbyte & 0x80:
+        lenbyte -= 0x80
+        if lenbyte > n - pos:
+            return None
+        pos += lenbyte
+    values = []
+    for _ in range(2):
+        if pos == n or sig[pos] != 0x02:
+            return None
+        pos += 1
+        if pos == n:
+            return None
+        lenbyte = sig[pos]
+        pos += 1
+        if lenbyte & 0x80:
+            lenbyte -= 0x80
+            if lenbyte > n - pos:
+                return None
+            while lenbyte > 0 and sig[pos] == 0:
+                pos += 1
+                lenbyte -= 1
+            if lenbyte >= 4:
+                return None
+            length = int.from_bytes(sig[pos:pos + lenbyte], "big")
+            pos += lenbyte
+        else:
+            length = lenbyte
+        if length > n - pos:
+            return None
+        values.append(sig[pos:pos + length].lstrip(b"\x00"))
+        pos += length
+    if any(len(v) > 32 for v in values):
+        return 0, 0
+    r, s = (int.from_bytes(v, "big") for v in values)
+    if r >= GE.ORDER or s >= GE.ORDER:
+        return 0, 0
+    return r, s
+
+
+def _der_int(v):
+    return bytes([2]) + ser_string(v.to_bytes(v.bit_length() // 8 + 1, "big"))
+
+
+def _is_low_der_signature(sig):
+    if not _is_valid_signature_encoding(sig):
+        raise ScriptError(SCRIPT_ERR_SIG_DER)
+    _, s = _parse_der_lax(sig[:-1])
+    if s > GE.ORDER_HALF:
+        raise ScriptError(SCRIPT_ERR_SIG_HIGH_S)
+
+
+def _is_defined_hashtype_signature(sig):
+    hashtype = sig[-1] & ~SIGHASH_ANYONECANPAY
+    return SIGHASH_ALL <= hashtype <= SIGHASH_SINGLE
+
+
+def check_signature_encoding(sig, flags):
+    # Empty signatures are allowed, as a compact way to provide an invalid signature.
+    if len(sig) == 0:
+        return
+    if flags & (SCRIPT_VERIFY_DERSIG | SCRIPT_VERIFY_LOW_S | SCRIPT_VERIFY_STRICTENC) and not _is_valid_signature_encoding(sig):
+        raise ScriptError(SCRIPT_ERR_SIG_DER)
+    if flags & SCRIPT_VERIFY_LOW_S:
+        _is_low_der_signature(sig)
+    if flags & SCRIPT_VERIFY_STRICTENC and not _is_defined_hashtype_signature(sig):
+        raise ScriptError(SCRIPT_ERR_SIG_HASHTYPE)
+
+
+def check_pubkey_encoding(pubkey, flags, sigversion):
+    if flags & SCRIPT_VERIFY_STRICTENC:
+        if not ((len(pubkey) == 33 and pubkey[0] in (2, 3)) or (len(pubkey) == 65 and pubkey[0] == 4)):
+            raise ScriptError(SCRIPT_ERR_PUBKEYTYPE)
+    # Only compressed keys are accepted in segwit.
+    if flags & SCRIPT_VERIFY_WITNESS_PUBKEYTYPE and sigversion == SIGVERSION_WITNESS_V0:
+        if not (len(pubkey) == 33 and pubkey[0] in (2, 3)):
+            raise ScriptError(SCRIPT_ERR_WITNESS_PUBKEYTYPE)
+
+
+def verify_ecdsa(pubkey, sig, msghash):
+    """Verify a DER-encoded ECDSA signature (without hash type) like CPubKey::Verify.
+
+    Unlike ECPubKey.verify_ecdsa, this accepts high-S and not strictly DER-encoded
+    signatures, and hybrid public keys."""
+    if not pubkey or len(pubkey) != {2: 33, 3: 33, 4: 65, 6: 65, 7: 65}.get(pubkey[0]):
+        return False
+    if pubkey[0] in (6, 7):
+        # Hybrid encoding: an uncompressed key whose prefix also encodes the parity of Y.
+        if (pubkey[0] & 1) != (pubkey[-1] & 1):
+            return False
+        pubkey = bytes([4]) + pubkey[1:]
+    key = ECPubKey()
+    key.set(pubkey)
+    if not key.is_valid:
+        return False
+    rs = _parse_der_lax(sig)
+    if rs is None or 0 in rs:
+        return False
+    r, s = rs
+    s = min(s, GE.ORDER - s)
+    der = _der_int(r) + _der_int(s)
+    return key.verify_ecdsa(bytes([0x30, len(der)]) + der, msghash, low_s=False)
+
+
+class ScriptExecutionData:
+    """Data about the taproot spend being verified, see ScriptExecutionData in the node."""
+    __slots__ = ("annex", "tapleaf_script", "leaf_version", "codeseparator_pos", "validation_weight_left")
+
+    def __init__(self):
+        self.annex = None
+        self.tapleaf_script = None
+        self.leaf_version = None
+        self.codeseparator_pos = 0xffffffff
+        self.validation_weight_left = None
+
+
+class BaseSignatureChecker:
+    """A checker for scripts evaluated outside of a transaction: all checks fail."""
+
+    def check_ecdsa_signature(self, sig, pubkey, script_code, sigversion):
+        return False
+
+    def check_schnorr_signature(self, sig, pubkey, sigversion, execdata):
+        raise ScriptError(SCRIPT_ERR_SCHNORR_SIG)
+
+    def check_lock_time(self, lock_time):
+        return False
+
+    def check_sequence(self, sequence):
+        return False
+
+
+class TransactionSignatureChecker(BaseSignatureChecker):
+    """Checks signatures and lock times against input input_index of tx.
+
+    amount is the value of the spent output, needed for segwit v0 signatures.
+    spent_utxos are the outputs spent by all inputs of tx, needed for taproot
+    signatures. Pass the same SighashCache when checking several inputs of a
+    transaction."""
+
+    def __init__(self, tx, input_index, amount, spent_utxos=None, *, cache=None):
+        self.tx = tx
+        self.input_index = input_index
+        self.amount = amount
+        self.spent_utxos = spent_utxos
+        self.cache = cache if cache is not None else SighashCache(tx, spent_utxos)
+
+    def check_ecdsa_signature(self, sig, pubkey, script_code, sigversion):
+        if not sig:
+            return False
+        hashtype = sig[-1]
+        try:
+            if sigversion == SIGVERSION_WITNESS_V0:
+                sighash = SegwitV0SignatureHash(script_code, self.tx, self.input_index, hashtype, self.amount, cache=self.cache)
+            else:
+                sighash, _ = LegacySignatureHash(script_code, self.tx, self.input_index, hashtype, cache=self.cache)
+        except CScriptInvalidError:
+            # The node hashes unparsable script codes, but such scripts fail anyway.
+            return False
+        return verify_ecdsa(pubkey, sig[:-1], sighash)
+
+    def check_schnorr_signature(self, sig, pubkey, sigversion, execdata):
+        assert self.spent_utxos is not None
+        if len(sig) != 64 and len(sig) != 65:
+            raise ScriptError(SCRIPT_ERR_SCHNORR_SIG_SIZE)
+        hashtype = SIGHASH_DEFAULT
+        if len(sig) == 65:
+            hashtype = sig[64]
+            sig = sig[:64]
+            if hashtype == SIGHASH_DEFAULT:
+                raise ScriptError(SCRIPT_ERR_SCHNORR_SIG_HASHTYPE)
+        if not (hashtype <= 0x03 or 0x81 <= hashtype <= 0x83):
+            raise ScriptError(SCRIPT_ERR_SCHNORR_SIG_HASHTYPE)
+        if hashtype & 3 == SIGHASH_SINGLE and self.input_index >= len(self.tx.vout):
+            raise ScriptError(SCRIPT_ERR_SCHNORR_SIG_HASHTYPE)
+        if sigversion == SIGVERSION_TAPSCRIPT:
+            sighash = TaprootSignatureHash(self.tx, self.spent_utxos, hashtype, self.input_index, scriptpath=True,
+                                           leaf_script=execdata.tapleaf_script, leaf_ver=execdata.leaf_version,
+                                           codeseparator_pos=execdata.codeseparator_pos, annex=execdata.annex, cache=self.cache)
+        else:
+            sighash = TaprootSignatureHash(self.tx, self.spent_utxos, hashtype, self.input_index, annex=execdata.annex, cache=self.cache)
+        if not verify_schnorr(pubkey, sig, sighash):
+            raise ScriptError(SCRIPT_ERR_SCHNORR_SIG)
+
+    def check_lock_time(self, lock_time):
+        tx_lock_time = self.tx.nLockTime
+        # Only compare lock times of the same kind (block height or time).
+        if (tx_lock_time < LOCKTIME_THRESHOLD) != (lock_time < LOCKTIME_THRESHOLD):
+            return False
+        if lock_time > tx_lock_time:
+            return False
+        # A final input would make the transaction's nLockTime ineffective.
+        return self.tx.vin[self.input_index].nSequence != SEQUENCE_FINAL
+
+    def check_sequence(self, sequence):
+        tx_sequence = self.tx.vin[self.input_index].nSequence
+        # Relative lock times (BIP68) require version 2, and must not be disabled on the input.
+        if self.tx.version < 2:
+            return False
+        if tx_sequence & SEQUENCE_LOCKTIME_DISABLE_FLAG:
+            return False
+        mask = SEQUENCE_LOCKTIME_TYPE_FLAG | SEQUENCE_LOCKTIME_MASK
+        tx_sequence &= mask
+        sequence &= mask
+        if (tx_sequence < SEQUENCE_LOCKTIME_TYPE_FLAG) != (sequence < SEQUENCE_LOCKTIME_TYPE_FLAG):
+            return False
+        return sequence <= tx_sequence
+
+
+def _eval_checksig_pre_tapscript(sig, pubkey, script, begincodehash, flags, checker, sigversion):
+    # The script code is the part of the script after the last executed OP_CODESEPARATOR.
+    script_code = CScript(script[begincodehash:])
+    # The signature is removed from pre-segwit script codes.
+    if sigversion == SIGVERSION_BASE:
+        script_code = _find_and_delete(script_code, sig, flags)
+    check_signature_encoding(sig, flags)
+    check_pubkey_encoding(pubkey, flags, sigversion)
+    success = checker.check_ecdsa_signature(sig, pubkey, script_code, sigversion)
+    if not success and flags & SCRIPT_VERIFY_NULLFAIL and len(sig):
+        raise ScriptError(SCRIPT_ERR_SIG_NULLFAIL)
+    return success
+
+
+def _find_and_delete(script_code, sig, flags):
+    try:
+        result = FindAndDelete(script_code, CScript([sig]))
+    except CScriptInvalidError:
+        return script_code
+    if len(result) != len(script_code) and flags & SCRIPT_VERIFY_CONST_SCRIPTCODE:
+        raise ScriptError(SCRIPT_ERR_SIG_FINDANDDELETE)
+    return result
+
+
+def _eval_checksig_tapscript(sig, pubkey, flags, checker, execdata):
+    # The order of these checks is consensus critical (see EvalChecksigTapscript).
+    success = len(sig) > 0
+    if success:
+        # Every non-empty signature uses up validation weight, even with an unknown key type.
+        execdata.validation_weight_left -= VALIDATION_WEIGHT_PER_SIGOP_PASSED
+        if execdata.validation_weight_left < 0:
+            raise ScriptError(SCRIPT_ERR_TAPSCRIPT_VALIDATION_WEIGHT)
+    if len(pubkey) == 0:
+        raise ScriptError(SCRIPT_ERR_TAPSCRIPT_EMPTY_PUBKEY)
+    elif len(pubkey) == 32:
+        if success:
+            checker.check_schnorr_signature(sig, pubkey, SIGVERSION_TAPSCRIPT, execdata)
+    elif flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_PUBKEYTYPE:
+        raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_PUBKEYTYPE)
+    return success
+
+
+def _eval_checksig(sig, pubkey, script, begincodehash, flags, checker, sigversion, execdata):
+    if sigversion == SIGVERSION_TAPSCRIPT:
+        return _eval_checksig_tapscript(sig, pubkey, flags, checker, execdata)
+    return _eval_checksig_pre_tapscript(sig, pubkey, script, begincodehash, flags, checker, sigversion)
+
+
+def eval_script(stack, script, flags, checker, sigversion, execdata=None):
+    """Execute a script on a stack (a list of bytes, modified in place), like EvalScript.
+
+    Raises ScriptError if the script fails."""
+    assert sigversion in (SIGVERSION_BASE, SIGVERSION_WITNESS_V0, SIGVERSION_TAPSCRIPT)
+    if execdata is None:
+        execdata = ScriptExecutionData()
+    legacy = sigversion != SIGVERSION_TAPSCRIPT
+    if legacy and len(script) > MAX_SCRIPT_SIZE:
+        raise ScriptError(SCRIPT_ERR_SCRIPT_SIZE)
+    script = CScript(script)
+    require_minimal = bool(flags & SCRIPT_VERIFY_MINIMALDATA)
+    altstack = []
+    # The condition stack, represented by its size and the position of the
+    # first false value (see ConditionStack).
+    exec_size = 0
+    first_false = None
+    begincodehash = 0
+    op_count = 0
+    execdata.codeseparator_pos = 0xffffffff
+
+    ops = script.raw_iter()
+    opcode_pos = -1
+    while True:
+        try:
+            opcode, data, sop_idx = next(ops)
+        except StopIteration:
+            break
+        except CScriptInvalidError:
+            raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+        opcode_pos += 1
+        executing = first_false is None
+
+        if data is not None and len(data) > MAX_SCRIPT_ELEMENT_SIZE:
+            raise ScriptError(SCRIPT_ERR_PUSH_SIZE)
+        # Note how OP_RESERVED does not count towards the opcode limit.
+        if legacy and opcode > OP_16:
+            op_count += 1
+            if op_count > MAX_OPS_PER_SCRIPT:
+                raise ScriptError(SCRIPT_ERR_OP_COUNT)
+        # Disabled opcodes (CVE-2010-5137) fail even in an unexecuted branch.
+        if opcode in DISABLED_OPCODES:
+            raise ScriptError(SCRIPT_ERR_DISABLED_OPCODE)
+        if opcode == OP_CODESEPARATOR and sigversion == SIGVERSION_BASE and flags & SCRIPT_VERIFY_CONST_SCRIPTCODE:
+            raise ScriptError(SCRIPT_ERR_OP_CODESEPARATOR)
+
+        if executing and opcode <= OP_PUSHDATA4:
+            if require_minimal and not check_minimal_push(data, opcode):
+                raise ScriptError(SCRIPT_ERR_MINIMALDATA)
+            stack.append(data)
+        elif executing or OP_IF <= opcode <= OP_ENDIF:
+            if opcode == OP_1NEGATE or OP_1 <= opcode <= OP_16:
+                stack.append(bn2vch(opcode - (OP_1 - 1)))
+
+            # Control
+            elif opcode == OP_NOP:
+                pass
+            elif opcode == OP_CHECKLOCKTIMEVERIFY:
+                # Without the flag, this is OP_NOP2.
+                if flags & SCRIPT_VERIFY_CHECKLOCKTIMEVERIFY:
+                    if len(stack) < 1:
+                        raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                    # Lock times are up to 5 bytes, to go beyond 2**31-1.
+                    lock_time = decode_script_num(stack[-1], require_minimal, 5)
+                    if lock_time < 0:
+                        raise ScriptError(SCRIPT_ERR_NEGATIVE_LOCKTIME)
+                    if not checker.check_lock_time(lock_time):
+                        raise ScriptError(SCRIPT_ERR_UNSATISFIED_LOCKTIME)
+                elif flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS:
+                    raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_NOPS)
+            elif opcode == OP_CHECKSEQUENCEVERIFY:
+                # Without the flag, this is OP_NOP3.
+                if flags & SCRIPT_VERIFY_CHECKSEQUENCEVERIFY:
+                    if len(stack) < 1:
+                        raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                    sequence = decode_script_num(stack[-1], require_minimal, 5)
+                    if sequence < 0:
+                        raise ScriptError(SCRIPT_ERR_NEGATIVE_LOCKTIME)
+                    # With the disable flag set in the operand, this is a NOP (for future soft forks).
+                    if not sequence & SEQUENCE_LOCKTIME_DISABLE_FLAG and not checker.check_sequence(sequence):
+                        raise ScriptError(SCRIPT_ERR_UNSATISFIED_LOCKTIME)
+                elif flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS:
+                    raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_NOPS)
+            elif opcode == OP_NOP1 or OP_NOP4 <= opcode <= OP_NOP10:
+                if flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_NOPS:
+                    raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_NOPS)
+            elif opcode == OP_IF or opcode == OP_NOTIF:
+                value = False
+                if executing:
+                    if len(stack) < 1:
+                        raise ScriptError(SCRIPT_ERR_UNBALANCED_CONDITIONAL)
+                    vch = stack[-1]
+                    # Tapscript requires minimal IF/NOTIF arguments as a consensus rule,
+                    # for witness v0 it is a policy rule.
+                    if sigversion == SIGVERSION_TAPSCRIPT and vch not in (b"", b"\x01"):
+                        raise ScriptError(SCRIPT_ERR_TAPSCRIPT_MINIMALIF)
+                    if sigversion == SIGVERSION_WITNESS_V0 and flags & SCRIPT_VERIFY_MINIMALIF and vch not in (b"", b"\x01"):
+                        raise ScriptError(SCRIPT_ERR_MINIMALIF)
+                    value = cast_to_bool(vch)
+                    if opcode == OP_NOTIF:
+                        value = not value
+                    stack.pop()
+                if first_false is None and not value:
+                    first_false = exec_size
+                exec_size += 1
+            elif opcode == OP_ELSE:
+                if exec_size == 0:
+                    raise ScriptError(SCRIPT_ERR_UNBALANCED_CONDITIONAL)
+                # Toggling anything but the first false value is unobservable.
+                if first_false is None:
+                    first_false = exec_size - 1
+                elif first_false == exec_size - 1:
+                    first_false = None
+            elif opcode == OP_ENDIF:
+                if exec_size == 0:
+                    raise ScriptError(SCRIPT_ERR_UNBALANCED_CONDITIONAL)
+                exec_size -= 1
+                if first_false == exec_size:
+                    first_false = None
+            elif opcode == OP_VERIFY:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                if not cast_to_bool(stack[-1]):
+                    raise ScriptError(SCRIPT_ERR_VERIFY)
+                stack.pop()
+            elif opcode == OP_RETURN:
+                raise ScriptError(SCRIPT_ERR_OP_RETURN)
+
+            # Stack ops
+            elif opcode == OP_TOALTSTACK:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                altstack.append(stack.pop())
+            elif opcode == OP_FROMALTSTACK:
+                if len(altstack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_ALTSTACK_OPERATION)
+                stack.append(altstack.pop())
+            elif opcode == OP_2DROP:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                del stack[-2:]
+            elif opcode == OP_2DUP:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.extend(stack[-2:])
+            elif opcode == OP_3DUP:
+                if len(stack) < 3:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.extend(stack[-3:])
+            elif opcode == OP_2OVER:
+                if len(stack) < 4:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.extend(stack[-4:-2])
+            elif opcode == OP_2ROT:
+                if len(stack) < 6:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                moved = stack[-6:-4]
+                del stack[-6:-4]
+                stack.extend(moved)
+            elif opcode == OP_2SWAP:
+                if len(stack) < 4:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack[-4:] = stack[-2:] + stack[-4:-2]
+            elif opcode == OP_IFDUP:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                if cast_to_bool(stack[-1]):
+                    stack.append(stack[-1])
+            elif opcode == OP_DEPTH:
+                stack.append(bn2vch(len(stack)))
+            elif opcode == OP_DROP:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.pop()
+            elif opcode == OP_DUP:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.append(stack[-1])
+            elif opcode == OP_NIP:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                del stack[-2]
+            elif opcode == OP_OVER:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.append(stack[-2])
+            elif opcode == OP_PICK or opcode == OP_ROLL:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                n = decode_script_num(stack[-1], require_minimal)
+                stack.pop()
+                if n < 0 or n >= len(stack):
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                vch = stack[-n - 1]
+                if opcode == OP_ROLL:
+                    del stack[-n - 1]
+                stack.append(vch)
+            elif opcode == OP_ROT:
+                if len(stack) < 3:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.append(stack.pop(-3))
+            elif opcode == OP_SWAP:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack[-2], stack[-1] = stack[-1], stack[-2]
+            elif opcode == OP_TUCK:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.insert(-2, stack[-1])
+            elif opcode == OP_SIZE:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                stack.append(bn2vch(len(stack[-1])))
+
+            # Bitwise logic
+            elif opcode == OP_EQUAL or opcode == OP_EQUALVERIFY:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                equal = stack.pop() == stack.pop()
+                if opcode == OP_EQUALVERIFY:
+                    if not equal:
+                        raise ScriptError(SCRIPT_ERR_EQUALVERIFY)
+                else:
+                    stack.append(_VCH_TRUE if equal else _VCH_FALSE)
+
+            # Numeric
+            elif OP_1ADD <= opcode <= OP_0NOTEQUAL:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                bn = decode_script_num(stack[-1], require_minimal)
+                if opcode == OP_1ADD:
+                    bn += 1
+                elif opcode == OP_1SUB:
+                    bn -= 1
+                elif opcode == OP_NEGATE:
+                    bn = -bn
+                elif opcode == OP_ABS:
+                    bn = abs(bn)
+                elif opcode == OP_NOT:
+                    bn = int(bn == 0)
+                elif opcode == OP_0NOTEQUAL:
+                    bn = int(bn != 0)
+                else:
+                    # OP_2MUL and OP_2DIV are disabled.
+                    raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+                stack[-1] = bn2vch(bn)
+            elif OP_ADD <= opcode <= OP_MAX:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                bn1 = decode_script_num(stack[-2], require_minimal)
+                bn2 = decode_script_num(stack[-1], require_minimal)
+                if opcode == OP_ADD:
+                    bn = bn1 + bn2
+                elif opcode == OP_SUB:
+                    bn = bn1 - bn2
+                elif opcode == OP_BOOLAND:
+                    bn = int(bn1 != 0 and bn2 != 0)
+                elif opcode == OP_BOOLOR:
+                    bn = int(bn1 != 0 or bn2 != 0)
+                elif opcode == OP_NUMEQUAL or opcode == OP_NUMEQUALVERIFY:
+                    bn = int(bn1 == bn2)
+                elif opcode == OP_NUMNOTEQUAL:
+                    bn = int(bn1 != bn2)
+                elif opcode == OP_LESSTHAN:
+                    bn = int(bn1 < bn2)
+                elif opcode == OP_GREATERTHAN:
+                    bn = int(bn1 > bn2)
+                elif opcode == OP_LESSTHANOREQUAL:
+                    bn = int(bn1 <= bn2)
+                elif opcode == OP_GREATERTHANOREQUAL:
+                    bn = int(bn1 >= bn2)
+                elif opcode == OP_MIN:
+                    bn = min(bn1, bn2)
+                elif opcode == OP_MAX:
+                    bn = max(bn1, bn2)
+                else:
+                    # OP_MUL, OP_DIV, OP_MOD, OP_LSHIFT and OP_RSHIFT are disabled.
+                    raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+                del stack[-2:]
+                if opcode == OP_NUMEQUALVERIFY:
+                    if not bn:
+                        raise ScriptError(SCRIPT_ERR_NUMEQUALVERIFY)
+                else:
+                    stack.append(bn2vch(bn))
+            elif opcode == OP_WITHIN:
+                if len(stack) < 3:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                bn1, bn2, bn3 = (decode_script_num(vch, require_minimal) for vch in stack[-3:])
+                del stack[-3:]
+                stack.append(_VCH_TRUE if bn2 <= bn1 < bn3 else _VCH_FALSE)
+
+            # Crypto
+            elif OP_RIPEMD160 <= opcode <= OP_HASH256:
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                vch = stack.pop()
+                if opcode == OP_RIPEMD160:
+                    stack.append(ripemd160(vch))
+                elif opcode == OP_SHA1:
+                    stack.append(hashlib.sha1(vch).digest())
+                elif opcode == OP_SHA256:
+                    stack.append(sha256(vch))
+                elif opcode == OP_HASH160:
+                    stack.append(hash160(vch))
+                else:
+                    stack.append(hash256(vch))
+            elif opcode == OP_CODESEPARATOR:
+                # Signature hashes only cover the script after the last executed OP_CODESEPARATOR.
+                begincodehash = sop_idx + 1
+                execdata.codeseparator_pos = opcode_pos
+            elif opcode == OP_CHECKSIG or opcode == OP_CHECKSIGVERIFY:
+                if len(stack) < 2:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                success = _eval_checksig(stack[-2], stack[-1], script, begincodehash, flags, checker, sigversion, execdata)
+                del stack[-2:]
+                if opcode == OP_CHECKSIGVERIFY:
+                    if not success:
+                        raise ScriptError(SCRIPT_ERR_CHECKSIGVERIFY)
+                else:
+                    stack.append(_VCH_TRUE if success else _VCH_FALSE)
+            elif opcode == OP_CHECKSIGADD:
+                if legacy:
+                    raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+                if len(stack) < 3:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                num = decode_script_num(stack[-2], require_minimal)
+                success = _eval_checksig(stack[-3], stack[-1], script, begincodehash, flags, checker, sigversion, execdata)
+                del stack[-3:]
+                stack.append(bn2vch(num + success))
+            elif opcode == OP_CHECKMULTISIG or opcode == OP_CHECKMULTISIGVERIFY:
+                if not legacy:
+                    raise ScriptError(SCRIPT_ERR_TAPSCRIPT_CHECKMULTISIG)
+                # ([sig ...] num_of_signatures [pubkey ...] num_of_pubkeys -- bool)
+                i = 1
+                if len(stack) < i:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                keys_count = decode_script_num(stack[-i], require_minimal)
+                if keys_count < 0 or keys_count > MAX_PUBKEYS_PER_MULTISIG:
+                    raise ScriptError(SCRIPT_ERR_PUBKEY_COUNT)
+                op_count += keys_count
+                if op_count > MAX_OPS_PER_SCRIPT:
+                    raise ScriptError(SCRIPT_ERR_OP_COUNT)
+                i += 1
+                ikey = i
+                # ikey2 is the position of the last non-signature item on the
+                # stack, used to check for NULLFAIL when cleaning up.
+                ikey2 = keys_count + 2
+                i += keys_count
+                if len(stack) < i:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                sigs_count = decode_script_num(stack[-i], require_minimal)
+                if sigs_count < 0 or sigs_count > keys_count:
+                    raise ScriptError(SCRIPT_ERR_SIG_COUNT)
+                i += 1
+                isig = i
+                i += sigs_count
+                if len(stack) < i:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+
+                script_code = CScript(script[begincodehash:])
+                # The signatures are removed from pre-segwit script codes.
+                if sigversion == SIGVERSION_BASE:
+                    for k in range(sigs_count):
+                        script_code = _find_and_delete(script_code, stack[-isig - k], flags)
+
+                success = True
+                while success and sigs_count > 0:
+                    sig = stack[-isig]
+                    pubkey = stack[-ikey]
+                    # This makes the order of pubkey/signature evaluation observable with STRICTENC.
+                    check_signature_encoding(sig, flags)
+                    check_pubkey_encoding(pubkey, flags, sigversion)
+                    if checker.check_ecdsa_signature(sig, pubkey, script_code, sigversion):
+                        isig += 1
+                        sigs_count -= 1
+                    ikey += 1
+                    keys_count -= 1
+                    # Fail early if more signatures than keys are left.
+                    if sigs_count > keys_count:
+                        success = False
+
+                # Clean up the arguments; on failure, all signatures must be empty with NULLFAIL.
+                while i > 1:
+                    i -= 1
+                    if not success and flags & SCRIPT_VERIFY_NULLFAIL and not ikey2 and len(stack[-1]):
+                        raise ScriptError(SCRIPT_ERR_SIG_NULLFAIL)
+                    if ikey2 > 0:
+                        ikey2 -= 1
+                    stack.pop()
+
+                # A bug makes CHECKMULTISIG consume an extra, unchecked argument.
+                if len(stack) < 1:
+                    raise ScriptError(SCRIPT_ERR_INVALID_STACK_OPERATION)
+                if flags & SCRIPT_VERIFY_NULLDUMMY and len(stack[-1]):
+                    raise ScriptError(SCRIPT_ERR_SIG_NULLDUMMY)
+                stack.pop()
+
+                if opcode == OP_CHECKMULTISIGVERIFY:
+                    if not success:
+                        raise ScriptError(SCRIPT_ERR_CHECKMULTISIGVERIFY)
+                else:
+                    stack.append(_VCH_TRUE if success else _VCH_FALSE)
+            else:
+                raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+
+        if len(stack) + len(altstack) > MAX_STACK_SIZE:
+            raise ScriptError(SCRIPT_ERR_STACK_SIZE)
+
+    if exec_size != 0:
+        raise ScriptError(SCRIPT_ERR_UNBALANCED_CONDITIONAL)
+
+
+def _execute_witness_script(stack, script, flags, sigversion, checker, execdata):
+    stack = list(stack)
+    if sigversion == SIGVERSION_TAPSCRIPT:
+        # OP_SUCCESSx overrides everything, including the stack element size limits.
+        try:
+            for opcode, _, _ in CScript(script).raw_iter():
+                if is_op_success(opcode):
+                    if flags & SCRIPT_VERIFY_DISCOURAGE_OP_SUCCESS:
+                        raise ScriptError(SCRIPT_ERR_DISCOURAGE_OP_SUCCESS)
+                    return
+        except CScriptInvalidError:
+            raise ScriptError(SCRIPT_ERR_BAD_OPCODE)
+        if len(stack) > MAX_STACK_SIZE:
+            raise ScriptError(SCRIPT_ERR_STACK_SIZE)
+    if any(len(elem) > MAX_SCRIPT_ELEMENT_SIZE for elem in stack):
+        raise ScriptError(SCRIPT_ERR_PUSH_SIZE)
+    eval_script(stack, script, flags, checker, sigversion, execdata)
+    # Witness scripts implicitly require a clean stack.
+    if len(stack) != 1:
+        raise ScriptError(SCRIPT_ERR_CLEANSTACK)
+    if not cast_to_bool(stack[-1]):
+        raise ScriptError(SCRIPT_ERR_EVAL_FALSE)
+
+
+def compute_taproot_merkle_root(control, tapleaf_hash):
+    """Compute the Merkle root of a taproot script tree from a control block and a leaf hash."""
+    k = tapleaf_hash
+    for pos in range(TAPROOT_CONTROL_BASE_SIZE, len(control), TAPROOT_CONTROL_NODE_SIZE):
+        node = control[pos:pos + TAPROOT_CONTROL_NODE_SIZE]
+        k = TaggedHash("TapBranch", k + node if k < node else node + k)
+    return k
+
+
+def _verify_taproot_commitment(control, program, tapleaf_hash):
+    merkle_root = compute_taproot_merkle_root(control, tapleaf_hash)
+    internal_pubkey = control[1:TAPROOT_CONTROL_BASE_SIZE]
+    tweaked = tweak_add_pubkey(internal_pubkey, TaggedHash("TapTweak", internal_pubkey + merkle_root))
+    return tweaked is not None and tweaked[0] == program and tweaked[1] == (control[0] & 1)
+
+
+def _witness_size(stack):
+    return len(ser_compact_size(len(stack))) + sum(len(ser_string(elem)) for elem in stack)
+
+
+def verify_witness_program(witness, version, program, flags, checker, is_p2sh):
+    """Verify the witness of a witness program, like VerifyWitnessProgram."""
+    stack = list(witness)
+    execdata = ScriptExecutionData()
+    if version == 0:
+        if len(program) == 32:
+            # P2WSH: the program is the SHA256 of the witness script (BIP141).
+            if len(stack) == 0:
+                raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_WITNESS_EMPTY)
+            script = stack.pop()
+            if sha256(script) != program:
+                raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH)
+            _execute_witness_script(stack, script, flags, SIGVERSION_WITNESS_V0, checker, execdata)
+        elif len(program) == 20:
+            # P2WPKH: the program is the HASH160 of the public key (BIP141).
+            if len(stack) != 2:
+                raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH)
+            script = CScript([OP_DUP, OP_HASH160, program, OP_EQUALVERIFY, OP_CHECKSIG])
+            _execute_witness_script(stack, script, flags, SIGVERSION_WITNESS_V0, checker, execdata)
+        else:
+            raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_WRONG_LENGTH)
+    elif version == 1 and len(program) == 32 and not is_p2sh:
+        # Taproot: the program is a tweaked public key (BIP341).
+        if not flags & SCRIPT_VERIFY_TAPROOT:
+            return
+        if len(stack) == 0:
+            raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_WITNESS_EMPTY)
+        if len(stack) >= 2 and len(stack[-1]) > 0 and stack[-1][0] == ANNEX_TAG:
+            execdata.annex = stack.pop()
+        if len(stack) == 1:
+            # Key path spending.
+            checker.check_schnorr_signature(stack[0], program, SIGVERSION_TAPROOT, execdata)
+            return
+        # Script path spending.
+        control = stack.pop()
+        script = stack.pop()
+        if (len(control) < TAPROOT_CONTROL_BASE_SIZE or len(control) > TAPROOT_CONTROL_MAX_SIZE or
+                (len(control) - TAPROOT_CONTROL_BASE_SIZE) % TAPROOT_CONTROL_NODE_SIZE != 0):
+            raise ScriptError(SCRIPT_ERR_TAPROOT_WRONG_CONTROL_SIZE)
+        leaf_version = control[0] & TAPROOT_LEAF_MASK
+        tapleaf_hash = TaggedHash("TapLeaf", bytes([leaf_version]) + ser_string(script))
+        if not _verify_taproot_commitment(control, program, tapleaf_hash):
+            raise ScriptError(SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH)
+        execdata.tapleaf_script = script
+        execdata.leaf_version = leaf_version
+        if leaf_version == LEAF_VERSION_TAPSCRIPT:
+            execdata.validation_weight_left = _witness_size(witness) + VALIDATION_WEIGHT_OFFSET
+            _execute_witness_script(stack, script, flags, SIGVERSION_TAPSCRIPT, checker, execdata)
+        elif flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_TAPROOT_VERSION:
+            raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_TAPROOT_VERSION)
+    elif not is_p2sh and version == 1 and program == b"\x4e\x73":
+        # Pay-to-anchor.
+        return
+    elif flags & SCRIPT_VERIFY_DISCOURAGE_UPGRADABLE_WITNESS_PROGRAM:
+        raise ScriptError(SCRIPT_ERR_DISCOURAGE_UPGRADABLE_WITNESS_PROGRAM)
+
+
+def verify_script(script_sig, script_pubkey, witness, flags, checker):
+    """Verify a spend, like VerifyScript. witness is a list of bytes (possibly empty).
+
+    Raises ScriptError if the spend is invalid."""
+    if flags & SCRIPT_VERIFY_SIGPUSHONLY and not is_push_only(script_sig):
+        raise ScriptError(SCRIPT_ERR_SIG_PUSHONLY)
+
+    # scriptSig and scriptPubKey are evaluated on the same stack, not
+    # concatenated (see CVE-2010-5141).
+    stack = []
+    eval_script(stack, script_sig, flags, checker, SIGVERSION_BASE)
+    stack_copy = list(stack)
+    eval_script(stack, script_pubkey, flags, checker, SIGVERSION_BASE)
+    if not stack or not cast_to_bool(stack[-1]):
+        raise ScriptError(SCRIPT_ERR_EVAL_FALSE)
+
+    had_witness = False
+    program = witness_program(script_pubkey) if flags & SCRIPT_VERIFY_WITNESS else None
+    if program is not None:
+        had_witness = True
+        # The scriptSig must be exactly empty, otherwise this reintroduces malleability.
+        if len(script_sig) != 0:
+            raise ScriptError(SCRIPT_ERR_WITNESS_MALLEATED)
+        verify_witness_program(witness, *program, flags, checker, is_p2sh=False)
+        # The stack is not clean for witness programs, so bypass the cleanstack check.
+        stack = stack[:1]
+
+    if flags & SCRIPT_VERIFY_P2SH and is_p2sh(script_pubkey):
+        if not is_push_only(script_sig):
+            raise ScriptError(SCRIPT_ERR_SIG_PUSHONLY)
+        # Evaluate the redeem script on the stack left by the scriptSig.
+        stack = stack_copy
+        redeem_script = stack.pop()
+        eval_script(stack, redeem_script, flags, checker, SIGVERSION_BASE)
+        if not stack or not cast_to_bool(stack[-1]):
+            raise ScriptError(SCRIPT_ERR_EVAL_FALSE)
+        program = witness_program(redeem_script) if flags & SCRIPT_VERIFY_WITNESS else None
+        if program is not None:
+            had_witness = True
+            # The scriptSig must be exactly a push of the redeem script.
+            if script_sig != CScript([redeem_script]):
+                raise ScriptError(SCRIPT_ERR_WITNESS_MALLEATED_P2SH)
+            verify_witness_program(witness, *program, flags, checker, is_p2sh=True)
+            stack = stack[:1]
+
+    # The clean stack check is only done after P2SH and witness evaluation,
+    # which leave their inputs on the stack.
+    if flags & SCRIPT_VERIFY_CLEANSTACK:
+        assert flags & SCRIPT_VERIFY_P2SH and flags & SCRIPT_VERIFY_WITNESS
+        if len(stack) != 1:
+            raise ScriptError(SCRIPT_ERR_CLEANSTACK)
+
+    if flags & SCRIPT_VERIFY_WITNESS:
+        assert flags & SCRIPT_VERIFY_P2SH
+        if not had_witness and len(witness) > 0:
+            raise ScriptError(SCRIPT_ERR_WITNESS_UNEXPECTED)
+
+
+def verify_input(tx, input_index, spent_utxos, flags=STANDARD_SCRIPT_VERIFY_FLAGS, *, cache=None):
+    """Verify the scriptSig and witness of an input of tx.
+
+    spent_utxos are the CTxOuts spent by all inputs of tx. Pass the same
+    SighashCache(tx, spent_utxos) when verifying several inputs of a
+    transaction. Raises ScriptError if the input is invalid."""
+    spent = spent_utxos[input_index]
+    witness = tx.wit.vtxinwit[input_index].scriptWitness.stack if input_index < len(tx.wit.vtxinwit) else []
+    checker = TransactionSignatureChecker(tx, input_index, spent.nValue, spent_utxos, cache=cache)
+    verify_script(tx.vin[input_index].scriptSig, spent.scriptPubKey, witness, flags, checker)
+
+
+def verify_inputs(tx, spent_utxos, flags=STANDARD_SCRIPT_VERIFY_FLAGS, input_indices=None):
+    """Verify inputs of tx (all by default).
+
+    Returns a list with the error message (None if valid) of each verified input."""
+    if input_indices is None:
+        input_indices = range(len(tx.vin))
+    cache = SighashCache(tx, spent_utxos)
+    errors = []
+    for i in input_indices:
+        try:
+            verify_input(tx, i, spent_utxos, flags, cache=cache)
+            errors.append(None)
+        except ScriptError as e:
+            errors.append(str(e))
+    return errors
+
+
+class TestFrameworkInterpreter(unittest.TestCase):
+    def spend(self, script_pubkey, amount=50000):
+        """Return a transaction spending an output with script_pubkey, and the spent outputs."""
+        tx = CTransaction()
+        tx.version = 2
+        tx.vin = [CTxIn(COutPoint(0x1234, 1), nSequence=0)]
+        tx.vout = [CTxOut(amount - 1000, CScript([OP_1]))]
+        tx.wit.vtxinwit = [CTxInWitness()]
+        return tx, [CTxOut(amount, script_pubkey)]
+
+    def assert_error(self, tx, spent, error, flags=STANDARD_SCRIPT_VERIFY_FLAGS):
+        self.assertEqual(verify_inputs(tx, spent, flags), [error])
+
+    def test_script_num(self):
+        for value in (0, 1, -1, 127, 128, -255, 256, 2**31 - 1, -2**31 + 1):
+            self.assertEqual(decode_script_num(bn2vch(value), True), value)
+        self.assertEqual(decode_script_num(b"\x01\x00", False), 1)
+        for vch, require_minimal in ((b"\x01\x00", True), (b"\x80", True), (b"\x00\x00\x00\x00\x01", False)):
+            with self.assertRaises(ScriptError):
+                decode_script_num(vch, require_minimal)
+        self.assertFalse(cast_to_bool(b"\x00\x80"))
+        self.assertTrue(cast_to_bool(b"\x80\x00"))
+
+    def test_eval_script(self):
+        def run(script, flags=SCRIPT_VERIFY_NONE):
+            stack = []
+            eval_script(stack, CScript(script), flags, BaseSignatureChecker(), SIGVERSION_BASE)
+            return stack
+        self.assertEqual(run([2, 3, OP_ADD, OP_DUP, 5, OP_NUMEQUALVERIFY]), [b"\x05"])
+        self.assertEqual(run([1, OP_IF, 2, OP_ELSE, 3, OP_ENDIF, OP_0, OP_NOTIF, 4, OP_ENDIF]), [b"\x02", b"\x04"])
+        self.assertEqual(run([1, 2, 3, OP_ROT, OP_DEPTH, OP_1SUB, OP_PICK]), [b"\x02", b"\x03", b"\x01", b"\x02"])
+        self.assertEqual(run([b"abc", OP_SIZE, OP_SWAP, OP_SHA256]), [b"\x03", sha256(b"abc")])
+        for script, error in (
+            ([OP_0, OP_IF], SCRIPT_ERR_UNBALANCED_CONDITIONAL),
+            ([OP_0, OP_IF, OP_CAT, OP_ENDIF], SCRIPT_ERR_DISABLED_OPCODE),
+            ([OP_ADD], SCRIPT_ERR_INVALID_STACK_OPERATION),
+            ([OP_RETURN], SCRIPT_ERR_OP_RETURN),
+            ([b"\x00" * 521], SCRIPT_ERR_PUSH_SIZE),
+            ([OP_NOP] * 202, SCRIPT_ERR_OP_COUNT),
+            ([1] * 1001, SCRIPT_ERR_STACK_SIZE),
+            (CScript(bytes([OP_PUSHDATA1, 1, 2])), None),
+            (CScript(bytes([OP_PUSHDATA1, 2, 2])), SCRIPT_ERR_BAD_OPCODE),
+        ):
+            if error is None:
+                run(script)
+                with self.assertRaisesRegex(ScriptError, SCRIPT_ERR_MINIMALDATA):
+                    run(script, SCRIPT_VERIFY_MINIMALDATA)
+                continue
+            with self.assertRaisesRegex(ScriptError, error):
+                run(script)
+
+    def test_legacy_and_segwit_v0(self):
+        key = ECKey()
+        key.set(bytes([1] * 32), True)
+        pubkey = key.get_pubkey().get_bytes()
+        multisig = CScript([OP_1, pubkey, pubkey, 2, OP_CHECKMULTISIG])
+
+        tx, spent = self.spend(CScript([OP_DUP, OP_HASH160, hash160(pubkey), OP_EQUALVERIFY, OP_CHECKSIG]))
+        sig = key.sign_ecdsa(LegacySignatureHash(spent[0].scriptPubKey, tx, 0, SIGHASH_ALL)[0]) + bytes([SIGHASH_ALL])
+        tx.vin[0].scriptSig = CScript([sig, pubkey])
+        self.assert_error(tx, spent, None)
+        tx.vin[0].scriptSig = CScript([sig[:-1] + bytes([SIGHASH_NONE]), pubkey])
+        self.assert_error(tx, spent, SCRIPT_ERR_SIG_NULLFAIL)
+        self.assert_error(tx, spent, SCRIPT_ERR_EVAL_FALSE, MANDATORY_SCRIPT_VERIFY_FLAGS)
+
+        tx, spent = self.spend(CScript([OP_HASH160, hash160(multisig), OP_EQUAL]))
+        sig = key.sign_ecdsa(LegacySignatureHash(multisig, tx, 0, SIGHASH_SINGLE)[0]) + bytes([SIGHASH_SINGLE])
+        tx.vin[0].scriptSig = CScript([OP_0, sig, multisig])
+        self.assert_error(tx, spent, None)
+        tx.vin[0].scriptSig = CScript([OP_1, sig, multisig])
+        self.assert_error(tx, spent, SCRIPT_ERR_SIG_NULLDUMMY)
+        self.assert_error(tx, spent, None, SCRIPT_VERIFY_P2SH)
+
+        tx, spent = self.spend(CScript([OP_0, sha256(multisig)]))
+        sig = key.sign_ecdsa(SegwitV0SignatureHash(multisig, tx, 0, SIGHASH_ALL, spent[0].nValue)) + bytes([SIGHASH_ALL])
+        tx.wit.vtxinwit[0].scriptWitness.stack = [b"", sig, multisig]
+        self.assert_error(tx, spent, None)
+        spent[0].nValue += 1
+        self.assert_error(tx, spent, SCRIPT_ERR_SIG_NULLFAIL)
+        tx.wit.vtxinwit[0].scriptWitness.stack = [b"", sig, bytes(multisig) + b"\x61"]
+        self.assert_error(tx, spent, SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH)
+
+    def test_taproot(self):
+        privkey = bytes([2] * 32)
+        pubkey, _ = compute_xonly_pubkey(privkey)
+        scripts = [("pk", CScript([pubkey, OP_CHECKSIG])), ("csa", CScript([OP_0, pubkey, OP_CHECKSIGADD, 1, OP_NUMEQUAL])),
+                   ("success", CScript(bytes([0x50])))]
+        tap = taproot_construct(pubkey, scripts)
+        tx, spent = self.spend(tap.scriptPubKey)
+
+        sighash = TaprootSignatureHash(tx, spent, SIGHASH_DEFAULT, 0)
+        tx.wit.vtxinwit[0].scriptWitness.stack = [sign_schnorr(tweak_add_privkey(privkey, tap.tweak), sighash)]
+        self.assert_error(tx, spent, None)
+        tx.wit.vtxinwit[0].scriptWitness.stack[0] += bytes([SIGHASH_ALL])
+        self.assert_error(tx, spent, SCRIPT_ERR_SCHNORR_SIG)
+        tx.wit.vtxinwit[0].scriptWitness.stack[0] = tx.wit.vtxinwit[0].scriptWitness.stack[0][:64] + bytes([SIGHASH_DEFAULT])
+        self.assert_error(tx, spent, SCRIPT_ERR_SCHNORR_SIG_HASHTYPE)
+
+        for name in ("pk", "csa"):
+            leaf = tap.leaves[name]
+            control = bytes([leaf.version + tap.negflag]) + pubkey + leaf.merklebranch
+            sighash = TaprootSignatureHash(tx, spent, SIGHASH_NONE, 0, scriptpath=True, leaf_script=leaf.script, codeseparator_pos=0xffffffff)
+            sig = sign_schnorr(privkey, sighash) + bytes([SIGHASH_NONE])
+            tx.wit.vtxinwit[0].scriptWitness.stack = [sig, leaf.script, control]
+            self.assert_error(tx, spent, None)
+            tx.wit.vtxinwit[0].scriptWitness.stack = [b"", leaf.script, control]
+            self.assert_error(tx, spent, SCRIPT_ERR_EVAL_FALSE)
+            tx.wit.vtxinwit[0].scriptWitness.stack = [sig, leaf.script, control[:-1]]
+            self.assert_error(tx, spent, SCRIPT_ERR_TAPROOT_WRONG_CONTROL_SIZE)
+            tx.wit.vtxinwit[0].scriptWitness.stack = [sig, leaf.script, control[:1] + bytes(32) + control[33:]]
+            self.assert_error(tx, spent, SCRIPT_ERR_WITNESS_PROGRAM_MISMATCH)
+
+        leaf = tap.leaves["success"]
+        tx.wit.vtxinwit[0].scriptWitness.stack = [leaf.script, bytes([leaf.version + tap.negflag]) + pubkey + leaf.merklebranch]
+        self.assert_error(tx, spent, SCRIPT_ERR_DISCOURAGE_OP_SUCCESS)
+        self.assert_error(tx, spent, None, MANDATORY_SCRIPT_VERIFY_FLAGS)
@@ -14,6 +14,7 @@ import random
 import unittest
 
 from test_framework.crypto import secp256k1
+from test_framework.crypto.libsecp256k1 import LibSecp256k1, find_library
 from test_framework.util import assert_not_equal, random_bitflip
 
 # Point with no known discrete log.
@@ -22,11 +23,40 @@ H_POINT = "50929b74c1a04954b78b4b6035e97a5e078a5a0f28ec96d547bfee9ace803ac0"
 # Order of the secp256k1 curve
 ORDER = secp256k1.GE.ORDER
 
+# Shared libsecp256k1 used instead of the Python implementation if available
+# (see load_libsecp256k1).
+_libsecp256k1 = None
+
+def load_libsecp256k1(builddir=None):
+    """Use a shared libsecp256k1 library for signing and verification if one is found.
+
+    See crypto/libsecp256k1.py for where it is looked for. Returns the path of
+    the loaded library, or None if the Python implementation is used.
+    Operations with deliberately non-standard behavior (flip_p, flip_r,
+    low_s=False signing) always use the Python implementation."""
+    global _libsecp256k1
+    path = find_library(builddir)
+    if path is None:
+        return None
+    try:
+        _libsecp256k1 = LibSecp256k1(path)
+    except (OSError, AttributeError):
+        # Not a usable library, or one without the required modules.
+        return None
+    return path
+
+# SHA256 states after hashing the prefix sha256(tag) || sha256(tag), per tag.
+_TAGGED_HASH_MIDSTATES: dict[str, "hashlib._Hash"] = {}
+
 def TaggedHash(tag, data):
-    ss = hashlib.sha256(tag.encode('utf-8')).digest()
-    ss += ss
-    ss += data
-    return hashlib.sha256(ss).digest()
+    midstate = _TAGGED_HASH_MIDSTATES.get(tag)
+    if midstate is None:
+        tag_hash = hashlib.sha256(tag.encode('utf-8')).digest()
+        midstate = hashlib.sha256(tag_hash + tag_hash)
+        _TAGGED_HASH_MIDSTATES[tag] = midstate
+    ss = midstate.copy()
+    ss.update(data)
+    return ss.digest()
 
 
 class ECPubKey:
@@ -101,6 +131,8 @@ class ECPubKey:
             return False
         if low_s and s >= secp256k1.GE.ORDER_HALF:
             return False
+        if _libsecp256k1 is not None and len(msg) == 32:
+            return _libsecp256k1.ecdsa_verify(self.p.to_bytes_uncompressed(), r, s, msg)
         z = int.from_bytes(msg, 'big')
 
         # Run verifier algorithm on r, s
@@ -160,7 +192,10 @@ class ECKey:
         """Compute an ECPubKey object for this secret key."""
         assert self.valid
         ret = ECPubKey()
-        ret.p = self.secret * secp256k1.G
+        if _libsecp256k1 is not None:
+            ret.p = secp256k1.GE.from_bytes(_libsecp256k1.pubkey_create(self.get_bytes(), False))
+        else:
+            ret.p = self.secret * secp256k1.G
         ret.compressed = self.compressed
         return ret
 
@@ -176,6 +211,9 @@ class ECKey:
             k = int.from_bytes(rfc6979_nonce(self.secret.to_bytes(32, 'big') + msg), 'big')
         else:
             k = random.randrange(1, ORDER)
+        if _libsecp256k1 is not None and low_s and len(msg) == 32:
+            # The library signs with k as nonce, so the signature is the same.
+            return _libsecp256k1.ecdsa_sign(self.get_bytes(), msg, (k % ORDER).to_bytes(32, 'big'))
         R = k * secp256k1.G
         r = int(R.x) % ORDER
         s = (pow(k, -1, ORDER) * (z + self.secret * r)) % ORDER
@@ -188,6 +226,42 @@ class ECKey:
         sb = s.to_bytes((s.bit_length() + 8) // 8, 'big')
         return b'\x30' + bytes([4 + len(rb) + len(sb), 2, len(rb)]) + rb + bytes([2, len(sb)]) + sb
 
+def derive_pubkeys(secrets, compressed=True):
+    """Compute the ECPubKey objects for a list of 32-byte private keys.
+
+    This is much faster than calling ECKey.get_pubkey() for every key: the
+    points are computed with the shared table of multiples of G and converted
+    to affine coordinates with a single field inversion for all of them."""
+    xs = [int.from_bytes(secret, 'big') for secret in secrets]
+    assert all(0 < x < ORDER for x in xs)
+    if _libsecp256k1 is not None:
+        points = [secp256k1.GE.from_bytes(_libsecp256k1.pubkey_create(secret, False)) for secret in secrets]
+    else:
+        points = secp256k1.FAST_G.mul_batch(xs)
+    pubkeys = []
+    for P in points:
+        pubkey = ECPubKey()
+        pubkey.p = P
+        pubkey.compressed = compressed
+        pubkeys.append(pubkey)
+    return pubkeys
+
+def derive_xonly_pubkeys(secrets):
+    """Compute the x-only public keys for a list of 32-byte private keys.
+
+    Returns the same (key, negated) tuples as compute_xonly_pubkey, but
+    computes them together like derive_pubkeys."""
+    xs = [int.from_bytes(secret, 'big') for secret in secrets]
+    valid = [i for i, x in enumerate(xs) if 0 < x < ORDER]
+    result = [(None, None)] * len(secrets)
+    if _libsecp256k1 is not None:
+        for i in valid:
+            result[i] = _libsecp256k1.xonly_pubkey(secrets[i])
+        return result
+    for i, P in zip(valid, secp256k1.FAST_G.mul_batch([xs[i] for i in valid])):
+        result[i] = (P.to_bytes_xonly(), not P.y.is_even())
+    return result
+
 def compute_xonly_pubkey(key):
     """Compute an x-only (32 byte) public key from a (32 byte) private key.
 
@@ -198,6 +272,8 @@ def compute_xonly_pubkey(key):
     x = int.from_bytes(key, 'big')
     if x == 0 or x >= ORDER:
         return (None, None)
+    if _libsecp256k1 is not None:
+        return _libsecp256k1.xonly_pubkey(key)
     P = x * secp256k1.G
     return (P.to_bytes_xonly(), not P.y.is_even())
 
@@ -210,7 +286,11 @@ def tweak_add_privkey(key, tweak):
     x = int.from_bytes(key, 'big')
     if x == 0 or x >= ORDER:
         return None
-    if not (x * secp256k1.G).y.is_even():
+    if _libsecp256k1 is not None:
+        negated = _libsecp256k1.xonly_pubkey(key)[1]
+    else:
+        negated = not (x * secp256k1.G).y.is_even()
+    if negated:
        x = ORDER - x
     t = int.from_bytes(tweak, 'big')
     if t >= ORDER:
@@ -226,6 +306,8 @@ def tweak_add_pubkey(key, tweak):
     assert len(key) == 32
     assert len(tweak) == 32
 
+    if _libsecp256k1 is not None:
+        return _libsecp256k1.xonly_tweak_add(key, tweak)
     P = secp256k1.GE.from_bytes_xonly(key)
     if P is None:
         return None
@@ -247,6 +329,8 @@ def verify_schnorr(key, sig, msg):
     assert len(key) == 32
     assert len(sig) == 64
 
+    if _libsecp256k1 is not None:
+        return _libsecp256k1.schnorr_verify(key, sig, msg)
     P = secp256k1.GE.from_bytes_xonly(key)
     if P is None:
         return False
@@ -264,6 +348,69 @@ def verify_schnorr(key, sig, msg):
         return False
     return True
 
+def verify_schnorr_batch(items):
+    """Verify a batch of Schnorr signatures (see BIP 340, "Batch Verification").
+
+    - items is a list of (key, sig, msg) tuples, as passed to verify_schnorr.
+
+    Returns whether all signatures are valid. Instead of checking
+    s*G == R + e*P for every signature, this checks a random linear
+    combination of those equations with a single multi-scalar multiplication,
+    which is much faster than verifying the signatures one by one. Use
+    find_invalid_schnorr to find out which signatures are invalid.
+
+    The weights of the combination are derived from a hash of the whole batch
+    (as suggested by BIP 340), so the result is deterministic and the random
+    module's state is left alone.
+    """
+    seed = TaggedHash("BIP0340/batch", b"".join(key + sig + len(msg).to_bytes(4, 'big') + msg for key, sig, msg in items))
+    # The scalars for G, for every public key (keys may be shared between
+    # signatures) and for the R of every signature.
+    g_scalar = 0
+    key_terms = {}
+    r_terms = []
+    for i, (key, sig, msg) in enumerate(items):
+        assert len(key) == 32
+        assert len(sig) == 64
+        if key not in key_terms:
+            key_terms[key] = [secp256k1.GE.from_bytes_xonly(key), 0]
+        if key_terms[key][0] is None:
+            return False
+        R = secp256k1.GE.from_bytes_xonly(sig[0:32])
+        if R is None:
+            return False
+        s = int.from_bytes(sig[32:64], 'big')
+        if s >= ORDER:
+            return False
+        e = int.from_bytes(TaggedHash("BIP0340/challenge", sig[0:32] + key + msg), 'big') % ORDER
+        # Random weight for every equation but the first. 128 bits are enough
+        # to make passing with an invalid signature negligibly unlikely, and
+        # halve the cost of the a_i * R_i terms.
+        a = 1 if i == 0 else int.from_bytes(TaggedHash("BIP0340/batch", seed + i.to_bytes(4, 'big'))[:16], 'big') or 1
+        g_scalar += a * s
+        key_terms[key][1] += a * e
+        r_terms.append((a, -R))
+    # sum(a_i * s_i) * G - sum(a_i * R_i) - sum(a_i * e_i * P_i) must be infinity.
+    terms = [(g_scalar, secp256k1.G)] + [(ORDER - e % ORDER, P) for P, e in key_terms.values()] + r_terms
+    return secp256k1.GE.mul(*terms).infinity
+
+def find_invalid_schnorr(items):
+    """Return the indices of the invalid signatures in a batch (see verify_schnorr_batch).
+
+    Valid parts of the batch are recognized with batch verification, by
+    repeatedly splitting the parts that fail in halves."""
+    invalid = []
+    todo = [(0, len(items))]
+    while todo:
+        start, end = todo.pop()
+        if end - start == 1:
+            if not verify_schnorr(*items[start]):
+                invalid.append(start)
+        elif end > start and not verify_schnorr_batch(items[start:end]):
+            mid = (start + end) // 2
+            todo += [(mid, end), (start, mid)]
+    return invalid
+
 def sign_schnorr(key, msg, aux=None, flip_p=False, flip_r=False):
     """Create a Schnorr signature (see BIP 340)."""
 
@@ -276,6 +423,8 @@ def sign_schnorr(key, msg, aux=None, flip_p=False, flip_r=False):
     sec = int.from_bytes(key, 'big')
     if sec == 0 or sec >= ORDER:
         return None
+    if _libsecp256k1 is not None and not flip_p and not flip_r:
+        return _libsecp256k1.schnorr_sign(key, msg, aux)
     P = sec * secp256k1.G
     if P.y.is_even() == flip_p:
         sec = ORDER - sec
@@ -312,6 +461,25 @@ class TestFrameworkKey(unittest.TestCase):
                     self.assertFalse(verify_pubkey.verify_ecdsa(sig_ecdsa, msg))
                     self.assertFalse(verify_schnorr(verify_xonly_pubkey, sig_schnorr, msg))
 
+    def test_derive_pubkeys(self):
+        secrets = [generate_privkey() for _ in range(20)]
+        for compressed in (True, False):
+            expected = []
+            for secret in secrets:
+                key = ECKey()
+                key.set(secret, compressed)
+                expected.append(key.get_pubkey().get_bytes())
+            self.assertEqual([pubkey.get_bytes() for pubkey in derive_pubkeys(secrets, compressed)], expected)
+        secrets += [bytes(32), ORDER.to_bytes(32, 'big')]
+        self.assertEqual(derive_xonly_pubkeys(secrets), [compute_xonly_pubkey(secret) for secret in secrets])
+        self.assertEqual(derive_pubkeys([]), [])
+
+    def test_tagged_hash(self):
+        for tag in ("TapLeaf", "TapLeaf", "BIP0340/challenge", ""):
+            for data in (b"", b"\x01" * 100):
+                tag_hash = hashlib.sha256(tag.encode('utf-8')).digest()
+                self.assertEqual(TaggedHash(tag, data), hashlib.sha256(tag_hash + tag_hash + data).digest())
+
     def test_schnorr_testvectors(self):
         """Implement the BIP340 test vectors (read from bip340_test_vectors.csv)."""
         num_tests = 0
@@ -343,3 +511,88 @@ class TestFrameworkKey(unittest.TestCase):
                     self.assertEqual(result, result_actual, "BIP340 test vector %i (%s): verification succeeded unexpectedly" % (i, comment))
                 num_tests += 1
         self.assertTrue(num_tests >= 15) # expect at least 15 test vectors
+
+    def test_schnorr_batch(self):
+        """Test batch verification of Schnorr signatures."""
+        vectors_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bip340_test_vectors.csv')
+        with open(vectors_file, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader)
+            vectors = [(bytes.fromhex(row[2]), bytes.fromhex(row[5]), bytes.fromhex(row[4]), row[6] == 'TRUE') for row in reader]
+        # Add signatures by a few keys, some of them for the same key.
+        privkeys = [generate_privkey() for _ in range(3)]
+        for i in range(10):
+            privkey = privkeys[i % len(privkeys)]
+            msg = bytes([i]) * 32
+            vectors.append((compute_xonly_pubkey(privkey)[0], sign_schnorr(privkey, msg), msg, True))
+        items = [(key, sig, msg) for key, sig, msg, _ in vectors]
+        valid = [item for item, (_, _, _, result) in zip(items, vectors) if result]
+        invalid = [i for i, (_, _, _, result) in enumerate(vectors) if not result]
+        self.assertTrue(invalid)
+        self.assertTrue(verify_schnorr_batch(valid))
+        self.assertTrue(verify_schnorr_batch([]))
+        self.assertFalse(verify_schnorr_batch(items))
+        self.assertEqual(find_invalid_schnorr(valid), [])
+        self.assertEqual(sorted(find_invalid_schnorr(items)), invalid)
+        for i in invalid:
+            self.assertFalse(verify_schnorr_batch(valid[:3] + [items[i]] + valid[3:]))
+        # A signature that is only valid for another message.
+        key, sig, msg = valid[-1]
+        self.assertFalse(verify_schnorr_batch(valid + [(key, sig, bytes(32))]))
+        # Batch verification does not consume the random module's stream.
+        state = random.getstate()
+        verify_schnorr_batch(valid)
+        self.assertEqual(random.getstate(), state)
+
+
+@unittest.skipIf(find_library() is None, "no libsecp256k1 library (set LIBSECP256K1 to its path)")
+class TestFrameworkKeyLibsecp256k1(unittest.TestCase):
+    """Compare the libsecp256k1 backend with the Python implementation."""
+
+    def setUp(self):
+        global _libsecp256k1
+        self.lib = LibSecp256k1(find_library())
+        self.addCleanup(globals().__setitem__, "_libsecp256k1", _libsecp256k1)
+
+    def use_lib(self, enabled):
+        global _libsecp256k1
+        _libsecp256k1 = self.lib if enabled else None
+
+    def both(self, func):
+        """Return the result of func with the Python implementation and with libsecp256k1."""
+        self.use_lib(False)
+        python_result = func()
+        self.use_lib(True)
+        return python_result, func()
+
+    def test_same_results(self):
+        for i in range(5):
+            key = ECKey()
+            key.generate(compressed=i % 2 == 0)
+            msg = bytes([i]) * 32
+            python_pubkey, lib_pubkey = self.both(key.get_pubkey)
+            self.assertEqual(python_pubkey.get_bytes(), lib_pubkey.get_bytes())
+            python_sig, lib_sig = self.both(lambda: key.sign_ecdsa(msg, rfc6979=True))
+            self.assertEqual(python_sig, lib_sig)
+            # Random nonces are drawn the same way, so seeded runs give the same signatures.
+            state = random.getstate()
+            self.assertEqual(*self.both(lambda: (random.setstate(state), key.sign_ecdsa(msg))))
+            for use_lib in (False, True):
+                self.use_lib(use_lib)
+                for sig in (python_sig, key.sign_ecdsa(msg), key.sign_ecdsa(msg, low_s=False)):
+                    self.assertTrue(python_pubkey.verify_ecdsa(sig, msg, low_s=False))
+                    self.assertFalse(python_pubkey.verify_ecdsa(sig, bytes([0xff]) * 32))
+
+            privkey = key.get_bytes()
+            aux = bytes([i + 1]) * 32
+            self.assertEqual(*self.both(lambda: compute_xonly_pubkey(privkey)))
+            xonly = compute_xonly_pubkey(privkey)[0]
+            for tweak in (bytes(32), msg, ORDER.to_bytes(32, 'big')):
+                self.assertEqual(*self.both(lambda: tweak_add_privkey(privkey, tweak)))
+                self.assertEqual(*self.both(lambda: tweak_add_pubkey(xonly, tweak)))
+            for schnorr_msg in (b"", msg, bytes(100)):
+                python_sig, lib_sig = self.both(lambda: sign_schnorr(privkey, schnorr_msg, aux))
+                self.assertEqual(python_sig, lib_sig)
+                self.assertEqual(*self.both(lambda: verify_schnorr(xonly, python_sig, schnorr_msg)))
+                self.assertEqual(*self.both(lambda: verify_schnorr(xonly, random_bitflip(python_sig), schnorr_msg)))
+        self.assertEqual(*self.both(lambda: tweak_add_pubkey(bytes(32), bytes(32))))
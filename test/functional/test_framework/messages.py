@@ -18,17 +18,26 @@ ser_*, deser_*: functions that handle serialization/deserialization.
 Classes use __slots__ to ensure extraneous attributes aren't accidentally added
 by tests, compromising their intended effect.
 """
+from array import array
 from base64 import b32decode, b32encode
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+import bisect
 import copy
 import hashlib
 from io import BytesIO
 import math
+import multiprocessing
 import random
 import socket
+import struct
 import time
 import unittest
+import unittest.mock
+import weakref
 
-from test_framework.crypto.siphash import siphash256
+from test_framework.crypto.siphash import siphash256, siphash256_many
 from test_framework.util import (
     assert_equal,
     assert_not_equal,
@@ -72,6 +81,7 @@ MSG_WITNESS_TX = MSG_TX | MSG_WITNESS_FLAG
 FILTER_TYPE_BASIC = 0
 
 WITNESS_SCALE_FACTOR = 4
+MIN_TRANSACTION_WEIGHT = WITNESS_SCALE_FACTOR * 60  # 60 is the lower bound for the size of a valid serialized CTransaction
 
 DEFAULT_ANCESTOR_LIMIT = 25    # default max number of in-mempool ancestors
 DEFAULT_DESCENDANT_LIMIT = 25  # default max number of in-mempool descendants
@@ -119,6 +129,18 @@ def ser_compact_size(l):
     return r
 
 
+def ser_compact_size_len(l):
+    """Return len(ser_compact_size(l))."""
+    if l < 253:
+        return 1
+    elif l < 0x10000:
+        return 3
+    elif l < 0x100000000:
+        return 5
+    else:
+        return 9
+
+
 def deser_compact_size(f):
     nit = int.from_bytes(f.read(1), "little")
     if nit == 253:
@@ -159,6 +181,11 @@ def ser_string(s):
     return ser_compact_size(len(s)) + s
 
 
+def ser_string_len(s):
+    """Return len(ser_string(s))."""
+    return ser_compact_size_len(len(s)) + len(s)
+
+
 def deser_uint256(f):
     return int.from_bytes(f.read(32), 'little')
 
@@ -196,13 +223,18 @@ def deser_vector(f, c, deser_function_name=None):
 # entries in the vector (we use this for serializing the vector of transactions
 # for a witness block).
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
+    r = bytearray()
+    ser_vector_into(r, l, ser_function_name)
+    return bytes(r)
+
+
+def ser_vector_into(buf, l, ser_function_name=None):
+    buf += ser_compact_size(len(l))
     for i in l:
         if ser_function_name:
-            r += getattr(i, ser_function_name)()
+            buf += getattr(i, ser_function_name)()
         else:
-            r += i.serialize()
-    return r
+            i.serialize_into(buf)
 
 
 def deser_uint256_vector(f):
@@ -215,10 +247,7 @@ def deser_uint256_vector(f):
 
 
 def ser_uint256_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(l)) + b"".join(ser_uint256(i) for i in l)
 
 
 def deser_string_vector(f):
@@ -231,10 +260,7 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ser_compact_size(len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
+    return ser_compact_size(len(l)) + b"".join(ser_string(sv) for sv in l)
 
 
 def deser_block_spent_outputs(f):
@@ -242,6 +268,82 @@ def deser_block_spent_outputs(f):
     return [deser_vector(f, CTxOut) for _ in range(nit)]
 
 
+# unpack_*: Counterparts of the deser_* functions that parse directly from a
+# buffer (bytes, bytearray or memoryview) at the given offset instead of
+# reading from a stream. They return the parsed value and the offset just past
+# it, and raise on truncated input.
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_INT32 = struct.Struct("<i")
+_UINT64 = struct.Struct("<Q")
+_INT64 = struct.Struct("<q")
+_OUTPOINT = struct.Struct("<32sI")
+_BLOCK_HEADER = struct.Struct("<i32s32sIII")
+
+
+def unpack_compact_size(buf, offset):
+    nit = buf[offset]
+    if nit < 253:
+        return nit, offset + 1
+    if nit == 253:
+        return _UINT16.unpack_from(buf, offset + 1)[0], offset + 3
+    if nit == 254:
+        return _UINT32.unpack_from(buf, offset + 1)[0], offset + 5
+    return _UINT64.unpack_from(buf, offset + 1)[0], offset + 9
+
+
+def unpack_bytes(buf, offset, n):
+    end = offset + n
+    if end > len(buf):
+        raise ValueError(f"unexpected end of data: need {n} bytes at offset {offset}, have {len(buf) - offset}")
+    return bytes(buf[offset:end]), end
+
+
+def unpack_string(buf, offset):
+    nit = buf[offset]
+    if nit < 253:
+        offset += 1
+    else:
+        nit, offset = unpack_compact_size(buf, offset)
+    end = offset + nit
+    if end > len(buf):
+        raise ValueError(f"unexpected end of data: need {nit} bytes at offset {offset}, have {len(buf) - offset}")
+    return bytes(buf[offset:end]), end
+
+
+def unpack_uint256(buf, offset):
+    data, offset = unpack_bytes(buf, offset, 32)
+    return int.from_bytes(data, 'little'), offset
+
+
+def unpack_vector(buf, offset, c):
+    nit, offset = unpack_compact_size(buf, offset)
+    r = []
+    for _ in range(nit):
+        t = c._new_empty()
+        offset = t._unpack(buf, offset)
+        r.append(t)
+    return r, offset
+
+
+def unpack_uint256_vector(buf, offset):
+    nit, offset = unpack_compact_size(buf, offset)
+    r = []
+    for _ in range(nit):
+        t, offset = unpack_uint256(buf, offset)
+        r.append(t)
+    return r, offset
+
+
+def unpack_string_vector(buf, offset):
+    nit, offset = unpack_compact_size(buf, offset)
+    r = []
+    for _ in range(nit):
+        t, offset = unpack_string(buf, offset)
+        r.append(t)
+    return r, offset
+
+
 def from_hex(obj, hex_string):
     """Deserialize from a hex string representation (e.g. from RPC)
 
@@ -291,7 +393,298 @@ def from_binary(cls, stream):
 # Objects that map to bitcoind objects, which can be serialized/deserialized
 
 
-class CAddress:
+def _with_owner(owners, owner):
+    """Return owners (a tuple of weak references) with owner added.
+
+    Returns owners itself if owner is already in it. References to owners that
+    no longer exist are dropped, so that objects shared by many short-lived
+    owners (e.g. an output put in one transaction after another) do not keep
+    them alive."""
+    if not owners:
+        return (weakref.ref(owner),)
+    for ref in owners:
+        if ref() is owner:
+            return owners
+    return tuple(ref for ref in owners if ref() is not None) + (weakref.ref(owner),)
+
+
+def _invalidate_owners(owners):
+    for ref in owners:
+        owner = ref()
+        if owner is not None:
+            owner._invalidate()
+
+
+class _TrackedList(list):
+    """List that invalidates the serialization cache of its owners on mutation.
+
+    Lists assigned to fields of a _CachedSerializable object are converted to
+    this type, so that e.g. tx.vin.append(...) or stack[0] = b"" are noticed.
+    Elements that are themselves cached objects are linked to the owners of
+    the list."""
+    __slots__ = ("_owners",)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._owners = ()
+
+    def _add_owner(self, owner):
+        owners = _with_owner(self._owners, owner)
+        if owners is self._owners:
+            return
+        self._owners = owners
+        for item in self:
+            if isinstance(item, _CachedSerializable):
+                item._add_owner(owner)
+
+    def _changing(self):
+        # Called before the list is modified, see _CachedSerializable._invalidate.
+        _invalidate_owners(self._owners)
+
+    def _adopt(self, items):
+        for ref in self._owners:
+            owner = ref()
+            if owner is None:
+                continue
+            for item in items:
+                if isinstance(item, _CachedSerializable):
+                    item._add_owner(owner)
+
+    def __setitem__(self, index, value):
+        self._changing()
+        if isinstance(index, slice):
+            value = list(value)
+            super().__setitem__(index, value)
+            self._adopt(value)
+        else:
+            super().__setitem__(index, value)
+            self._adopt((value,))
+
+    def __delitem__(self, index):
+        self._changing()
+        super().__delitem__(index)
+
+    # mypy compares these with list.__add__/__mul__, which return a new list.
+    def __iadd__(self, other):  # type: ignore[misc]
+        other = list(other)
+        self._changing()
+        super().__iadd__(other)
+        self._adopt(other)
+        return self
+
+    def __imul__(self, n):  # type: ignore[misc]
+        self._changing()
+        super().__imul__(n)
+        return self
+
+    def append(self, item):
+        self._changing()
+        super().append(item)
+        self._adopt((item,))
+
+    def extend(self, items):
+        items = list(items)
+        self._changing()
+        super().extend(items)
+        self._adopt(items)
+
+    def insert(self, index, item):
+        self._changing()
+        super().insert(index, item)
+        self._adopt((item,))
+
+    def pop(self, *args):
+        self._changing()
+        return super().pop(*args)
+
+    def remove(self, item):
+        self._changing()
+        super().remove(item)
+
+    def clear(self):
+        self._changing()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._changing()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._changing()
+        super().reverse()
+
+    def __reduce__(self):
+        # Copies and pickles are plain lists; they get tracked again once
+        # assigned to a field of a _CachedSerializable object.
+        return (list, (list(self),))
+
+
+class _Serializable:
+    """Base class for objects that can serialize themselves into a buffer.
+
+    Subclasses implement serialize_into(buf, ...), which appends the
+    serialization to the bytearray buf, so that nested objects (e.g. the
+    transactions of a block) are all written into one buffer instead of
+    being concatenated as bytes. serialize() is a wrapper around it.
+
+    serialized_size(...) returns the length of the serialization. Classes
+    that are sized in loops (transactions, blocks) compute it from their
+    fields instead of serializing.
+
+    A subclass that only overrides serialize() (e.g. to send a malformed
+    message in a test) gets a serialize_into() that uses it, and a subclass
+    that changes how it is serialized without overriding serialized_size()
+    is sized by serializing it. The serialize() of a class that implements
+    serialize_into() uses that class's serialize_into(), so that e.g.
+    super(CBlock, block).serialize() still returns just the header."""
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "serialize" in cls.__dict__ and "serialize_into" not in cls.__dict__:
+            def serialize_into(self, buf, *args, **kwargs):
+                buf += self.serialize(*args, **kwargs)
+            cls.serialize_into = serialize_into
+        elif "serialize_into" in cls.__dict__ and "serialize" not in cls.__dict__:
+            own_serialize_into = cls.__dict__["serialize_into"]
+
+            def serialize(self, *args, **kwargs):
+                buf = bytearray()
+                own_serialize_into(self, buf, *args, **kwargs)
+                return bytes(buf)
+            cls.serialize = serialize
+        if "serialized_size" not in cls.__dict__ and any(name in cls.__dict__ for name in _SERIALIZE_METHODS):
+            cls.serialized_size = _Serializable.serialized_size
+
+    def serialize(self, *args, **kwargs):
+        buf = bytearray()
+        self.serialize_into(buf, *args, **kwargs)
+        return bytes(buf)
+
+    def serialized_size(self, *args, **kwargs):
+        buf = bytearray()
+        self.serialize_into(buf, *args, **kwargs)
+        return len(buf)
+
+
+_SERIALIZE_METHODS = ("serialize", "serialize_into", "serialize_with_witness", "serialize_without_witness")
+
+
+class _CachedSerializable:
+    """Base class for objects that cache their serialization and hashes.
+
+    Any assignment to a field clears the cache and the caches of all objects
+    this one is (or was) part of, e.g. setting tx.vin[0].prevout.n clears the
+    cached serialization of the outpoint, the input and the transaction.
+    Mutating a field's value in place (other than through a list) is not
+    detected."""
+    __slots__ = ("_cache", "_owners", "__weakref__")
+
+    def __init__(self):
+        # Subclasses must call this before setting any field.
+        _set_field(self, "_cache", None)
+        _set_field(self, "_owners", ())
+
+    @classmethod
+    def _new_empty(cls):
+        """Return an instance with no fields set, for _unpack()."""
+        obj = cls.__new__(cls)
+        _set_field(obj, "_cache", None)
+        _set_field(obj, "_owners", ())
+        return obj
+
+    def __setattr__(self, name, value):
+        if type(value) is list:
+            value = _TrackedList(value)
+        if isinstance(value, _TRACKED_TYPES):
+            value._add_owner(self)
+        if self._cache is not None or self._owners:
+            self._invalidate()
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if not name.startswith("_") and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        _CachedSerializable.__init__(self)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _add_owner(self, owner):
+        _set_field(self, "_owners", _with_owner(self._owners, owner))
+
+    def reset_cache(self):
+        """Drop the cached serialization and hashes of this object only, e.g.
+        to measure how long computing them takes."""
+        _set_field(self, "_cache", None)
+
+    def _invalidate(self):
+        # Called before a change, so that owners can still see the old state
+        # (see CTransaction._invalidate).
+        _set_field(self, "_cache", None)
+        _invalidate_owners(self._owners)
+
+    def _cached(self, key, compute):
+        """Return the cached value for key, calling compute() on a miss."""
+        if self._cache is not None and key in self._cache:
+            return self._cache[key]
+        # compute() may itself invalidate the cache (see serialize_with_witness),
+        # so only look up the cache dict afterwards.
+        value = compute()
+        if self._cache is None:
+            _set_field(self, "_cache", {})
+        self._cache[key] = value
+        return value
+
+
+_TRACKED_TYPES = (_CachedSerializable, _TrackedList)
+
+# Used by the _unpack() methods of the transaction classes to set fields
+# without going through _CachedSerializable.__setattr__, which is the main cost
+# of deserializing large transactions and blocks. Those methods invalidate the
+# cache themselves before setting any field. _CachedSerializable uses it for its
+# own _cache and _owners slots as well.
+_set_field = object.__setattr__
+
+
+class _Unpackable(_Serializable):
+    """Base class for objects that can be parsed straight out of a buffer.
+
+    Subclasses implement _unpack(buf, offset), which must set every field of
+    the object (it may be called on an instance that skipped __init__) and
+    return the offset just past the parsed data."""
+    __slots__ = ()
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        """Deserialize an object from a buffer (bytes, bytearray or memoryview).
+
+        Returns the object and the offset just past its serialization."""
+        obj = cls._new_empty()
+        return obj, obj._unpack(buf, offset)
+
+    @classmethod
+    def _new_empty(cls):
+        """Return an instance with no fields set, for _unpack()."""
+        return cls.__new__(cls)
+
+    def deserialize(self, f):
+        start = f.tell()
+        if isinstance(f, BytesIO):
+            # getvalue() does not copy the initial bytes of a BytesIO that
+            # has not been written to.
+            f.seek(self._unpack(f.getvalue(), start))
+        else:
+            data = f.read()
+            f.seek(start + self._unpack(data, 0))
+
+
+class CAddress(_Serializable):
     __slots__ = ("net", "ip", "nServices", "port", "time")
 
     # see https://github.com/bitcoin/bips/blob/master/bip-0155.mediawiki
@@ -341,18 +734,16 @@ class CAddress:
         self.ip = socket.inet_ntoa(f.read(4))
         self.port = int.from_bytes(f.read(2), "big")
 
-    def serialize(self, *, with_time=True):
+    def serialize_into(self, buf, *, with_time=True):
         """Serialize in addrv1 format (pre-BIP155)"""
         assert self.net == self.NET_IPV4
-        r = b""
         if with_time:
             # VERSION messages serialize CAddress objects without time
-            r += self.time.to_bytes(4, "little")
-        r += self.nServices.to_bytes(8, "little")
-        r += b"\x00" * 10 + b"\xff" * 2
-        r += socket.inet_aton(self.ip)
-        r += self.port.to_bytes(2, "big")
-        return r
+            buf += self.time.to_bytes(4, "little")
+        buf += self.nServices.to_bytes(8, "little")
+        buf += b"\x00" * 10 + b"\xff" * 2
+        buf += socket.inet_aton(self.ip)
+        buf += self.port.to_bytes(2, "big")
 
     def deserialize_v2(self, f):
         """Deserialize from addrv2 format (BIP155)"""
@@ -417,7 +808,7 @@ class CAddress:
                 % (self.nServices, self.ADDRV2_NET_NAME[self.net], self.ip, self.port))
 
 
-class CInv:
+class CInv(_Unpackable):
     __slots__ = ("hash", "type")
 
     typemap = {
@@ -435,15 +826,17 @@ class CInv:
         self.type = t
         self.hash = h
 
-    def deserialize(self, f):
-        self.type = int.from_bytes(f.read(4), "little")
-        self.hash = deser_uint256(f)
+    def _unpack(self, buf, offset):
+        self.type = _UINT32.unpack_from(buf, offset)[0]
+        self.hash, offset = unpack_uint256(buf, offset + 4)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.type.to_bytes(4, "little")
-        r += ser_uint256(self.hash)
-        return r
+    def serialize_into(self, buf):
+        buf += self.type.to_bytes(4, "little")
+        buf += ser_uint256(self.hash)
+
+    def serialized_size(self):
+        return 36
 
     def __repr__(self):
         return "CInv(type=%s hash=%064x)" \
@@ -453,51 +846,65 @@ class CInv:
         return isinstance(other, CInv) and self.hash == other.hash and self.type == other.type
 
 
-class CBlockLocator:
+class CBlockLocator(_Unpackable):
     __slots__ = ("nVersion", "vHave")
 
     def __init__(self):
         self.vHave = []
 
-    def deserialize(self, f):
-        int.from_bytes(f.read(4), "little", signed=True)  # Ignore version field.
-        self.vHave = deser_uint256_vector(f)
+    def _unpack(self, buf, offset):
+        _INT32.unpack_from(buf, offset)  # Ignore version field.
+        self.vHave, offset = unpack_uint256_vector(buf, offset + 4)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += (0).to_bytes(4, "little", signed=True)  # Bitcoin Core ignores the version field. Set it to 0.
-        r += ser_uint256_vector(self.vHave)
-        return r
+    def serialize_into(self, buf):
+        buf += (0).to_bytes(4, "little", signed=True)  # Bitcoin Core ignores the version field. Set it to 0.
+        buf += ser_uint256_vector(self.vHave)
 
     def __repr__(self):
         return "CBlockLocator(vHave=%s)" % (repr(self.vHave))
 
 
-class COutPoint:
+class COutPoint(_CachedSerializable, _Unpackable):
     __slots__ = ("hash", "n")
 
     def __init__(self, hash=0, n=0):
+        super().__init__()
         self.hash = hash
         self.n = n
 
-    def deserialize(self, f):
-        self.hash = deser_uint256(f)
-        self.n = int.from_bytes(f.read(4), "little")
+    def _unpack(self, buf, offset):
+        if self._cache is not None or self._owners:
+            self._invalidate()
+        hash, n = _OUTPOINT.unpack_from(buf, offset)
+        _set_field(self, "hash", int.from_bytes(hash, 'little'))
+        _set_field(self, "n", n)
+        return offset + _OUTPOINT.size
 
     def serialize(self):
+        return self._cached("ser", self._serialize)
+
+    def serialize_into(self, buf):
+        buf += self.serialize()
+
+    def _serialize(self):
         r = b""
         r += ser_uint256(self.hash)
         r += self.n.to_bytes(4, "little")
         return r
 
+    def serialized_size(self):
+        return 36
+
     def __repr__(self):
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
 
 
-class CTxIn:
+class CTxIn(_CachedSerializable, _Unpackable):
     __slots__ = ("nSequence", "prevout", "scriptSig")
 
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
+        super().__init__()
         if outpoint is None:
             self.prevout = COutPoint()
         else:
@@ -505,52 +912,82 @@ class CTxIn:
         self.scriptSig = scriptSig
         self.nSequence = nSequence
 
-    def deserialize(self, f):
-        self.prevout = COutPoint()
-        self.prevout.deserialize(f)
-        self.scriptSig = deser_string(f)
-        self.nSequence = int.from_bytes(f.read(4), "little")
+    def _unpack(self, buf, offset):
+        if self._cache is not None or self._owners:
+            self._invalidate()
+        prevout = COutPoint._new_empty()
+        offset = prevout._unpack(buf, offset)
+        prevout._add_owner(self)
+        _set_field(self, "prevout", prevout)
+        script_sig, offset = unpack_string(buf, offset)
+        _set_field(self, "scriptSig", script_sig)
+        _set_field(self, "nSequence", _UINT32.unpack_from(buf, offset)[0])
+        return offset + 4
 
     def serialize(self):
+        return self._cached("ser", self._serialize)
+
+    def serialize_into(self, buf):
+        buf += self.serialize()
+
+    def _serialize(self):
         r = b""
         r += self.prevout.serialize()
         r += ser_string(self.scriptSig)
         r += self.nSequence.to_bytes(4, "little")
         return r
 
+    def serialized_size(self):
+        return 36 + ser_string_len(self.scriptSig) + 4
+
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
             % (repr(self.prevout), self.scriptSig.hex(),
                self.nSequence)
 
 
-class CTxOut:
+class CTxOut(_CachedSerializable, _Unpackable):
     __slots__ = ("nValue", "scriptPubKey")
 
     def __init__(self, nValue=0, scriptPubKey=b""):
+        super().__init__()
         self.nValue = nValue
         self.scriptPubKey = scriptPubKey
 
-    def deserialize(self, f):
-        self.nValue = int.from_bytes(f.read(8), "little", signed=True)
-        self.scriptPubKey = deser_string(f)
+    def _unpack(self, buf, offset):
+        if self._cache is not None or self._owners:
+            self._invalidate()
+        _set_field(self, "nValue", _INT64.unpack_from(buf, offset)[0])
+        script_pubkey, offset = unpack_string(buf, offset + 8)
+        _set_field(self, "scriptPubKey", script_pubkey)
+        return offset
 
     def serialize(self):
+        return self._cached("ser", self._serialize)
+
+    def serialize_into(self, buf):
+        buf += self.serialize()
+
+    def _serialize(self):
         r = b""
         r += self.nValue.to_bytes(8, "little", signed=True)
         r += ser_string(self.scriptPubKey)
         return r
 
+    def serialized_size(self):
+        return 8 + ser_string_len(self.scriptPubKey)
+
     def __repr__(self):
         return "CTxOut(nValue=%i.%08i scriptPubKey=%s)" \
             % (self.nValue // COIN, self.nValue % COIN,
                self.scriptPubKey.hex())
 
 
-class CScriptWitness:
+class CScriptWitness(_CachedSerializable):
     __slots__ = ("stack",)
 
     def __init__(self):
+        super().__init__()
         # stack is a vector of strings
         self.stack = []
 
@@ -564,17 +1001,28 @@ class CScriptWitness:
         return True
 
 
-class CTxInWitness:
+class CTxInWitness(_CachedSerializable, _Unpackable):
     __slots__ = ("scriptWitness",)
 
     def __init__(self):
+        super().__init__()
         self.scriptWitness = CScriptWitness()
 
-    def deserialize(self, f):
-        self.scriptWitness.stack = deser_string_vector(f)
+    def _unpack(self, buf, offset):
+        script_witness = CScriptWitness()
+        script_witness.stack, offset = unpack_string_vector(buf, offset)
+        self.scriptWitness = script_witness
+        return offset
 
     def serialize(self):
-        return ser_string_vector(self.scriptWitness.stack)
+        return self._cached("ser", lambda: ser_string_vector(self.scriptWitness.stack))
+
+    def serialize_into(self, buf):
+        buf += self.serialize()
+
+    def serialized_size(self):
+        stack = self.scriptWitness.stack
+        return ser_compact_size_len(len(stack)) + sum(ser_string_len(x) for x in stack)
 
     def __repr__(self):
         return repr(self.scriptWitness)
@@ -583,10 +1031,11 @@ class CTxInWitness:
         return self.scriptWitness.is_null()
 
 
-class CTxWitness:
+class CTxWitness(_CachedSerializable, _Serializable):
     __slots__ = ("vtxinwit",)
 
     def __init__(self):
+        super().__init__()
         self.vtxinwit = []
 
     def deserialize(self, f):
@@ -594,13 +1043,19 @@ class CTxWitness:
             self.vtxinwit[i].deserialize(f)
 
     def serialize(self):
-        r = b""
+        return self._cached("ser", self._serialize)
+
+    def serialize_into(self, buf):
+        buf += self.serialize()
+
+    def _serialize(self):
         # This is different than the usual vector serialization --
         # we omit the length of the vector, which is required to be
         # the same length as the transaction's vin vector.
-        for x in self.vtxinwit:
-            r += x.serialize()
-        return r
+        return b"".join(x.serialize() for x in self.vtxinwit)
+
+    def serialized_size(self):
+        return sum(x.serialized_size() for x in self.vtxinwit)
 
     def __repr__(self):
         return "CTxWitness(%s)" % \
@@ -613,16 +1068,44 @@ class CTxWitness:
         return True
 
 
-class CTransaction:
-    __slots__ = ("nLockTime", "version", "vin", "vout", "wit")
+class _CloneSource:
+    """The transaction that copies made with CTransaction(tx) read from.
+
+    This is tx itself until tx is about to change, at which point tx is
+    replaced by a snapshot of its old state (see CTransaction._invalidate)."""
+    __slots__ = ("tx", "__weakref__")
+
+    def __init__(self, tx):
+        self.tx = tx
+
+
+_CLONED_TX_FIELDS = ("vin", "vout", "wit")
+
+
+class CTransaction(_CachedSerializable, _Unpackable):
+    """A transaction.
+
+    CTransaction(tx) makes a deep copy of tx, but vin, vout and wit are only
+    copied when they are first accessed on the copy (serializing the copy does
+    not count). Until then the copy shares them with tx (or, once tx changes,
+    with a snapshot of tx), so copying a transaction that is only serialized,
+    or of which only some fields change, is cheap."""
+    __slots__ = ("_clone_source", "_clones", "nLockTime", "version", "vin", "vout", "wit")
 
     def __init__(self, tx=None):
+        super().__init__()
+        _set_field(self, "_clone_source", None)
+        _set_field(self, "_clones", None)
         if tx is None:
             self.version = 2
             self.vin = []
             self.vout = []
             self.wit = CTxWitness()
             self.nLockTime = 0
+        elif isinstance(tx, CTransaction):
+            self.version = tx.version
+            self.nLockTime = tx.nLockTime
+            _set_field(self, "_clone_source", tx._get_clone_source())
         else:
             self.version = tx.version
             self.vin = copy.deepcopy(tx.vin)
@@ -630,81 +1113,188 @@ class CTransaction:
             self.nLockTime = tx.nLockTime
             self.wit = copy.deepcopy(tx.wit)
 
-    def deserialize(self, f):
-        self.version = int.from_bytes(f.read(4), "little")
-        self.vin = deser_vector(f, CTxIn)
+    @classmethod
+    def _new_empty(cls):
+        obj = super()._new_empty()
+        _set_field(obj, "_clone_source", None)
+        _set_field(obj, "_clones", None)
+        return obj
+
+    def __setstate__(self, state):
+        _set_field(self, "_clone_source", None)
+        _set_field(self, "_clones", None)
+        super().__setstate__(state)
+
+    def _get_clone_source(self):
+        """Return the _CloneSource for a new copy of this transaction."""
+        source = self._clones() if self._clones is not None else None
+        if source is None:
+            source = _CloneSource(self)
+            # Only a weak reference, so that changing this transaction after
+            # its copies are gone does not take a snapshot.
+            _set_field(self, "_clones", weakref.ref(source))
+            if self._cache is None:
+                # Make sure that assigning to a field calls _invalidate().
+                _set_field(self, "_cache", {})
+        return source
+
+    def __getattr__(self, name):
+        # Only called for fields that are not set: copy them from the clone
+        # source on first access.
+        if name in _CLONED_TX_FIELDS and self._clone_source is not None:
+            value = copy.deepcopy(getattr(self._clone_source.tx, name))
+            if type(value) is list:
+                value = _TrackedList(value)
+            value._add_owner(self)
+            # The serialization does not change, so keep the cache.
+            _set_field(self, name, value)
+            if all(self._is_set(field) for field in _CLONED_TX_FIELDS):
+                _set_field(self, "_clone_source", None)
+            return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def _is_set(self, name):
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def _peek(self, name):
+        """Return a field for reading, without copying it from the clone source."""
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            return getattr(self._clone_source.tx, name)
+
+    def _invalidate(self):
+        if self._clones is not None:
+            source = self._clones()
+            if source is not None:
+                # This transaction is about to change: let its copies read
+                # from a snapshot instead.
+                snapshot = CTransaction()
+                snapshot.version = self.version
+                snapshot.nLockTime = self.nLockTime
+                for name in _CLONED_TX_FIELDS:
+                    setattr(snapshot, name, copy.deepcopy(self._peek(name)))
+                source.tx = snapshot
+            _set_field(self, "_clones", None)
+        super()._invalidate()
+
+    def _unpack(self, buf, offset):
+        self.version = _UINT32.unpack_from(buf, offset)[0]
+        vin, offset = unpack_vector(buf, offset + 4, CTxIn)
+        vout = []
         flags = 0
-        if len(self.vin) == 0:
-            flags = int.from_bytes(f.read(1), "little")
+        if len(vin) == 0:
+            flags = buf[offset]
+            offset += 1
             # Not sure why flags can't be zero, but this
             # matches the implementation in bitcoind
             if (flags != 0):
-                self.vin = deser_vector(f, CTxIn)
-                self.vout = deser_vector(f, CTxOut)
+                vin, offset = unpack_vector(buf, offset, CTxIn)
+                vout, offset = unpack_vector(buf, offset, CTxOut)
         else:
-            self.vout = deser_vector(f, CTxOut)
+            vout, offset = unpack_vector(buf, offset, CTxOut)
+        wit = CTxWitness()
         if flags != 0:
-            self.wit.vtxinwit = [CTxInWitness() for _ in range(len(self.vin))]
-            self.wit.deserialize(f)
-        else:
-            self.wit = CTxWitness()
-        self.nLockTime = int.from_bytes(f.read(4), "little")
+            vtxinwit = []
+            for _ in range(len(vin)):
+                inwit, offset = CTxInWitness.from_buffer(buf, offset)
+                vtxinwit.append(inwit)
+            wit.vtxinwit = vtxinwit
+        self.vin = vin
+        self.vout = vout
+        self.wit = wit
+        _set_field(self, "_clone_source", None)
+        self.nLockTime = _UINT32.unpack_from(buf, offset)[0]
+        return offset + 4
 
     def serialize_without_witness(self):
-        r = b""
+        return self._cached("ser_without_witness", self._serialize_without_witness)
+
+    def _serialize_without_witness(self):
+        r = bytearray()
         r += self.version.to_bytes(4, "little")
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
+        ser_vector_into(r, self._peek("vin"))
+        ser_vector_into(r, self._peek("vout"))
         r += self.nLockTime.to_bytes(4, "little")
-        return r
+        return bytes(r)
 
     # Only serialize with witness when explicitly called for
     def serialize_with_witness(self):
+        return self._cached("ser_with_witness", self._serialize_with_witness)
+
+    def _serialize_with_witness(self):
         flags = 0
-        if not self.wit.is_null():
+        if not self._peek("wit").is_null():
             flags |= 1
-        r = b""
+        r = bytearray()
         r += self.version.to_bytes(4, "little")
         if flags:
             dummy = []
-            r += ser_vector(dummy)
+            ser_vector_into(r, dummy)
             r += flags.to_bytes(1, "little")
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
+        ser_vector_into(r, self._peek("vin"))
+        ser_vector_into(r, self._peek("vout"))
         if flags & 1:
-            if (len(self.wit.vtxinwit) != len(self.vin)):
+            if (len(self._peek("wit").vtxinwit) != len(self._peek("vin"))):
                 # vtxinwit must have the same length as vin
                 self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
                 for _ in range(len(self.wit.vtxinwit), len(self.vin)):
                     self.wit.vtxinwit.append(CTxInWitness())
-            r += self.wit.serialize()
+            self._peek("wit").serialize_into(r)
         r += self.nLockTime.to_bytes(4, "little")
-        return r
+        return bytes(r)
 
     # Regular serialization is with witness -- must explicitly
     # call serialize_without_witness to exclude witness data.
     def serialize(self):
         return self.serialize_with_witness()
 
+    def serialize_into(self, buf, with_witness=True):
+        if with_witness:
+            buf += self.serialize_with_witness()
+        else:
+            buf += self.serialize_without_witness()
+
+    def serialized_size(self, with_witness=True):
+        if self._cache is not None:
+            ser = self._cache.get("ser_with_witness" if with_witness else "ser_without_witness")
+            if ser is not None:
+                return len(ser)
+        vin, vout, wit = self._peek("vin"), self._peek("vout"), self._peek("wit")
+        size = 4 + ser_compact_size_len(len(vin)) + ser_compact_size_len(len(vout)) + 4
+        size += sum(x.serialized_size() for x in vin)
+        size += sum(x.serialized_size() for x in vout)
+        if with_witness and not wit.is_null():
+            # Marker and flag, then one witness per input: missing ones are
+            # serialized as empty stacks and extra ones are dropped (see
+            # _serialize_with_witness).
+            size += 2 + sum(x.serialized_size() for x in wit.vtxinwit[:len(vin)])
+            size += max(0, len(vin) - len(wit.vtxinwit))
+        return size
+
     @property
     def wtxid_hex(self):
         """Return wtxid (transaction hash with witness) as hex string."""
-        return hash256(self.serialize())[::-1].hex()
+        return self._cached("wtxid", lambda: hash256(self.serialize()))[::-1].hex()
 
     @property
     def wtxid_int(self):
         """Return wtxid (transaction hash with witness) as integer."""
-        return uint256_from_str(hash256(self.serialize_with_witness()))
+        return uint256_from_str(self._cached("wtxid", lambda: hash256(self.serialize())))
 
     @property
     def txid_hex(self):
         """Return txid (transaction hash without witness) as hex string."""
-        return hash256(self.serialize_without_witness())[::-1].hex()
+        return self._cached("txid", lambda: hash256(self.serialize_without_witness()))[::-1].hex()
 
     @property
     def txid_int(self):
         """Return txid (transaction hash without witness) as integer."""
-        return uint256_from_str(hash256(self.serialize_without_witness()))
+        return uint256_from_str(self._cached("txid", lambda: hash256(self.serialize_without_witness())))
 
     def is_valid(self):
         for tout in self.vout:
@@ -715,8 +1305,11 @@ class CTransaction:
     # Calculate the transaction weight using witness and non-witness
     # serialization size (does NOT use sigops).
     def get_weight(self):
-        with_witness_size = len(self.serialize_with_witness())
-        without_witness_size = len(self.serialize_without_witness())
+        return self._cached("weight", self._get_weight)
+
+    def _get_weight(self):
+        with_witness_size = self.serialized_size(with_witness=True)
+        without_witness_size = self.serialized_size(with_witness=False)
         return (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
 
     def get_vsize(self):
@@ -727,7 +1320,7 @@ class CTransaction:
             % (self.version, repr(self.vin), repr(self.vout), repr(self.wit), self.nLockTime)
 
 
-class CBlockHeader:
+class CBlockHeader(_Unpackable):
     __slots__ = ("hashMerkleRoot", "hashPrevBlock", "nBits", "nNonce",
                  "nTime", "nVersion")
 
@@ -750,26 +1343,45 @@ class CBlockHeader:
         self.nBits = 0
         self.nNonce = 0
 
-    def deserialize(self, f):
-        self.nVersion = int.from_bytes(f.read(4), "little", signed=True)
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.nTime = int.from_bytes(f.read(4), "little")
-        self.nBits = int.from_bytes(f.read(4), "little")
-        self.nNonce = int.from_bytes(f.read(4), "little")
+    def _unpack(self, buf, offset):
+        (self.nVersion, hash_prev_block, hash_merkle_root,
+         self.nTime, self.nBits, self.nNonce) = _BLOCK_HEADER.unpack_from(buf, offset)
+        self.hashPrevBlock = int.from_bytes(hash_prev_block, 'little')
+        self.hashMerkleRoot = int.from_bytes(hash_merkle_root, 'little')
+        return offset + _BLOCK_HEADER.size
 
-    def serialize(self):
-        return self._serialize_header()
+    def serialize_into(self, buf):
+        buf += self._serialize_header()
+
+    def serialized_size(self):
+        return BLOCK_HEADER_SIZE
 
     def _serialize_header(self):
-        r = b""
-        r += self.nVersion.to_bytes(4, "little", signed=True)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += self.nTime.to_bytes(4, "little")
-        r += self.nBits.to_bytes(4, "little")
-        r += self.nNonce.to_bytes(4, "little")
-        return r
+        return _BLOCK_HEADER.pack(self.nVersion, ser_uint256(self.hashPrevBlock), ser_uint256(self.hashMerkleRoot),
+                                  self.nTime, self.nBits, self.nNonce)
+
+    def solve(self, workers=None):
+        """Increase nNonce until the header hash is at most the target encoded
+        in nBits. If all nonces are exhausted, nTime is increased and the
+        search restarts from nonce 0.
+
+        With workers, the nonces are searched in chunks by a pool of that many
+        processes. The result is the same as without: the first valid nonce.
+        Starting the processes takes a while, so this only pays off for
+        difficulties well above the regtest minimum."""
+        target = min(uint256_from_compact(self.nBits), 2**256 - 1).to_bytes(32, "big")
+        while True:
+            # The nonce is the last field of the header.
+            prefix = self._serialize_header()[:-4]
+            if workers:
+                nonce = _grind_nonce_parallel(prefix, target, self.nNonce, workers)
+            else:
+                nonce = _grind_nonce(prefix, target, self.nNonce, 1 << 32)
+            if nonce is not None:
+                self.nNonce = nonce
+                return
+            self.nTime += 1
+            self.nNonce = 0
 
     @property
     def hash_hex(self):
@@ -786,45 +1398,100 @@ class CBlockHeader:
             % (self.nVersion, self.hashPrevBlock, self.hashMerkleRoot,
                time.ctime(self.nTime), self.nBits, self.nNonce)
 
+# Number of nonces searched by each task of CBlockHeader.solve(workers=N).
+_SOLVE_CHUNK_SIZE = 1 << 16
+
+
+def _grind_nonce(header_prefix, target, start, stop):
+    """Return the lowest nonce in [start, stop) for which the header made of
+    header_prefix (all fields but the nonce) and the nonce hashes to at most
+    target (big-endian bytes), or None."""
+    # Only the last SHA256 block of the header depends on the nonce.
+    midstate = hashlib.sha256(header_prefix)
+    pack = _UINT32.pack
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(pack(nonce))
+        if hashlib.sha256(h.digest()).digest()[::-1] <= target:
+            return nonce
+    return None
+
+
+def _grind_nonce_parallel(header_prefix, target, start, workers):
+    """Same as _grind_nonce() over [start, 2**32), using a process pool.
+
+    Chunks are handed out and their results collected in nonce order, so the
+    lowest valid nonce is returned regardless of which worker finds one first."""
+    # Spawn rather than fork, as tests have other threads running.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        chunk_starts = iter(range(start, 1 << 32, _SOLVE_CHUNK_SIZE))
+        while True:
+            while len(pending) < 2 * workers:
+                chunk_start = next(chunk_starts, None)
+                if chunk_start is None:
+                    break
+                chunk_stop = min(chunk_start + _SOLVE_CHUNK_SIZE, 1 << 32)
+                pending.append(pool.submit(_grind_nonce, header_prefix, target, chunk_start, chunk_stop))
+            if not pending:
+                return None
+            nonce = pending.popleft().result()
+            if nonce is not None:
+                for future in pending:
+                    future.cancel()
+                return nonce
+
+
 BLOCK_HEADER_SIZE = len(CBlockHeader().serialize())
 assert_equal(BLOCK_HEADER_SIZE, 80)
+assert_equal(_BLOCK_HEADER.size, BLOCK_HEADER_SIZE)
 
 class CBlock(CBlockHeader):
-    __slots__ = ("vtx",)
+    __slots__ = ("_merkle_trees", "vtx")
 
     def __init__(self, header=None):
         super().__init__(header)
         self.vtx = []
+        self._merkle_trees = {}
 
-    def deserialize(self, f):
-        super().deserialize(f)
-        self.vtx = deser_vector(f, CTransaction)
+    def _unpack(self, buf, offset):
+        offset = super()._unpack(buf, offset)
+        self.vtx, offset = unpack_vector(buf, offset, CTransaction)
+        self._merkle_trees = {}
+        return offset
 
-    def serialize(self, with_witness=True):
-        r = b""
-        r += super().serialize()
-        if with_witness:
-            r += ser_vector(self.vtx, "serialize_with_witness")
-        else:
-            r += ser_vector(self.vtx, "serialize_without_witness")
-        return r
+    def serialize_into(self, buf, with_witness=True):
+        super().serialize_into(buf)
+        buf += ser_compact_size(len(self.vtx))
+        for tx in self.vtx:
+            tx.serialize_into(buf, with_witness=with_witness)
+
+    def serialized_size(self, with_witness=True):
+        return (super().serialized_size() + ser_compact_size_len(len(self.vtx))
+                + sum(tx.serialized_size(with_witness=with_witness) for tx in self.vtx))
 
     # Calculate the merkle root given a vector of transaction hashes
     @classmethod
     def get_merkle_root(cls, hashes):
-        while len(hashes) > 1:
-            newhashes = []
-            for i in range(0, len(hashes), 2):
-                i2 = min(i+1, len(hashes)-1)
-                newhashes.append(hash256(hashes[i] + hashes[i2]))
-            hashes = newhashes
-        return uint256_from_str(hashes[0])
+        return MerkleTree(hashes).root_int
+
+    def _get_merkle_tree(self, name, hashes):
+        """Return the MerkleTree kept under name, updated to the given leaves.
+
+        Keeping the tree around makes recomputing the root after changing a
+        few transactions (e.g. the coinbase) cheap."""
+        tree = self._merkle_trees.get(name)
+        if tree is None:
+            tree = self._merkle_trees[name] = MerkleTree(hashes)
+        else:
+            tree.set_leaves(hashes)
+        return tree
 
     def calc_merkle_root(self):
         hashes = []
         for tx in self.vtx:
             hashes.append(ser_uint256(tx.txid_int))
-        return self.get_merkle_root(hashes)
+        return self._get_merkle_tree("txid", hashes).root_int
 
     def calc_witness_merkle_root(self):
         # For witness root purposes, the hash of the
@@ -835,7 +1502,7 @@ class CBlock(CBlockHeader):
             # Calculate the hashes with witness data
             hashes.append(ser_uint256(tx.wtxid_int))
 
-        return self.get_merkle_root(hashes)
+        return self._get_merkle_tree("wtxid", hashes).root_int
 
     def is_valid(self):
         target = uint256_from_compact(self.nBits)
@@ -848,44 +1515,219 @@ class CBlock(CBlockHeader):
             return False
         return True
 
-    def solve(self):
-        target = uint256_from_compact(self.nBits)
-        while self.hash_int > target:
-            self.nNonce += 1
+    # Calculate the block weight using witness and non-witness
+    # serialization size (does NOT use sigops). The weights of the
+    # transactions are cached by the transactions themselves.
+    def get_weight(self):
+        if type(self).serialized_size is not CBlock.serialized_size:
+            # The serialization was changed by a subclass (see _Serializable).
+            with_witness_size = self.serialized_size(with_witness=True)
+            without_witness_size = self.serialized_size(with_witness=False)
+            return (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
+        base_size = super().serialized_size() + ser_compact_size_len(len(self.vtx))
+        return WITNESS_SCALE_FACTOR * base_size + sum(tx.get_weight() for tx in self.vtx)
+
+    def __repr__(self):
+        return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
+            % (self.nVersion, self.hashPrevBlock, self.hashMerkleRoot,
+               time.ctime(self.nTime), self.nBits, self.nNonce, repr(self.vtx))
+
+
+def _scan_transaction(buf, offset):
+    """Find the boundaries of the serialized transaction starting at offset
+    without deserializing it.
+
+    Returns the offset just past its outputs (where the witness or nLockTime
+    starts) and the offset just past the whole transaction."""
+    pos = offset + 4
+    # Same witness detection as CTransaction: an empty vin followed by
+    # non-zero flags.
+    if buf[pos] == 0 and buf[pos + 1] != 0:
+        witness = True
+        pos += 2
+    else:
+        witness = False
+    n_in, pos = unpack_compact_size(buf, pos)
+    for _ in range(n_in):
+        script_len, pos = unpack_compact_size(buf, pos + 36)
+        pos += script_len + 4
+    n_out, pos = unpack_compact_size(buf, pos)
+    for _ in range(n_out):
+        script_len, pos = unpack_compact_size(buf, pos + 8)
+        pos += script_len
+    io_end = pos
+    if witness:
+        for _ in range(n_in):
+            n_items, pos = unpack_compact_size(buf, pos)
+            for _ in range(n_items):
+                item_len, pos = unpack_compact_size(buf, pos)
+                pos += item_len
+    pos += 4
+    if pos > len(buf):
+        raise ValueError(f"unexpected end of data: transaction at offset {offset} ends at {pos}, have {len(buf)}")
+    return io_end, pos
+
+
+class _LazyTransactions(Sequence):
+    """Read-only view of the transactions of a LazyBlock."""
+    __slots__ = ("_block",)
+
+    def __init__(self, block):
+        self._block = block
+
+    def __len__(self):
+        return len(self._block._tx_io_ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._block.get_tx(index)
+
+    def __repr__(self):
+        return "_LazyTransactions(%d txs)" % len(self)
+
+
+class LazyBlock(CBlockHeader):
+    """Block that keeps its raw transaction data and decodes it on demand.
+
+    Deserializing only parses the header and scans the transactions once to
+    record their byte ranges, instead of building CTransaction objects for the
+    whole block. vtx[i] decodes (and caches) a single transaction, while txids,
+    wtxids, merkle roots, serialization and weight are computed directly from
+    the raw data.
+
+    The transactions are read-only: modifying a CTransaction returned by vtx[i]
+    does not change the block. Use to_block() to get a regular CBlock."""
+    __slots__ = ("_buf", "_tx_io_ends", "_tx_starts", "_txs")
+
+    def __init__(self, header=None):
+        super().__init__(header)
+        self._buf = b""
+        self._tx_starts = array("I", [0])
+        self._tx_io_ends = array("I")
+        self._txs = []
+
+    def _unpack(self, buf, offset):
+        offset = super()._unpack(buf, offset)
+        n_tx, offset = unpack_compact_size(buf, offset)
+        tx_starts = array("I", [0])
+        tx_io_ends = array("I")
+        pos = offset
+        for _ in range(n_tx):
+            io_end, pos = _scan_transaction(buf, pos)
+            tx_io_ends.append(io_end - offset)
+            tx_starts.append(pos - offset)
+        self._buf = bytes(buf[offset:pos])
+        self._tx_starts = tx_starts
+        self._tx_io_ends = tx_io_ends
+        self._txs = [None] * n_tx
+        return pos
+
+    @property
+    def vtx(self):
+        return _LazyTransactions(self)
+
+    def get_tx(self, index):
+        """Return the transaction at index, deserializing it on first access."""
+        tx = self._txs[index]
+        if tx is None:
+            tx, _ = CTransaction.from_buffer(self._buf, self._tx_starts[index])
+            self._txs[index] = tx
+        return tx
+
+    def get_tx_bytes(self, index, with_witness=True):
+        """Return the serialization of the transaction at index as a list of
+        memoryview slices into the raw block data."""
+        index = range(len(self._txs))[index]
+        start, end = self._tx_starts[index], self._tx_starts[index + 1]
+        buf = memoryview(self._buf)
+        if with_witness:
+            return [buf[start:end]]
+        io_start = start + 6 if buf[start + 4] == 0 and buf[start + 5] != 0 else start + 4
+        return [buf[start:start + 4], buf[io_start:self._tx_io_ends[index]], buf[end - 4:end]]
+
+    def _tx_hash(self, index, with_witness):
+        h = hashlib.sha256()
+        for part in self.get_tx_bytes(index, with_witness):
+            h.update(part)
+        return sha256(h.digest())
+
+    def get_txid_int(self, index):
+        """Return the txid of the transaction at index as integer."""
+        return uint256_from_str(self._tx_hash(index, with_witness=False))
+
+    def get_wtxid_int(self, index):
+        """Return the wtxid of the transaction at index as integer."""
+        return uint256_from_str(self._tx_hash(index, with_witness=True))
+
+    def calc_merkle_root(self):
+        return CBlock.get_merkle_root([self._tx_hash(i, with_witness=False) for i in range(len(self._txs))])
+
+    def calc_witness_merkle_root(self):
+        # For witness root purposes, the hash of the
+        # coinbase, with witness, is defined to be 0...0
+        hashes = [ser_uint256(0)]
+        hashes += [self._tx_hash(i, with_witness=True) for i in range(1, len(self._txs))]
+        return CBlock.get_merkle_root(hashes)
+
+    def serialize_into(self, buf, with_witness=True):
+        super().serialize_into(buf)
+        buf += ser_compact_size(len(self._txs))
+        if with_witness:
+            buf += self._buf
+        else:
+            for i in range(len(self._txs)):
+                for part in self.get_tx_bytes(i, with_witness=False):
+                    buf += part
+
+    def _stripped_size(self):
+        """Return the size of the transaction data serialized without witness."""
+        size = 0
+        for i in range(len(self._txs)):
+            size += sum(len(part) for part in self.get_tx_bytes(i, with_witness=False))
+        return size
+
+    def serialized_size(self, with_witness=True):
+        size = BLOCK_HEADER_SIZE + ser_compact_size_len(len(self._txs))
+        if with_witness:
+            return size + len(self._buf)
+        return size + self._stripped_size()
 
     # Calculate the block weight using witness and non-witness
     # serialization size (does NOT use sigops).
     def get_weight(self):
-        with_witness_size = len(self.serialize(with_witness=True))
-        without_witness_size = len(self.serialize(with_witness=False))
+        with_witness_size = self.serialized_size(with_witness=True)
+        without_witness_size = self.serialized_size(with_witness=False)
         return (WITNESS_SCALE_FACTOR - 1) * without_witness_size + with_witness_size
 
+    def to_block(self):
+        """Return a fully deserialized CBlock."""
+        return CBlock.from_buffer(self.serialize())[0]
+
     def __repr__(self):
-        return "CBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x vtx=%s)" \
+        return "LazyBlock(nVersion=%i hashPrevBlock=%064x hashMerkleRoot=%064x nTime=%s nBits=%08x nNonce=%08x ntx=%i)" \
             % (self.nVersion, self.hashPrevBlock, self.hashMerkleRoot,
-               time.ctime(self.nTime), self.nBits, self.nNonce, repr(self.vtx))
+               time.ctime(self.nTime), self.nBits, self.nNonce, len(self._txs))
 
 
-class PrefilledTransaction:
+class PrefilledTransaction(_Unpackable):
     __slots__ = ("index", "tx")
 
     def __init__(self, index=0, tx = None):
         self.index = index
         self.tx = tx
 
-    def deserialize(self, f):
-        self.index = deser_compact_size(f)
-        self.tx = CTransaction()
-        self.tx.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.index, offset = unpack_compact_size(buf, offset)
+        self.tx, offset = CTransaction.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self, with_witness=True):
-        r = b""
-        r += ser_compact_size(self.index)
-        if with_witness:
-            r += self.tx.serialize_with_witness()
-        else:
-            r += self.tx.serialize_without_witness()
-        return r
+    def serialize_into(self, buf, with_witness=True):
+        buf += ser_compact_size(self.index)
+        self.tx.serialize_into(buf, with_witness=with_witness)
+
+    def serialized_size(self, with_witness=True):
+        return ser_compact_size_len(self.index) + self.tx.serialized_size(with_witness=with_witness)
 
     def serialize_without_witness(self):
         return self.serialize(with_witness=False)
@@ -898,7 +1740,7 @@ class PrefilledTransaction:
 
 
 # This is what we send on the wire, in a cmpctblock message.
-class P2PHeaderAndShortIDs:
+class P2PHeaderAndShortIDs(_Unpackable):
     __slots__ = ("header", "nonce", "prefilled_txn", "prefilled_txn_length",
                  "shortids", "shortids_length")
 
@@ -910,31 +1752,28 @@ class P2PHeaderAndShortIDs:
         self.prefilled_txn_length = 0
         self.prefilled_txn = []
 
-    def deserialize(self, f):
-        self.header.deserialize(f)
-        self.nonce = int.from_bytes(f.read(8), "little")
-        self.shortids_length = deser_compact_size(f)
-        for _ in range(self.shortids_length):
-            # shortids are defined to be 6 bytes in the spec, so append
-            # two zero bytes and read it in as an 8-byte number
-            self.shortids.append(int.from_bytes(f.read(6) + b'\x00\x00', "little"))
-        self.prefilled_txn = deser_vector(f, PrefilledTransaction)
+    def _unpack(self, buf, offset):
+        self.header, offset = CBlockHeader.from_buffer(buf, offset)
+        self.nonce = _UINT64.unpack_from(buf, offset)[0]
+        self.shortids_length, offset = unpack_compact_size(buf, offset + 8)
+        # shortids are defined to be 6 bytes in the spec
+        shortids, offset = unpack_bytes(buf, offset, 6 * self.shortids_length)
+        self.shortids = [int.from_bytes(shortids[i:i + 6], "little") for i in range(0, len(shortids), 6)]
+        self.prefilled_txn, offset = unpack_vector(buf, offset, PrefilledTransaction)
         self.prefilled_txn_length = len(self.prefilled_txn)
+        return offset
 
     # When using version 2 compact blocks, we must serialize with_witness.
-    def serialize(self, with_witness=False):
-        r = b""
-        r += self.header.serialize()
-        r += self.nonce.to_bytes(8, "little")
-        r += ser_compact_size(self.shortids_length)
+    def serialize_into(self, buf, with_witness=False):
+        self.header.serialize_into(buf)
+        buf += self.nonce.to_bytes(8, "little")
+        buf += ser_compact_size(self.shortids_length)
         for x in self.shortids:
             # We only want the first 6 bytes
-            r += x.to_bytes(8, "little")[0:6]
-        if with_witness:
-            r += ser_vector(self.prefilled_txn, "serialize_with_witness")
-        else:
-            r += ser_vector(self.prefilled_txn, "serialize_without_witness")
-        return r
+            buf += x.to_bytes(8, "little")[0:6]
+        buf += ser_compact_size(len(self.prefilled_txn))
+        for x in self.prefilled_txn:
+            x.serialize_into(buf, with_witness=with_witness)
 
     def __repr__(self):
         return "P2PHeaderAndShortIDs(header=%s, nonce=%d, shortids_length=%d, shortids=%s, prefilled_txn_length=%d, prefilledtxn=%s" % (repr(self.header), self.nonce, self.shortids_length, repr(self.shortids), self.prefilled_txn_length, repr(self.prefilled_txn))
@@ -944,8 +1783,8 @@ class P2PHeaderAndShortIDs:
 # block version 2)
 class P2PHeaderAndShortWitnessIDs(P2PHeaderAndShortIDs):
     __slots__ = ()
-    def serialize(self):
-        return super().serialize(with_witness=True)
+    def serialize_into(self, buf):
+        super().serialize_into(buf, with_witness=True)
 
 # Calculate the BIP 152-compact blocks shortid for a given transaction hash
 def calculate_shortid(k0, k1, tx_hash):
@@ -954,6 +1793,11 @@ def calculate_shortid(k0, k1, tx_hash):
     return expected_shortid
 
 
+# Calculate the shortids for many transaction hashes at once
+def calculate_shortids(k0, k1, tx_hashes):
+    return [shortid & 0x0000ffffffffffff for shortid in siphash256_many(k0, k1, tx_hashes)]
+
+
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
 class HeaderAndShortIDs:
@@ -1010,37 +1854,40 @@ class HeaderAndShortIDs:
         self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
+        tx_hashes = []
         for i in range(len(block.vtx)):
             if i not in prefill_list:
                 tx_hash = block.vtx[i].txid_int
                 if use_witness:
                     tx_hash = block.vtx[i].wtxid_int
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+                tx_hashes.append(tx_hash)
+        self.shortids = calculate_shortids(k0, k1, tx_hashes)
 
     def __repr__(self):
         return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
 
 
-class BlockTransactionsRequest:
+class BlockTransactionsRequest(_Unpackable):
     __slots__ = ("blockhash", "indexes")
 
     def __init__(self, blockhash=0, indexes = None):
         self.blockhash = blockhash
         self.indexes = indexes if indexes is not None else []
 
-    def deserialize(self, f):
-        self.blockhash = deser_uint256(f)
-        indexes_length = deser_compact_size(f)
+    def _unpack(self, buf, offset):
+        self.blockhash, offset = unpack_uint256(buf, offset)
+        indexes_length, offset = unpack_compact_size(buf, offset)
+        self.indexes = []
         for _ in range(indexes_length):
-            self.indexes.append(deser_compact_size(f))
+            index, offset = unpack_compact_size(buf, offset)
+            self.indexes.append(index)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        r += ser_compact_size(len(self.indexes))
+    def serialize_into(self, buf):
+        buf += ser_uint256(self.blockhash)
+        buf += ser_compact_size(len(self.indexes))
         for x in self.indexes:
-            r += ser_compact_size(x)
-        return r
+            buf += ser_compact_size(x)
 
     # helper to set the differentially encoded indexes from absolute ones
     def from_absolute(self, absolute_indexes):
@@ -1062,31 +1909,204 @@ class BlockTransactionsRequest:
         return "BlockTransactionsRequest(hash=%064x indexes=%s)" % (self.blockhash, repr(self.indexes))
 
 
-class BlockTransactions:
+class BlockTransactions(_Unpackable):
     __slots__ = ("blockhash", "transactions")
 
     def __init__(self, blockhash=0, transactions = None):
         self.blockhash = blockhash
         self.transactions = transactions if transactions is not None else []
 
-    def deserialize(self, f):
-        self.blockhash = deser_uint256(f)
-        self.transactions = deser_vector(f, CTransaction)
+    def _unpack(self, buf, offset):
+        self.blockhash, offset = unpack_uint256(buf, offset)
+        self.transactions, offset = unpack_vector(buf, offset, CTransaction)
+        return offset
 
-    def serialize(self, with_witness=True):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        if with_witness:
-            r += ser_vector(self.transactions, "serialize_with_witness")
-        else:
-            r += ser_vector(self.transactions, "serialize_without_witness")
-        return r
+    def serialize_into(self, buf, with_witness=True):
+        buf += ser_uint256(self.blockhash)
+        buf += ser_compact_size(len(self.transactions))
+        for tx in self.transactions:
+            tx.serialize_into(buf, with_witness=with_witness)
+
+    def serialized_size(self, with_witness=True):
+        return (32 + ser_compact_size_len(len(self.transactions))
+                + sum(tx.serialized_size(with_witness=with_witness) for tx in self.transactions))
 
     def __repr__(self):
         return "BlockTransactions(hash=%064x transactions=%s)" % (self.blockhash, repr(self.transactions))
 
 
-class CPartialMerkleTree:
+class MerkleTree:
+    """Merkle tree over a list of 32-byte hashes, computed as in blocks: on
+    each level an odd last node is paired with itself.
+
+    All levels are kept (levels[0] are the leaves, levels[-1] is [root]), so
+    changing or appending a leaf only rehashes its path to the root."""
+    __slots__ = ("levels",)
+
+    def __init__(self, leaves=()):
+        self._build(list(leaves))
+
+    def _build(self, leaves):
+        self.levels = [leaves]
+        level = leaves
+        while len(level) > 1:
+            level = [hash256(level[i] + level[min(i + 1, len(level) - 1)]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def leaves(self):
+        return self.levels[0]
+
+    @property
+    def root(self):
+        """Return the root hash (all zeroes for an empty tree)."""
+        if not self.levels[0]:
+            return bytes(32)
+        return self.levels[-1][0]
+
+    @property
+    def root_int(self):
+        return uint256_from_str(self.root)
+
+    def _rehash_path(self, index):
+        """Recompute the ancestors of leaf index."""
+        for height, level in enumerate(self.levels):
+            if len(level) == 1:
+                return
+            index >>= 1
+            node = hash256(level[2 * index] + level[min(2 * index + 1, len(level) - 1)])
+            if height + 1 == len(self.levels):
+                self.levels.append([node])
+            elif index == len(self.levels[height + 1]):
+                self.levels[height + 1].append(node)
+            else:
+                self.levels[height + 1][index] = node
+
+    def update(self, index, leaf):
+        """Replace leaf index."""
+        self.levels[0][index] = leaf
+        self._rehash_path(index)
+
+    def append(self, leaf):
+        self.levels[0].append(leaf)
+        self._rehash_path(len(self.levels[0]) - 1)
+
+    def set_leaves(self, leaves):
+        """Update the tree to the given leaves, rehashing only the paths of
+        the leaves that changed or were appended."""
+        leaves = list(leaves)
+        old = self.levels[0]
+        if len(leaves) < len(old):
+            self._build(leaves)
+            return
+        changed = [i for i in range(len(old)) if old[i] != leaves[i]]
+        if (len(changed) + len(leaves) - len(old)) * len(self.levels) > len(leaves):
+            # Rehashing the paths one by one would cost more than a rebuild.
+            self._build(leaves)
+            return
+        for i in changed:
+            self.update(i, leaves[i])
+        for leaf in leaves[len(old):]:
+            self.append(leaf)
+
+    def get_branch(self, index):
+        """Return the hashes needed to recompute the root from leaf index."""
+        branch = []
+        for level in self.levels[:-1]:
+            branch.append(level[min(index ^ 1, len(level) - 1)])
+            index >>= 1
+        return branch
+
+    @staticmethod
+    def root_from_branch(leaf, index, branch):
+        """Return the root implied by a leaf, its index and get_branch()."""
+        node = leaf
+        for sibling in branch:
+            node = hash256(sibling + node) if index & 1 else hash256(node + sibling)
+            index >>= 1
+        return node
+
+    def get_partial_merkle_tree(self, matches):
+        """Return a CPartialMerkleTree proving the leaves at the given indexes,
+        as sent in a merkleblock message."""
+        matches = sorted(set(matches))
+        pmt = CPartialMerkleTree()
+        pmt.nTransactions = len(self)
+
+        def traverse(height, pos):
+            # Is any match under this node?
+            i = bisect.bisect_left(matches, pos << height)
+            parent_of_match = i < len(matches) and matches[i] < (pos + 1) << height
+            pmt.vBits.append(parent_of_match)
+            if height == 0 or not parent_of_match:
+                pmt.vHash.append(uint256_from_str(self.levels[height][pos]))
+            else:
+                traverse(height - 1, pos * 2)
+                if pos * 2 + 1 < len(self.levels[height - 1]):
+                    traverse(height - 1, pos * 2 + 1)
+
+        if pmt.nTransactions:
+            traverse(len(self.levels) - 1, 0)
+        return pmt
+
+    @staticmethod
+    def extract_matches(pmt):
+        """Check a CPartialMerkleTree and return its root and the list of
+        (index, hash) of the leaves it proves, hashes as integers.
+
+        Raises ValueError if it is malformed, with the same checks as
+        CPartialMerkleTree::ExtractMatches in bitcoind."""
+        n = pmt.nTransactions
+        if n == 0:
+            raise ValueError("no transactions")
+        if n > MAX_BLOCK_WEIGHT // MIN_TRANSACTION_WEIGHT:
+            raise ValueError("too many transactions")
+        if len(pmt.vHash) > n:
+            raise ValueError("more hashes than transactions")
+        if len(pmt.vBits) < len(pmt.vHash):
+            raise ValueError("fewer bits than hashes")
+        height = 0
+        while (n + (1 << height) - 1) >> height > 1:
+            height += 1
+        bits = iter(pmt.vBits)
+        hashes = iter(pmt.vHash)
+        matches = []
+
+        def traverse(height, pos):
+            parent_of_match = next(bits, None)
+            if parent_of_match is None:
+                raise ValueError("overflowed the bits array")
+            if height == 0 or not parent_of_match:
+                h = next(hashes, None)
+                if h is None:
+                    raise ValueError("overflowed the hash array")
+                if height == 0 and parent_of_match:
+                    matches.append((pos, h))
+                return ser_uint256(h)
+            left = traverse(height - 1, pos * 2)
+            if (pos * 2 + 1) << (height - 1) < n:
+                right = traverse(height - 1, pos * 2 + 1)
+                if right == left:
+                    # Identical siblings allow mutating the tree without
+                    # changing the root (CVE-2012-2459).
+                    raise ValueError("identical left and right branches")
+            else:
+                right = left
+            return hash256(left + right)
+
+        root = traverse(height, 0)
+        bits_used = len(pmt.vBits) - sum(1 for _ in bits)
+        if (bits_used + 7) // 8 != (len(pmt.vBits) + 7) // 8:
+            raise ValueError("not all bits were consumed")
+        if next(hashes, None) is not None:
+            raise ValueError("not all hashes were consumed")
+        return uint256_from_str(root), matches
+
+
+class CPartialMerkleTree(_Serializable):
     __slots__ = ("nTransactions", "vBits", "vHash")
 
     def __init__(self):
@@ -1102,21 +2122,19 @@ class CPartialMerkleTree:
         for i in range(len(vBytes) * 8):
             self.vBits.append(vBytes[i//8] & (1 << (i % 8)) != 0)
 
-    def serialize(self):
-        r = b""
-        r += self.nTransactions.to_bytes(4, "little")
-        r += ser_uint256_vector(self.vHash)
+    def serialize_into(self, buf):
+        buf += self.nTransactions.to_bytes(4, "little")
+        buf += ser_uint256_vector(self.vHash)
         vBytesArray = bytearray([0x00] * ((len(self.vBits) + 7)//8))
         for i in range(len(self.vBits)):
             vBytesArray[i // 8] |= self.vBits[i] << (i % 8)
-        r += ser_string(bytes(vBytesArray))
-        return r
+        buf += ser_string(bytes(vBytesArray))
 
     def __repr__(self):
         return "CPartialMerkleTree(nTransactions=%d, vHash=%s, vBits=%s)" % (self.nTransactions, repr(self.vHash), repr(self.vBits))
 
 
-class CMerkleBlock:
+class CMerkleBlock(_Serializable):
     __slots__ = ("header", "txn")
 
     def __init__(self):
@@ -1127,18 +2145,16 @@ class CMerkleBlock:
         self.header.deserialize(f)
         self.txn.deserialize(f)
 
-    def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += self.txn.serialize()
-        return r
+    def serialize_into(self, buf):
+        self.header.serialize_into(buf)
+        self.txn.serialize_into(buf)
 
     def __repr__(self):
         return "CMerkleBlock(header=%s, txn=%s)" % (repr(self.header), repr(self.txn))
 
 
 # Objects that correspond to messages on the wire
-class msg_version:
+class msg_version(_Serializable):
     __slots__ = ("addrFrom", "addrTo", "nNonce", "relay", "nServices",
                  "nStartingHeight", "nTime", "nVersion", "strSubVer")
     msgtype = b"version"
@@ -1172,18 +2188,16 @@ class msg_version:
         # But, unconditionally check it to match behaviour in bitcoind
         self.relay = int.from_bytes(f.read(1), "little")  # f.read(1) may return an empty b''
 
-    def serialize(self):
-        r = b""
-        r += self.nVersion.to_bytes(4, "little", signed=True)
-        r += self.nServices.to_bytes(8, "little")
-        r += self.nTime.to_bytes(8, "little", signed=True)
-        r += self.addrTo.serialize(with_time=False)
-        r += self.addrFrom.serialize(with_time=False)
-        r += self.nNonce.to_bytes(8, "little")
-        r += ser_string(self.strSubVer.encode('utf-8'))
-        r += self.nStartingHeight.to_bytes(4, "little", signed=True)
-        r += self.relay.to_bytes(1, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += self.nVersion.to_bytes(4, "little", signed=True)
+        buf += self.nServices.to_bytes(8, "little")
+        buf += self.nTime.to_bytes(8, "little", signed=True)
+        self.addrTo.serialize_into(buf, with_time=False)
+        self.addrFrom.serialize_into(buf, with_time=False)
+        buf += self.nNonce.to_bytes(8, "little")
+        buf += ser_string(self.strSubVer.encode('utf-8'))
+        buf += self.nStartingHeight.to_bytes(4, "little", signed=True)
+        buf += self.relay.to_bytes(1, "little")
 
     def __repr__(self):
         return 'msg_version(nVersion=%i nServices=%i nTime=%s addrTo=%s addrFrom=%s nNonce=0x%016X strSubVer=%s nStartingHeight=%i relay=%i)' \
@@ -1192,7 +2206,7 @@ class msg_version:
                self.strSubVer, self.nStartingHeight, self.relay)
 
 
-class msg_verack:
+class msg_verack(_Serializable):
     __slots__ = ()
     msgtype = b"verack"
 
@@ -1202,14 +2216,14 @@ class msg_verack:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_verack()"
 
 
-class msg_addr:
+class msg_addr(_Serializable):
     __slots__ = ("addrs",)
     msgtype = b"addr"
 
@@ -1219,14 +2233,14 @@ class msg_addr:
     def deserialize(self, f):
         self.addrs = deser_vector(f, CAddress)
 
-    def serialize(self):
-        return ser_vector(self.addrs)
+    def serialize_into(self, buf):
+        ser_vector_into(buf, self.addrs)
 
     def __repr__(self):
         return "msg_addr(addrs=%s)" % (repr(self.addrs))
 
 
-class msg_addrv2:
+class msg_addrv2(_Serializable):
     __slots__ = ("addrs",)
     msgtype = b"addrv2"
 
@@ -1236,14 +2250,14 @@ class msg_addrv2:
     def deserialize(self, f):
         self.addrs = deser_vector(f, CAddress, "deserialize_v2")
 
-    def serialize(self):
-        return ser_vector(self.addrs, "serialize_v2")
+    def serialize_into(self, buf):
+        ser_vector_into(buf, self.addrs, "serialize_v2")
 
     def __repr__(self):
         return "msg_addrv2(addrs=%s)" % (repr(self.addrs))
 
 
-class msg_sendaddrv2:
+class msg_sendaddrv2(_Serializable):
     __slots__ = ()
     msgtype = b"sendaddrv2"
 
@@ -1253,14 +2267,14 @@ class msg_sendaddrv2:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_sendaddrv2()"
 
 
-class msg_inv:
+class msg_inv(_Unpackable):
     __slots__ = ("inv",)
     msgtype = b"inv"
 
@@ -1270,34 +2284,36 @@ class msg_inv:
         else:
             self.inv = inv
 
-    def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+    def _unpack(self, buf, offset):
+        self.inv, offset = unpack_vector(buf, offset, CInv)
+        return offset
 
-    def serialize(self):
-        return ser_vector(self.inv)
+    def serialize_into(self, buf):
+        ser_vector_into(buf, self.inv)
 
     def __repr__(self):
         return "msg_inv(inv=%s)" % (repr(self.inv))
 
 
-class msg_getdata:
+class msg_getdata(_Unpackable):
     __slots__ = ("inv",)
     msgtype = b"getdata"
 
     def __init__(self, inv=None):
         self.inv = inv if inv is not None else []
 
-    def deserialize(self, f):
-        self.inv = deser_vector(f, CInv)
+    def _unpack(self, buf, offset):
+        self.inv, offset = unpack_vector(buf, offset, CInv)
+        return offset
 
-    def serialize(self):
-        return ser_vector(self.inv)
+    def serialize_into(self, buf):
+        ser_vector_into(buf, self.inv)
 
     def __repr__(self):
         return "msg_getdata(inv=%s)" % (repr(self.inv))
 
 
-class msg_getblocks:
+class msg_getblocks(_Unpackable):
     __slots__ = ("locator", "hashstop")
     msgtype = b"getblocks"
 
@@ -1305,23 +2321,21 @@ class msg_getblocks:
         self.locator = CBlockLocator()
         self.hashstop = 0
 
-    def deserialize(self, f):
-        self.locator = CBlockLocator()
-        self.locator.deserialize(f)
-        self.hashstop = deser_uint256(f)
+    def _unpack(self, buf, offset):
+        self.locator, offset = CBlockLocator.from_buffer(buf, offset)
+        self.hashstop, offset = unpack_uint256(buf, offset)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+    def serialize_into(self, buf):
+        self.locator.serialize_into(buf)
+        buf += ser_uint256(self.hashstop)
 
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%064x)" \
             % (repr(self.locator), self.hashstop)
 
 
-class msg_tx:
+class msg_tx(_Unpackable):
     __slots__ = ("tx",)
     msgtype = b"tx"
 
@@ -1331,16 +2345,20 @@ class msg_tx:
         else:
             self.tx = tx
 
-    def deserialize(self, f):
-        self.tx.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.tx, offset = CTransaction.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self):
-        return self.tx.serialize_with_witness()
+    def serialize_into(self, buf):
+        self.tx.serialize_into(buf)
+
+    def serialized_size(self):
+        return self.tx.serialized_size()
 
     def __repr__(self):
         return "msg_tx(tx=%s)" % (repr(self.tx))
 
-class msg_wtxidrelay:
+class msg_wtxidrelay(_Serializable):
     __slots__ = ()
     msgtype = b"wtxidrelay"
 
@@ -1350,8 +2368,8 @@ class msg_wtxidrelay:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_wtxidrelay()"
@@ -1360,11 +2378,14 @@ class msg_wtxidrelay:
 class msg_no_witness_tx(msg_tx):
     __slots__ = ()
 
-    def serialize(self):
-        return self.tx.serialize_without_witness()
+    def serialize_into(self, buf):
+        self.tx.serialize_into(buf, with_witness=False)
+
+    def serialized_size(self):
+        return self.tx.serialized_size(with_witness=False)
 
 
-class msg_block:
+class msg_block(_Unpackable):
     __slots__ = ("block",)
     msgtype = b"block"
 
@@ -1374,11 +2395,15 @@ class msg_block:
         else:
             self.block = block
 
-    def deserialize(self, f):
-        self.block.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.block, offset = CBlock.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self):
-        return self.block.serialize()
+    def serialize_into(self, buf):
+        self.block.serialize_into(buf)
+
+    def serialized_size(self):
+        return self.block.serialized_size()
 
     def __repr__(self):
         return "msg_block(block=%s)" % (repr(self.block))
@@ -1386,15 +2411,15 @@ class msg_block:
 
 # Generic type to control the raw bytes sent over the wire.
 # The msgtype and the data must be provided.
-class msg_generic:
+class msg_generic(_Serializable):
     __slots__ = ("msgtype", "data")
 
     def __init__(self, msgtype, data=None):
         self.msgtype = msgtype
         self.data = data
 
-    def serialize(self):
-        return self.data
+    def serialize_into(self, buf):
+        buf += self.data
 
     def __repr__(self):
         return "msg_generic()"
@@ -1402,11 +2427,14 @@ class msg_generic:
 
 class msg_no_witness_block(msg_block):
     __slots__ = ()
-    def serialize(self):
-        return self.block.serialize(with_witness=False)
+    def serialize_into(self, buf):
+        self.block.serialize_into(buf, with_witness=False)
 
+    def serialized_size(self):
+        return self.block.serialized_size(with_witness=False)
 
-class msg_getaddr:
+
+class msg_getaddr(_Serializable):
     __slots__ = ()
     msgtype = b"getaddr"
 
@@ -1416,14 +2444,14 @@ class msg_getaddr:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_getaddr()"
 
 
-class msg_ping:
+class msg_ping(_Serializable):
     __slots__ = ("nonce",)
     msgtype = b"ping"
 
@@ -1433,16 +2461,14 @@ class msg_ping:
     def deserialize(self, f):
         self.nonce = int.from_bytes(f.read(8), "little")
 
-    def serialize(self):
-        r = b""
-        r += self.nonce.to_bytes(8, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += self.nonce.to_bytes(8, "little")
 
     def __repr__(self):
         return "msg_ping(nonce=%08x)" % self.nonce
 
 
-class msg_pong:
+class msg_pong(_Serializable):
     __slots__ = ("nonce",)
     msgtype = b"pong"
 
@@ -1452,16 +2478,14 @@ class msg_pong:
     def deserialize(self, f):
         self.nonce = int.from_bytes(f.read(8), "little")
 
-    def serialize(self):
-        r = b""
-        r += self.nonce.to_bytes(8, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += self.nonce.to_bytes(8, "little")
 
     def __repr__(self):
         return "msg_pong(nonce=%08x)" % self.nonce
 
 
-class msg_mempool:
+class msg_mempool(_Serializable):
     __slots__ = ()
     msgtype = b"mempool"
 
@@ -1471,31 +2495,32 @@ class msg_mempool:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_mempool()"
 
 
-class msg_notfound:
+class msg_notfound(_Unpackable):
     __slots__ = ("vec", )
     msgtype = b"notfound"
 
     def __init__(self, vec=None):
         self.vec = vec or []
 
-    def deserialize(self, f):
-        self.vec = deser_vector(f, CInv)
+    def _unpack(self, buf, offset):
+        self.vec, offset = unpack_vector(buf, offset, CInv)
+        return offset
 
-    def serialize(self):
-        return ser_vector(self.vec)
+    def serialize_into(self, buf):
+        ser_vector_into(buf, self.vec)
 
     def __repr__(self):
         return "msg_notfound(vec=%s)" % (repr(self.vec))
 
 
-class msg_sendheaders:
+class msg_sendheaders(_Serializable):
     __slots__ = ()
     msgtype = b"sendheaders"
 
@@ -1505,8 +2530,8 @@ class msg_sendheaders:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_sendheaders()"
@@ -1516,7 +2541,7 @@ class msg_sendheaders:
 # number of entries
 # vector of hashes
 # hash_stop (hash of last desired block header, 0 to get as many as possible)
-class msg_getheaders:
+class msg_getheaders(_Unpackable):
     __slots__ = ("hashstop", "locator",)
     msgtype = b"getheaders"
 
@@ -1524,16 +2549,14 @@ class msg_getheaders:
         self.locator = CBlockLocator()
         self.hashstop = 0
 
-    def deserialize(self, f):
-        self.locator = CBlockLocator()
-        self.locator.deserialize(f)
-        self.hashstop = deser_uint256(f)
+    def _unpack(self, buf, offset):
+        self.locator, offset = CBlockLocator.from_buffer(buf, offset)
+        self.hashstop, offset = unpack_uint256(buf, offset)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+    def serialize_into(self, buf):
+        self.locator.serialize_into(buf)
+        buf += ser_uint256(self.hashstop)
 
     def __repr__(self):
         return "msg_getheaders(locator=%s, stop=%064x)" \
@@ -1542,28 +2565,31 @@ class msg_getheaders:
 
 # headers message has
 # <count> <vector of block headers>
-class msg_headers:
+class msg_headers(_Unpackable):
     __slots__ = ("headers",)
     msgtype = b"headers"
 
     def __init__(self, headers=None):
         self.headers = headers if headers is not None else []
 
-    def deserialize(self, f):
+    def _unpack(self, buf, offset):
         # comment in bitcoind indicates these should be deserialized as blocks
-        blocks = deser_vector(f, CBlock)
-        for x in blocks:
-            self.headers.append(CBlockHeader(x))
+        blocks, offset = unpack_vector(buf, offset, CBlock)
+        self.headers = [CBlockHeader(x) for x in blocks]
+        return offset
 
-    def serialize(self):
-        blocks = [CBlock(x) for x in self.headers]
-        return ser_vector(blocks)
+    def serialize_into(self, buf):
+        # Serialized as blocks with no transactions, see _unpack().
+        buf += ser_compact_size(len(self.headers))
+        for x in self.headers:
+            buf += x._serialize_header()
+            buf += b"\x00"
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
 
 
-class msg_merkleblock:
+class msg_merkleblock(_Serializable):
     __slots__ = ("merkleblock",)
     msgtype = b"merkleblock"
 
@@ -1576,14 +2602,14 @@ class msg_merkleblock:
     def deserialize(self, f):
         self.merkleblock.deserialize(f)
 
-    def serialize(self):
-        return self.merkleblock.serialize()
+    def serialize_into(self, buf):
+        self.merkleblock.serialize_into(buf)
 
     def __repr__(self):
         return "msg_merkleblock(merkleblock=%s)" % (repr(self.merkleblock))
 
 
-class msg_filterload:
+class msg_filterload(_Serializable):
     __slots__ = ("data", "nHashFuncs", "nTweak", "nFlags")
     msgtype = b"filterload"
 
@@ -1599,20 +2625,18 @@ class msg_filterload:
         self.nTweak = int.from_bytes(f.read(4), "little")
         self.nFlags = int.from_bytes(f.read(1), "little")
 
-    def serialize(self):
-        r = b""
-        r += ser_string(self.data)
-        r += self.nHashFuncs.to_bytes(4, "little")
-        r += self.nTweak.to_bytes(4, "little")
-        r += self.nFlags.to_bytes(1, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += ser_string(self.data)
+        buf += self.nHashFuncs.to_bytes(4, "little")
+        buf += self.nTweak.to_bytes(4, "little")
+        buf += self.nFlags.to_bytes(1, "little")
 
     def __repr__(self):
         return "msg_filterload(data={}, nHashFuncs={}, nTweak={}, nFlags={})".format(
             self.data, self.nHashFuncs, self.nTweak, self.nFlags)
 
 
-class msg_filteradd:
+class msg_filteradd(_Serializable):
     __slots__ = ("data")
     msgtype = b"filteradd"
 
@@ -1622,16 +2646,14 @@ class msg_filteradd:
     def deserialize(self, f):
         self.data = deser_string(f)
 
-    def serialize(self):
-        r = b""
-        r += ser_string(self.data)
-        return r
+    def serialize_into(self, buf):
+        buf += ser_string(self.data)
 
     def __repr__(self):
         return "msg_filteradd(data={})".format(self.data)
 
 
-class msg_filterclear:
+class msg_filterclear(_Serializable):
     __slots__ = ()
     msgtype = b"filterclear"
 
@@ -1641,14 +2663,14 @@ class msg_filterclear:
     def deserialize(self, f):
         pass
 
-    def serialize(self):
-        return b""
+    def serialize_into(self, buf):
+        pass
 
     def __repr__(self):
         return "msg_filterclear()"
 
 
-class msg_feefilter:
+class msg_feefilter(_Serializable):
     __slots__ = ("feerate",)
     msgtype = b"feefilter"
 
@@ -1658,16 +2680,14 @@ class msg_feefilter:
     def deserialize(self, f):
         self.feerate = int.from_bytes(f.read(8), "little")
 
-    def serialize(self):
-        r = b""
-        r += self.feerate.to_bytes(8, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += self.feerate.to_bytes(8, "little")
 
     def __repr__(self):
         return "msg_feefilter(feerate=%08x)" % self.feerate
 
 
-class msg_sendcmpct:
+class msg_sendcmpct(_Serializable):
     __slots__ = ("announce", "version")
     msgtype = b"sendcmpct"
 
@@ -1679,70 +2699,63 @@ class msg_sendcmpct:
         self.announce = bool(int.from_bytes(f.read(1), "little"))
         self.version = int.from_bytes(f.read(8), "little")
 
-    def serialize(self):
-        r = b""
-        r += int(self.announce).to_bytes(1, "little")
-        r += self.version.to_bytes(8, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += int(self.announce).to_bytes(1, "little")
+        buf += self.version.to_bytes(8, "little")
 
     def __repr__(self):
         return "msg_sendcmpct(announce=%s, version=%lu)" % (self.announce, self.version)
 
 
-class msg_cmpctblock:
+class msg_cmpctblock(_Unpackable):
     __slots__ = ("header_and_shortids",)
     msgtype = b"cmpctblock"
 
     def __init__(self, header_and_shortids = None):
         self.header_and_shortids = header_and_shortids
 
-    def deserialize(self, f):
-        self.header_and_shortids = P2PHeaderAndShortIDs()
-        self.header_and_shortids.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.header_and_shortids, offset = P2PHeaderAndShortIDs.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.header_and_shortids.serialize()
-        return r
+    def serialize_into(self, buf):
+        self.header_and_shortids.serialize_into(buf)
 
     def __repr__(self):
         return "msg_cmpctblock(HeaderAndShortIDs=%s)" % repr(self.header_and_shortids)
 
 
-class msg_getblocktxn:
+class msg_getblocktxn(_Unpackable):
     __slots__ = ("block_txn_request",)
     msgtype = b"getblocktxn"
 
     def __init__(self):
         self.block_txn_request = None
 
-    def deserialize(self, f):
-        self.block_txn_request = BlockTransactionsRequest()
-        self.block_txn_request.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.block_txn_request, offset = BlockTransactionsRequest.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.block_txn_request.serialize()
-        return r
+    def serialize_into(self, buf):
+        self.block_txn_request.serialize_into(buf)
 
     def __repr__(self):
         return "msg_getblocktxn(block_txn_request=%s)" % (repr(self.block_txn_request))
 
 
-class msg_blocktxn:
+class msg_blocktxn(_Unpackable):
     __slots__ = ("block_transactions",)
     msgtype = b"blocktxn"
 
     def __init__(self):
         self.block_transactions = BlockTransactions()
 
-    def deserialize(self, f):
-        self.block_transactions.deserialize(f)
+    def _unpack(self, buf, offset):
+        self.block_transactions, offset = BlockTransactions.from_buffer(buf, offset)
+        return offset
 
-    def serialize(self):
-        r = b""
-        r += self.block_transactions.serialize()
-        return r
+    def serialize_into(self, buf):
+        self.block_transactions.serialize_into(buf)
 
     def __repr__(self):
         return "msg_blocktxn(block_transactions=%s)" % (repr(self.block_transactions))
@@ -1751,11 +2764,11 @@ class msg_blocktxn:
 class msg_no_witness_blocktxn(msg_blocktxn):
     __slots__ = ()
 
-    def serialize(self):
-        return self.block_transactions.serialize(with_witness=False)
+    def serialize_into(self, buf):
+        self.block_transactions.serialize_into(buf, with_witness=False)
 
 
-class msg_getcfilters:
+class msg_getcfilters(_Serializable):
     __slots__ = ("filter_type", "start_height", "stop_hash")
     msgtype =  b"getcfilters"
 
@@ -1769,18 +2782,16 @@ class msg_getcfilters:
         self.start_height = int.from_bytes(f.read(4), "little")
         self.stop_hash = deser_uint256(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += self.start_height.to_bytes(4, "little")
-        r += ser_uint256(self.stop_hash)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += self.start_height.to_bytes(4, "little")
+        buf += ser_uint256(self.stop_hash)
 
     def __repr__(self):
         return "msg_getcfilters(filter_type={:#x}, start_height={}, stop_hash={:x})".format(
             self.filter_type, self.start_height, self.stop_hash)
 
-class msg_cfilter:
+class msg_cfilter(_Serializable):
     __slots__ = ("filter_type", "block_hash", "filter_data")
     msgtype =  b"cfilter"
 
@@ -1794,18 +2805,16 @@ class msg_cfilter:
         self.block_hash = deser_uint256(f)
         self.filter_data = deser_string(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += ser_uint256(self.block_hash)
-        r += ser_string(self.filter_data)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += ser_uint256(self.block_hash)
+        buf += ser_string(self.filter_data)
 
     def __repr__(self):
         return "msg_cfilter(filter_type={:#x}, block_hash={:x})".format(
             self.filter_type, self.block_hash)
 
-class msg_getcfheaders:
+class msg_getcfheaders(_Serializable):
     __slots__ = ("filter_type", "start_height", "stop_hash")
     msgtype =  b"getcfheaders"
 
@@ -1819,18 +2828,16 @@ class msg_getcfheaders:
         self.start_height = int.from_bytes(f.read(4), "little")
         self.stop_hash = deser_uint256(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += self.start_height.to_bytes(4, "little")
-        r += ser_uint256(self.stop_hash)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += self.start_height.to_bytes(4, "little")
+        buf += ser_uint256(self.stop_hash)
 
     def __repr__(self):
         return "msg_getcfheaders(filter_type={:#x}, start_height={}, stop_hash={:x})".format(
             self.filter_type, self.start_height, self.stop_hash)
 
-class msg_cfheaders:
+class msg_cfheaders(_Serializable):
     __slots__ = ("filter_type", "stop_hash", "prev_header", "hashes")
     msgtype =  b"cfheaders"
 
@@ -1846,19 +2853,17 @@ class msg_cfheaders:
         self.prev_header = deser_uint256(f)
         self.hashes = deser_uint256_vector(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += ser_uint256(self.stop_hash)
-        r += ser_uint256(self.prev_header)
-        r += ser_uint256_vector(self.hashes)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += ser_uint256(self.stop_hash)
+        buf += ser_uint256(self.prev_header)
+        buf += ser_uint256_vector(self.hashes)
 
     def __repr__(self):
         return "msg_cfheaders(filter_type={:#x}, stop_hash={:x})".format(
             self.filter_type, self.stop_hash)
 
-class msg_getcfcheckpt:
+class msg_getcfcheckpt(_Serializable):
     __slots__ = ("filter_type", "stop_hash")
     msgtype =  b"getcfcheckpt"
 
@@ -1870,17 +2875,15 @@ class msg_getcfcheckpt:
         self.filter_type = int.from_bytes(f.read(1), "little")
         self.stop_hash = deser_uint256(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += ser_uint256(self.stop_hash)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += ser_uint256(self.stop_hash)
 
     def __repr__(self):
         return "msg_getcfcheckpt(filter_type={:#x}, stop_hash={:x})".format(
             self.filter_type, self.stop_hash)
 
-class msg_cfcheckpt:
+class msg_cfcheckpt(_Serializable):
     __slots__ = ("filter_type", "stop_hash", "headers")
     msgtype =  b"cfcheckpt"
 
@@ -1894,18 +2897,16 @@ class msg_cfcheckpt:
         self.stop_hash = deser_uint256(f)
         self.headers = deser_uint256_vector(f)
 
-    def serialize(self):
-        r = b""
-        r += self.filter_type.to_bytes(1, "little")
-        r += ser_uint256(self.stop_hash)
-        r += ser_uint256_vector(self.headers)
-        return r
+    def serialize_into(self, buf):
+        buf += self.filter_type.to_bytes(1, "little")
+        buf += ser_uint256(self.stop_hash)
+        buf += ser_uint256_vector(self.headers)
 
     def __repr__(self):
         return "msg_cfcheckpt(filter_type={:#x}, stop_hash={:x})".format(
             self.filter_type, self.stop_hash)
 
-class msg_sendtxrcncl:
+class msg_sendtxrcncl(_Serializable):
     __slots__ = ("version", "salt")
     msgtype = b"sendtxrcncl"
 
@@ -1917,11 +2918,9 @@ class msg_sendtxrcncl:
         self.version = int.from_bytes(f.read(4), "little")
         self.salt = int.from_bytes(f.read(8), "little")
 
-    def serialize(self):
-        r = b""
-        r += self.version.to_bytes(4, "little")
-        r += self.salt.to_bytes(8, "little")
-        return r
+    def serialize_into(self, buf):
+        buf += self.version.to_bytes(4, "little")
+        buf += self.salt.to_bytes(8, "little")
 
     def __repr__(self):
         return "msg_sendtxrcncl(version=%lu, salt=%lu)" %\
@@ -1959,3 +2958,351 @@ class TestFrameworkScript(unittest.TestCase):
         check_varint(0x80123456, "86ffc7e756")
         check_varint(0xffffffff, "8efefefe7f")
         check_varint(0xffffffffffffffff, "80fefefefefefefefe7f")
+
+    def test_tx_cache_invalidation(self):
+        tx = CTransaction()
+        tx.vin.append(CTxIn(COutPoint(1, 0), b"\x51"))
+        tx.vout.append(CTxOut(1000, b"\x51"))
+
+        def check(tx):
+            """Compare the cached ids against a fresh deserialization."""
+            fresh = from_binary(CTransaction, tx._serialize_with_witness())
+            self.assertEqual(tx.txid_hex, fresh.txid_hex)
+            self.assertEqual(tx.wtxid_hex, fresh.wtxid_hex)
+            self.assertEqual(tx.get_weight(), fresh.get_weight())
+            return tx.wtxid_hex
+
+        seen = {check(tx)}
+        witness = CScriptWitness()
+        witness.stack = [b"\x03"]
+        mutations = [
+            lambda: setattr(tx, "nLockTime", 1),
+            lambda: setattr(tx.vin[0].prevout, "n", 1),
+            lambda: setattr(tx.vin[0], "scriptSig", b"\x52"),
+            lambda: tx.vin.append(CTxIn(COutPoint(2, 0))),
+            lambda: setattr(tx.vout[0], "nValue", 999),
+            lambda: tx.vout.insert(0, CTxOut(1, b"")),
+            lambda: tx.vout.reverse(),
+            lambda: tx.wit.vtxinwit.append(CTxInWitness()) or tx.wit.vtxinwit[0].scriptWitness.stack.append(b"\x01"),
+            lambda: tx.wit.vtxinwit[0].scriptWitness.stack.__setitem__(0, b"\x02"),
+            lambda: setattr(tx.wit.vtxinwit[0], "scriptWitness", witness),
+            lambda: tx.vin.pop(),
+        ]
+        for mutate in mutations:
+            mutate()
+            wtxid = check(tx)
+            self.assertNotIn(wtxid, seen)
+            seen.add(wtxid)
+
+        # Copies do not share caches or invalidation with the original.
+        for clone in (CTransaction(tx), copy.deepcopy(tx)):
+            clone.vout[0].nValue += 1
+            self.assertEqual(check(tx), wtxid)
+            self.assertNotEqual(check(clone), wtxid)
+
+        # Objects shared between transactions invalidate all of them.
+        tx2 = CTransaction()
+        tx2.vin = [tx.vin[0]]
+        txid = tx.txid_hex
+        txid2 = tx2.txid_hex
+        tx.vin[0].nSequence = 1
+        self.assertNotEqual(check(tx), txid)
+        self.assertNotEqual(check(tx2), txid2)
+
+        # Owners are held weakly, so reusing an object does not pile them up.
+        txout = CTxOut(1, b"\x51")
+        for _ in range(1000):
+            reuser = CTransaction()
+            reuser.vin = [CTxIn(COutPoint(1, 0))]
+            reuser.vout = [txout]
+            reuser.vout.append(txout)
+            self.assertIsNotNone(reuser.txid_hex)
+        self.assertLessEqual(len(txout._owners), 2)
+        txid = reuser.txid_hex
+        txout.nValue = 2
+        self.assertNotEqual(check(reuser), txid)
+
+    def test_from_buffer(self):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), bytes([i]) * i, i) for i in range(3)]
+        tx.vout = [CTxOut(i * COIN, b"\x51" * 300) for i in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(3)]
+        tx.wit.vtxinwit[1].scriptWitness.stack = [b"", b"\x01" * 80]
+        block = CBlock()
+        block.nBits = 0x207fffff
+        block.vtx = [tx, CTransaction(tx)]
+        block.vtx[1].wit = CTxWitness()
+        block.hashMerkleRoot = block.calc_merkle_root()
+
+        for obj in (tx, block.vtx[1], block, msg_block(block), msg_tx(tx), msg_inv([CInv(MSG_TX, 1), CInv(MSG_BLOCK, 2)])):
+            ser = obj.serialize()
+            # Parse at a non-zero offset out of a memoryview.
+            buf = memoryview(b"\xff" * 7 + ser + b"\xff")
+            parsed, offset = type(obj).from_buffer(buf, 7)
+            self.assertEqual(offset, 7 + len(ser))
+            self.assertEqual(parsed.serialize(), ser)
+            # The stream interface delegates to the same parser.
+            f = BytesIO(b"\xff" + ser)
+            f.read(1)
+            streamed = type(obj)()
+            streamed.deserialize(f)
+            self.assertEqual(f.tell(), 1 + len(ser))
+            self.assertEqual(streamed.serialize(), ser)
+
+        self.assertEqual(from_binary(CBlock, block.serialize()).vtx[0].wtxid_hex, tx.wtxid_hex)
+        with self.assertRaises((ValueError, struct.error)):
+            CTransaction.from_buffer(tx.serialize()[:-1])
+        with self.assertRaises((ValueError, struct.error)):
+            CBlock.from_buffer(block.serialize()[:100])
+
+    def test_lazy_block(self):
+        block = CBlock()
+        block.nBits = 0x207fffff
+        for i in range(5):
+            tx = CTransaction()
+            tx.vin = [CTxIn(COutPoint(i, j), b"\x51" * j) for j in range(i + 1)]
+            tx.vout = [CTxOut(j, b"\x52" * 300) for j in range(i)]
+            if i % 2:
+                tx.wit.vtxinwit = [CTxInWitness() for _ in tx.vin]
+                tx.wit.vtxinwit[-1].scriptWitness.stack = [b"\x01" * 300, b""]
+            block.vtx.append(tx)
+        block.hashMerkleRoot = block.calc_merkle_root()
+
+        lazy = from_binary(LazyBlock, block.serialize())
+        self.assertEqual(lazy.hash_hex, block.hash_hex)
+        self.assertEqual(len(lazy.vtx), len(block.vtx))
+        self.assertEqual(lazy._txs, [None] * len(block.vtx))
+        self.assertEqual(lazy.calc_merkle_root(), block.hashMerkleRoot)
+        self.assertEqual(lazy.calc_witness_merkle_root(), block.calc_witness_merkle_root())
+        self.assertEqual(lazy.get_weight(), block.get_weight())
+        for with_witness in (True, False):
+            self.assertEqual(lazy.serialize(with_witness=with_witness), block.serialize(with_witness=with_witness))
+        for i, tx in enumerate(block.vtx):
+            self.assertEqual(lazy.get_txid_int(i), tx.txid_int)
+            self.assertEqual(lazy.get_wtxid_int(i), tx.wtxid_int)
+        # Only accessed transactions are decoded.
+        self.assertEqual(lazy.vtx[3].wtxid_hex, block.vtx[3].wtxid_hex)
+        self.assertIs(lazy.vtx[-2], lazy.vtx[3])
+        self.assertEqual(sum(tx is not None for tx in lazy._txs), 1)
+        self.assertEqual([tx.txid_hex for tx in lazy.vtx[1:3]], [tx.txid_hex for tx in block.vtx[1:3]])
+        self.assertEqual(lazy.to_block().serialize(), block.serialize())
+        self.assertEqual(LazyBlock(block).serialize(), CBlock(block).serialize())
+
+    def test_serialize_into(self):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), b"\x51" * i) for i in range(3)]
+        tx.vout = [CTxOut(i, b"\x52" * 30) for i in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(3)]
+        tx.wit.vtxinwit[0].scriptWitness.stack = [b"\x01" * 80]
+        block = CBlock()
+        block.vtx = [tx, CTransaction(tx)]
+        header_and_shortids = HeaderAndShortIDs()
+        header_and_shortids.initialize_from_block(block, prefill_list=[0, 1], use_witness=True)
+
+        for obj, args, expected in (
+                (tx, (), tx.serialize_with_witness()),
+                (tx, (False,), tx.serialize_without_witness()),
+                (block, (), block.serialize()),
+                (block, (False,), block.serialize(with_witness=False)),
+                (msg_cmpctblock(header_and_shortids.to_p2p()), (), None),
+                (msg_version(), (), None),
+                (msg_verack(), (), b"")):
+            buf = bytearray(b"\xff")
+            obj.serialize_into(buf, *args)
+            self.assertEqual(bytes(buf), b"\xff" + (obj.serialize() if expected is None else expected))
+        self.assertEqual(msg_no_witness_block(block).serialize(), block.serialize(with_witness=False))
+        self.assertEqual(msg_headers([block, CBlockHeader(block)]).serialize(), b"\x02" + 2 * (CBlockHeader(block).serialize() + b"\x00"))
+
+        # Overriding serialize() alone also changes serialize_into().
+        class msg_bogus_tx(msg_tx):
+            def serialize(self):
+                return b"bogus"
+        buf = bytearray()
+        msg_block(block).serialize_into(buf)
+        msg_bogus_tx(tx).serialize_into(buf)
+        self.assertEqual(bytes(buf), block.serialize() + b"bogus")
+
+        # A serialize() override can still use the serialization of a base class.
+        class msg_bloated_block(CBlock):
+            def serialize(self):
+                return super(CBlock, self).serialize() + b"\xff" + len(self.vtx).to_bytes(8, "little") + b"".join(tx.serialize() for tx in self.vtx)
+        bloated = msg_bloated_block(block)
+        bloated.vtx = block.vtx
+        self.assertEqual(super(CBlock, block).serialize(), CBlockHeader(block).serialize())
+        self.assertEqual(bloated.serialized_size(), block.serialized_size() + 8)
+
+    def test_serialized_size(self):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), b"\x51" * (i * 150)) for i in range(3)]
+        tx.vout = [CTxOut(i, b"\x52" * (i * 70000)) for i in range(2)]
+        block = CBlock()
+        block.vtx = [tx]
+        objs = [tx, block, msg_tx(tx), msg_no_witness_tx(tx), msg_block(block), msg_no_witness_block(block),
+                BlockTransactions(1, [tx]), PrefilledTransaction(300, tx), msg_inv([CInv(MSG_TX, 1)]), msg_version()]
+        for witness_items in ([], [[]], [[b""], [b"\x01" * 300]], [[b"\x01"]] * 3, [[b"\x01"]] * 4):
+            tx.wit.vtxinwit = [CTxInWitness() for _ in witness_items]
+            for inwit, stack in zip(tx.wit.vtxinwit, witness_items):
+                inwit.scriptWitness.stack = stack
+            for obj in objs:
+                self.assertEqual(obj.serialized_size(), len(obj.serialize()))
+            for obj in (tx, block):
+                self.assertEqual(obj.serialized_size(with_witness=False), len(obj.serialize_without_witness() if obj is tx else obj.serialize(with_witness=False)))
+            self.assertEqual(tx.get_weight(), 3 * len(tx.serialize_without_witness()) + len(tx.serialize_with_witness()))
+            self.assertIn("weight", tx._cache)
+            self.assertEqual(block.get_weight(), 3 * len(block.serialize(with_witness=False)) + len(block.serialize()))
+
+        # Subclasses that change the serialization are sized by serializing.
+        class BrokenCTransaction(CTransaction):
+            __slots__ = ()
+            def serialize_with_witness(self):
+                return b"\x00" * 10
+        self.assertEqual(BrokenCTransaction(tx).serialized_size(), 10)
+        self.assertEqual(BrokenCTransaction(tx).get_weight(), 3 * tx.serialized_size(with_witness=False) + 10)
+
+        class BrokenCBlock(CBlock):
+            def serialize(self, with_witness=True):
+                return super().serialize(with_witness=with_witness) + b"\x00"
+        broken_block = BrokenCBlock()
+        broken_block.vtx = [tx]
+        self.assertEqual(broken_block.get_weight(), block.get_weight() + 4)
+
+    def test_merkle_tree(self):
+        def naive_root(hashes):
+            if not hashes:
+                return bytes(32)
+            while len(hashes) > 1:
+                hashes = [hash256(hashes[i] + hashes[min(i + 1, len(hashes) - 1)]) for i in range(0, len(hashes), 2)]
+            return hashes[0]
+
+        leaves = [sha256(bytes([i])) for i in range(20)]
+        grown = MerkleTree()
+        for n in range(len(leaves) + 1):
+            tree = MerkleTree(leaves[:n])
+            self.assertEqual(tree.root, naive_root(leaves[:n]))
+            self.assertEqual(grown.root, tree.root)
+            self.assertEqual(grown.levels, tree.levels)
+            for i in range(n):
+                branch = tree.get_branch(i)
+                self.assertEqual(MerkleTree.root_from_branch(leaves[i], i, branch), tree.root)
+                self.assertNotEqual(MerkleTree.root_from_branch(leaves[i - 1], i, branch), tree.root)
+            for i in range(0, n, 3):
+                tree.update(i, hash256(leaves[i]))
+            self.assertEqual(tree.root, naive_root([hash256(leaf) if i % 3 == 0 else leaf for i, leaf in enumerate(leaves[:n])]))
+            tree.set_leaves(leaves[:n])
+            self.assertEqual(tree.root, naive_root(leaves[:n]))
+            if n < len(leaves):
+                grown.append(leaves[n])
+
+        # Blocks keep their trees and update them as transactions change.
+        block = CBlock()
+        block.vtx = [CTransaction() for _ in range(7)]
+        for i, tx in enumerate(block.vtx):
+            tx.nLockTime = i
+        self.assertEqual(block.calc_merkle_root(), CBlock.get_merkle_root([ser_uint256(tx.txid_int) for tx in block.vtx]))
+        block.vtx[0].nLockTime = 100
+        block.vtx.append(CTransaction())
+        self.assertEqual(block.calc_merkle_root(), CBlock.get_merkle_root([ser_uint256(tx.txid_int) for tx in block.vtx]))
+        del block.vtx[3:]
+        self.assertEqual(block.calc_merkle_root(), CBlock.get_merkle_root([ser_uint256(tx.txid_int) for tx in block.vtx]))
+
+        # Partial merkle trees round-trip through a merkleblock message.
+        for n, matched in ((1, [0]), (1, []), (7, [0, 6]), (20, [3, 4, 19]), (20, range(20))):
+            tree = MerkleTree(leaves[:n])
+            msg = msg_merkleblock()
+            msg.merkleblock.txn = tree.get_partial_merkle_tree(matched)
+            parsed = from_binary(msg_merkleblock, msg.serialize()).merkleblock.txn
+            root, matches = MerkleTree.extract_matches(parsed)
+            self.assertEqual(root, tree.root_int)
+            self.assertEqual(matches, [(i, uint256_from_str(leaves[i])) for i in sorted(matched)])
+
+        pmt = MerkleTree(leaves[:7]).get_partial_merkle_tree([2])
+        pmt.vHash.append(0)
+        with self.assertRaisesRegex(ValueError, "not all hashes were consumed"):
+            MerkleTree.extract_matches(pmt)
+        pmt = MerkleTree(leaves[:2] * 2).get_partial_merkle_tree([0, 3])
+        with self.assertRaisesRegex(ValueError, "identical left and right branches"):
+            MerkleTree.extract_matches(pmt)
+
+    def test_solve(self):
+        block = CBlock()
+        block.nBits = 0x1f7fffff
+        block.nTime = 1700000000
+        block.vtx = [CTransaction()]
+        block.hashMerkleRoot = block.calc_merkle_root()
+        target = uint256_from_compact(block.nBits)
+
+        expected = CBlockHeader(block)
+        while expected.hash_int > target:
+            expected.nNonce += 1
+        block.solve()
+        self.assertEqual(block.nNonce, expected.nNonce)
+        # An already valid header is left alone.
+        block.solve()
+        self.assertEqual(block.nNonce, expected.nNonce)
+
+        # Small chunks, so that the pool has to pick the lowest of several hits.
+        with unittest.mock.patch(f"{__name__}._SOLVE_CHUNK_SIZE", 16):
+            header = CBlockHeader(block)
+            header.nNonce = 0
+            header.solve(workers=2)
+        self.assertEqual(header.nNonce, expected.nNonce)
+
+        # When the nonces run out, nTime is increased.
+        header = CBlockHeader(block)
+        header.nNonce = 0xffffffff
+        while uint256_from_str(hash256(header._serialize_header())) <= target:
+            header.nTime += 1
+        exhausted_time = header.nTime
+        header.solve()
+        self.assertEqual(header.nTime, exhausted_time + 1)
+        self.assertLessEqual(header.hash_int, target)
+
+    def test_tx_clone(self):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i, i), b"\x51" * i) for i in range(3)]
+        tx.vout = [CTxOut(i, b"\x52" * i) for i in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for _ in range(3)]
+        tx.wit.vtxinwit[1].scriptWitness.stack = [b"\x01"]
+        ser = tx.serialize()
+
+        # Copies are serialized without copying the fields.
+        clone = CTransaction(tx)
+        self.assertEqual(clone.serialize(), ser)
+        self.assertEqual(clone.serialized_size(with_witness=False), len(tx.serialize_without_witness()))
+        self.assertIs(clone._clone_source.tx, tx)
+        self.assertIsNot(clone.vout, tx.vout)
+        self.assertIsNot(clone.vout[0], tx.vout[0])
+        self.assertIs(clone._clone_source.tx, tx)
+
+        # Changing the original does not change its copies, however it is done.
+        for mutate in (lambda t: setattr(t, "nLockTime", 1),
+                       lambda t: setattr(t.vin[0].prevout, "n", 7),
+                       lambda t: t.vout.append(CTxOut()),
+                       lambda t: t.wit.vtxinwit[1].scriptWitness.stack.append(b"\x02"),
+                       lambda t: t.deserialize(BytesIO(CTransaction().serialize()))):
+            original = CTransaction(tx)
+            clone = CTransaction(original)
+            clone_of_clone = CTransaction(clone)
+            mutate(original)
+            self.assertNotEqual(original.serialize(), ser)
+            self.assertEqual(clone.serialize(), ser)
+            self.assertEqual(clone_of_clone.serialize(), ser)
+            self.assertEqual(clone_of_clone.vin[0].prevout.n, 0)
+
+            # ... and the other way round.
+            original = CTransaction(tx)
+            clone = CTransaction(original)
+            mutate(clone)
+            self.assertEqual(original.serialize(), ser)
+            self.assertNotEqual(clone.serialize(), ser)
+
+        # No snapshot is taken once the copies are gone.
+        clone = CTransaction(tx)
+        del clone
+        tx.nLockTime = 2
+        self.assertIsNone(tx._clones)
+
+        clone = CTransaction(tx)
+        self.assertEqual(copy.deepcopy(clone).serialize(), tx.serialize())
+        self.assertEqual(repr(clone), repr(tx))
+        self.assertIsNone(clone._clone_source)
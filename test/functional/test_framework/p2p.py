@@ -412,26 +412,39 @@ class P2PConnection(asyncio.Protocol):
     def build_message(self, message, is_decoy=False):
         """Build a serialized P2P message"""
         msgtype = message.msgtype
-        data = message.serialize()
+        tmsg = bytearray()
         if self.supports_v2_p2p:
             if msgtype in SHORTID.values():
-                tmsg = MSGTYPE_TO_SHORTID.get(msgtype).to_bytes(1, 'big')
+                tmsg += MSGTYPE_TO_SHORTID.get(msgtype).to_bytes(1, 'big')
             else:
-                tmsg = b"\x00"
+                tmsg += b"\x00"
                 tmsg += msgtype
                 tmsg += b"\x00" * (12 - len(msgtype))
-            tmsg += data
+            self._serialize_payload(message, tmsg)
             return self.v2_state.v2_enc_packet(tmsg, ignore=is_decoy)
         else:
-            tmsg = self.magic_bytes
+            tmsg += self.magic_bytes
             tmsg += msgtype
             tmsg += b"\x00" * (12 - len(msgtype))
-            tmsg += len(data).to_bytes(4, "little")
-            th = sha256(data)
-            h = sha256(th)
-            tmsg += h[:4]
-            tmsg += data
-            return tmsg
+            # Length and checksum are filled in once the payload is known.
+            tmsg += b"\x00" * 8
+            start = len(tmsg)
+            self._serialize_payload(message, tmsg)
+            with memoryview(tmsg) as data:
+                h = sha256(sha256(data[start:]))
+            tmsg[start - 8:start - 4] = (len(tmsg) - start).to_bytes(4, "little")
+            tmsg[start - 4:start] = h[:4]
+            return bytes(tmsg)
+
+    @staticmethod
+    def _serialize_payload(message, buf):
+        """Append the serialized message to buf"""
+        serialize_into = getattr(message, "serialize_into", None)
+        if serialize_into is not None:
+            serialize_into(buf)
+        else:
+            # Messages defined by tests may only implement serialize().
+            buf += message.serialize()
 
     def _log_message(self, direction, msg):
         """Logs a message being sent or received over the connection."""
@@ -8,16 +8,22 @@ This file is modified from python-bitcoinlib.
 """
 
 from collections import namedtuple
+from functools import cached_property, lru_cache
+import heapq
 import unittest
 
 from .key import TaggedHash, tweak_add_pubkey, compute_xonly_pubkey
 
 from .messages import (
+    COutPoint,
     CTransaction,
+    CTxIn,
     CTxOut,
     hash256,
+    ser_compact_size,
     ser_string,
     sha256,
+    tx_from_hex,
 )
 
 from .crypto.ripemd160 import ripemd160
@@ -483,54 +489,14 @@ class CScript(bytes):
         PUSHDATA encodings can be accurately distinguished, as well as
         determining the exact opcode byte indexes. (sop_idx)
         """
-        i = 0
-        while i < len(self):
-            sop_idx = i
-            opcode = CScriptOp(self[i])
-            i += 1
-
-            if opcode > OP_PUSHDATA4:
-                yield (opcode, None, sop_idx)
+        compiled = _compile_script(self)
+        for opcode, sop_idx, data_offset, data_len in compiled.ops:
+            if data_len is None:
+                yield (_opcode_instances[opcode], None, sop_idx)
             else:
-                datasize = None
-                pushdata_type = None
-                if opcode < OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA(%d)' % opcode
-                    datasize = opcode
-
-                elif opcode == OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA1'
-                    if i >= len(self):
-                        raise CScriptInvalidError('PUSHDATA1: missing data length')
-                    datasize = self[i]
-                    i += 1
-
-                elif opcode == OP_PUSHDATA2:
-                    pushdata_type = 'PUSHDATA2'
-                    if i + 1 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA2: missing data length')
-                    datasize = self[i] + (self[i + 1] << 8)
-                    i += 2
-
-                elif opcode == OP_PUSHDATA4:
-                    pushdata_type = 'PUSHDATA4'
-                    if i + 3 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA4: missing data length')
-                    datasize = self[i] + (self[i + 1] << 8) + (self[i + 2] << 16) + (self[i + 3] << 24)
-                    i += 4
-
-                else:
-                    assert False  # shouldn't happen
-
-                data = bytes(self[i:i + datasize])
-
-                # Check for truncation
-                if len(data) < datasize:
-                    raise CScriptTruncatedPushDataError('%s: truncated data' % pushdata_type, data)
-
-                i += datasize
-
-                yield (opcode, data, sop_idx)
+                yield (_opcode_instances[opcode], self[data_offset:data_offset + data_len], sop_idx)
+        if compiled.error is not None:
+            compiled.raise_error()
 
     def __iter__(self):
         """'Cooked' iteration
@@ -586,18 +552,15 @@ class CScript(bytes):
 
         Note that this is consensus-critical.
         """
-        n = 0
-        lastOpcode = OP_INVALIDOPCODE
-        for (opcode, data, sop_idx) in self.raw_iter():
-            if opcode in (OP_CHECKSIG, OP_CHECKSIGVERIFY):
-                n += 1
-            elif opcode in (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
-                if fAccurate and (OP_1 <= lastOpcode <= OP_16):
-                    n += lastOpcode.decode_op_n()
-                else:
-                    n += 20
-            lastOpcode = opcode
-        return n
+        # Standard templates, without parsing.
+        if len(self) == 25 and self[:3] == b'\x76\xa9\x14' and self[23:] == b'\x88\xac':  # P2PKH
+            return 1
+        if (len(self) == 23 and self[:2] == b'\xa9\x14' and self[22] == OP_EQUAL) or self.IsWitnessProgram():  # P2SH, segwit
+            return 0
+        compiled = _compile_script(self)
+        if compiled.error is not None:
+            compiled.raise_error()
+        return compiled.sigops[fAccurate]
 
     def IsWitnessProgram(self):
         """A witness program is any valid CScript that consists of a 1-byte
@@ -607,6 +570,88 @@ class CScript(bytes):
                 (self[1] + 2 == len(self)))
 
 
+# Maximum number of distinct scripts whose parsed form is kept.
+SCRIPT_CACHE_SIZE = 1 << 14
+
+
+class _CompiledScript:
+    """The parsed form of a script, see _compile_script.
+
+    ops is a tuple of (opcode, sop_idx, data_offset, data_len) per opcode,
+    with data_len None for opcodes other than pushes. error is the
+    (exception class, arguments) of a parse error after the last opcode in
+    ops, or None."""
+    __slots__ = ("ops", "error", "_sigops")
+
+    def __init__(self, ops, error):
+        self.ops = ops
+        self.error = error
+        self._sigops = None
+
+    def raise_error(self):
+        cls, args = self.error
+        raise cls(*args)
+
+    @property
+    def sigops(self):
+        """The inaccurate and accurate SigOp counts (see CScript.GetSigOpCount)."""
+        if self._sigops is None:
+            inaccurate = accurate = 0
+            last_opcode = OP_INVALIDOPCODE
+            for opcode, _, _, _ in self.ops:
+                if opcode == OP_CHECKSIG or opcode == OP_CHECKSIGVERIFY:
+                    inaccurate += 1
+                    accurate += 1
+                elif opcode == OP_CHECKMULTISIG or opcode == OP_CHECKMULTISIGVERIFY:
+                    inaccurate += 20
+                    accurate += last_opcode - OP_1 + 1 if OP_1 <= last_opcode <= OP_16 else 20
+                last_opcode = opcode
+            self._sigops = (inaccurate, accurate)
+        return self._sigops
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def _compile_script(script):
+    """Parse a script into a _CompiledScript, once per distinct script."""
+    ops = []
+    i = 0
+    n = len(script)
+    while i < n:
+        sop_idx = i
+        opcode = script[i]
+        i += 1
+        if opcode > OP_PUSHDATA4:
+            ops.append((opcode, sop_idx, None, None))
+            continue
+        if opcode < OP_PUSHDATA1:
+            pushdata_type = 'PUSHDATA(%d)' % opcode
+            datasize = opcode
+        elif opcode == OP_PUSHDATA1:
+            pushdata_type = 'PUSHDATA1'
+            if i >= n:
+                return _CompiledScript(tuple(ops), (CScriptInvalidError, ('PUSHDATA1: missing data length',)))
+            datasize = script[i]
+            i += 1
+        elif opcode == OP_PUSHDATA2:
+            pushdata_type = 'PUSHDATA2'
+            if i + 1 >= n:
+                return _CompiledScript(tuple(ops), (CScriptInvalidError, ('PUSHDATA2: missing data length',)))
+            datasize = script[i] + (script[i + 1] << 8)
+            i += 2
+        else:
+            pushdata_type = 'PUSHDATA4'
+            if i + 3 >= n:
+                return _CompiledScript(tuple(ops), (CScriptInvalidError, ('PUSHDATA4: missing data length',)))
+            datasize = int.from_bytes(script[i:i + 4], "little")
+            i += 4
+        # Check for truncation
+        if i + datasize > n:
+            return _CompiledScript(tuple(ops), (CScriptTruncatedPushDataError, ('%s: truncated data' % pushdata_type, bytes(script[i:]))))
+        ops.append((opcode, sop_idx, i, datasize))
+        i += datasize
+    return _CompiledScript(tuple(ops), None)
+
+
 SIGHASH_DEFAULT = 0 # Taproot-only default, semantics same as SIGHASH_ALL
 SIGHASH_ALL = 1
 SIGHASH_NONE = 2
@@ -615,10 +660,15 @@ SIGHASH_ANYONECANPAY = 0x80
 
 def FindAndDelete(script, sig):
     """Consensus critical, see FindAndDelete() in Satoshi codebase"""
+    compiled = _compile_script(script)
+    if compiled.error is not None:
+        compiled.raise_error()
+    if len(sig) > 0 and sig not in script:
+        return CScript(script)
     r = b''
     last_sop_idx = sop_idx = 0
     skip = True
-    for (opcode, data, sop_idx) in script.raw_iter():
+    for (_, sop_idx, _, _) in compiled.ops:
         if not skip:
             r += script[last_sop_idx:sop_idx]
         last_sop_idx = sop_idx
@@ -630,52 +680,57 @@ def FindAndDelete(script, sig):
         r += script[last_sop_idx:]
     return CScript(r)
 
-def LegacySignatureMsg(script, txTo, inIdx, hashtype):
+def LegacySignatureMsg(script, txTo, inIdx, hashtype, *, cache=None):
     """Preimage of the signature hash, if it exists.
 
     Returns either (None, err) to indicate error (which translates to sighash 1),
     or (msg, None).
+
+    The preimage is the serialization of a modified copy of txTo, but it is
+    assembled directly from the serialized inputs and outputs of txTo (see
+    SighashCache.legacy_inputs), without copying the transaction.
     """
 
     if inIdx >= len(txTo.vin):
         return (None, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = CTransaction(txTo)
-
-    for txin in txtmp.vin:
-        txin.scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+    if (hashtype & 0x1f) == SIGHASH_SINGLE and inIdx >= len(txTo.vout):
+        return (None, "outIdx %d out of range (%d)" % (inIdx, len(txTo.vout)))
+    if cache is None:
+        cache = SighashCache(txTo)
+    assert cache.tx is txTo
 
-    if (hashtype & 0x1f) == SIGHASH_NONE:
-        txtmp.vout = []
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
-
-    elif (hashtype & 0x1f) == SIGHASH_SINGLE:
-        outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            return (None, "outIdx %d out of range (%d)" % (outIdx, len(txtmp.vout)))
-
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for _ in range(outIdx):
-            txtmp.vout.append(CTxOut(-1))
-        txtmp.vout.append(tmp)
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+    # The signed input, with the script code as scriptSig.
+    txin = txTo.vin[inIdx]
+    signed_input = txin.prevout.serialize() + ser_string(FindAndDelete(script, CScript([OP_CODESEPARATOR]))) + txin.nSequence.to_bytes(4, "little")
 
+    parts = [txTo.version.to_bytes(4, "little")]
     if hashtype & SIGHASH_ANYONECANPAY:
-        tmp = txtmp.vin[inIdx]
-        txtmp.vin = []
-        txtmp.vin.append(tmp)
+        parts += [ser_compact_size(1), signed_input]
+    else:
+        # Other inputs have an empty scriptSig, and with SIGHASH_NONE and
+        # SIGHASH_SINGLE a zero nSequence.
+        if (hashtype & 0x1f) in (SIGHASH_NONE, SIGHASH_SINGLE):
+            inputs = cache.legacy_inputs_no_sequence
+        else:
+            inputs = cache.legacy_inputs
+        parts.append(ser_compact_size(len(inputs)))
+        parts += inputs[:inIdx]
+        parts.append(signed_input)
+        parts += inputs[inIdx + 1:]
 
-    s = txtmp.serialize_without_witness()
-    s += hashtype.to_bytes(4, "little")
+    if (hashtype & 0x1f) == SIGHASH_NONE:
+        parts.append(ser_compact_size(0))
+    elif (hashtype & 0x1f) == SIGHASH_SINGLE:
+        # The outputs before inIdx are replaced by CTxOut(-1).
+        parts.append(ser_compact_size(inIdx + 1))
+        parts.append(CTxOut(-1).serialize() * inIdx)
+        parts.append(txTo.vout[inIdx].serialize())
+    else:
+        parts.append(cache.legacy_outputs)
 
-    return (s, None)
+    parts.append(txTo.nLockTime.to_bytes(4, "little"))
+    parts.append(hashtype.to_bytes(4, "little"))
+    return (b"".join(parts), None)
 
 def LegacySignatureHash(*args, **kwargs):
     """Consensus-correct SignatureHash
@@ -691,51 +746,109 @@ def LegacySignatureHash(*args, **kwargs):
     else:
         return (hash256(msg), err)
 
-def sign_input_legacy(tx, input_index, input_scriptpubkey, privkey, sighash_type=SIGHASH_ALL):
+def sign_input_legacy(tx, input_index, input_scriptpubkey, privkey, sighash_type=SIGHASH_ALL, *, cache=None):
     """Add legacy ECDSA signature for a given transaction input. Note that the signature
        is prepended to the scriptSig field, i.e. additional data pushes necessary for more
-       complex spends than P2PK (e.g. pubkey for P2PKH) can be already set before."""
-    (sighash, err) = LegacySignatureHash(input_scriptpubkey, tx, input_index, sighash_type)
+       complex spends than P2PK (e.g. pubkey for P2PKH) can be already set before. Pass
+       the same SighashCache when signing several inputs of a transaction."""
+    (sighash, err) = LegacySignatureHash(input_scriptpubkey, tx, input_index, sighash_type, cache=cache)
     assert err is None
     der_sig = privkey.sign_ecdsa(sighash)
     tx.vin[input_index].scriptSig = bytes(CScript([der_sig + bytes([sighash_type])])) + tx.vin[input_index].scriptSig
 
-def sign_input_segwitv0(tx, input_index, input_scriptpubkey, input_amount, privkey, sighash_type=SIGHASH_ALL):
+def sign_input_segwitv0(tx, input_index, input_scriptpubkey, input_amount, privkey, sighash_type=SIGHASH_ALL, *, cache=None):
     """Add segwitv0 ECDSA signature for a given transaction input. Note that the signature
        is inserted at the bottom of the witness stack, i.e. additional witness data
-       needed (e.g. pubkey for P2WPKH) can already be set before."""
-    sighash = SegwitV0SignatureHash(input_scriptpubkey, tx, input_index, sighash_type, input_amount)
+       needed (e.g. pubkey for P2WPKH) can already be set before. Pass the same
+       SighashCache when signing several inputs of a transaction."""
+    sighash = SegwitV0SignatureHash(input_scriptpubkey, tx, input_index, sighash_type, input_amount, cache=cache)
     der_sig = privkey.sign_ecdsa(sighash)
     tx.wit.vtxinwit[input_index].scriptWitness.stack.insert(0, der_sig + bytes([sighash_type]))
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class SighashCache:
+    """Per-transaction data for signature hashes, like PrecomputedTransactionData in the node.
+
+    The hashes of all prevouts, sequences and outputs (BIP143 and BIP341) and of
+    all spent outputs (BIP341) are computed on first use, and then reused for
+    every input and hash type, so that signing all inputs of a transaction takes
+    linear rather than quadratic time. The same holds for the serialized inputs
+    and outputs that make up legacy signature hash preimages. The transaction
+    and spent_utxos must not be modified while the cache is in use, except for
+    scriptSigs and witnesses."""
+
+    def __init__(self, tx, spent_utxos=None):
+        self.tx = tx
+        self.spent_utxos = spent_utxos
+
+    # Serialized inputs with an empty scriptSig and serialized outputs, as used
+    # by legacy signature hashes.
+    @cached_property
+    def legacy_inputs(self):
+        return [txin.prevout.serialize() + ser_string(b"") + txin.nSequence.to_bytes(4, "little") for txin in self.tx.vin]
+
+    @cached_property
+    def legacy_inputs_no_sequence(self):
+        return [txin.prevout.serialize() + ser_string(b"") + bytes(4) for txin in self.tx.vin]
+
+    @cached_property
+    def legacy_outputs(self):
+        return ser_compact_size(len(self.tx.vout)) + b"".join(txout.serialize() for txout in self.tx.vout)
+
+    # Single SHA256 hashes, as used by BIP341.
+    @cached_property
+    def sha_prevouts(self):
+        return BIP341_sha_prevouts(self.tx)
+
+    @cached_property
+    def sha_sequences(self):
+        return BIP341_sha_sequences(self.tx)
+
+    @cached_property
+    def sha_outputs(self):
+        return BIP341_sha_outputs(self.tx)
+
+    @cached_property
+    def sha_amounts(self):
+        return BIP341_sha_amounts(self.spent_utxos)
+
+    @cached_property
+    def sha_scriptpubkeys(self):
+        return BIP341_sha_scriptpubkeys(self.spent_utxos)
+
+    # Double SHA256 hashes, as used by BIP143.
+    @cached_property
+    def hash_prevouts(self):
+        return sha256(self.sha_prevouts)
+
+    @cached_property
+    def hash_sequence(self):
+        return sha256(self.sha_sequences)
+
+    @cached_property
+    def hash_outputs(self):
+        return sha256(self.sha_outputs)
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
 # for version 0 witnesses.
-def SegwitV0SignatureMsg(script, txTo, inIdx, hashtype, amount):
+def SegwitV0SignatureMsg(script, txTo, inIdx, hashtype, amount, *, cache=None):
     ZERO_HASH = bytes([0]*32)
 
+    if cache is None:
+        cache = SighashCache(txTo)
+    assert cache.tx is txTo
+
     hashPrevouts = ZERO_HASH
     hashSequence = ZERO_HASH
     hashOutputs = ZERO_HASH
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = hash256(serialize_prevouts)
+        hashPrevouts = cache.hash_prevouts
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += i.nSequence.to_bytes(4, "little")
-        hashSequence = hash256(serialize_sequence)
+        hashSequence = cache.hash_sequence
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = hash256(serialize_outputs)
+        hashOutputs = cache.hash_outputs
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
         hashOutputs = hash256(serialize_outputs)
@@ -797,6 +910,101 @@ class TestFrameworkScript(unittest.TestCase):
                 multisig_script = CScript([CScriptOp.encode_op_n(n), multisig_op])
                 self.assertEqual(multisig_script.GetSigOpCount(fAccurate=False), 20)
                 self.assertEqual(multisig_script.GetSigOpCount(fAccurate=True), n)
+        # templates and scripts counted from their cached parse
+        self.assertEqual(CScript([OP_DUP, OP_HASH160, bytes(20), OP_EQUALVERIFY, OP_CHECKSIG]).GetSigOpCount(fAccurate=False), 1)
+        self.assertEqual(CScript([OP_HASH160, bytes(20), OP_EQUAL]).GetSigOpCount(fAccurate=False), 0)
+        self.assertEqual(CScript([OP_0, bytes(20)]).GetSigOpCount(fAccurate=False), 0)
+        self.assertEqual(CScript([OP_CHECKSIG, OP_HASH160, bytes(20), OP_EQUAL]).GetSigOpCount(fAccurate=False), 1)
+        for _ in range(2):
+            with self.assertRaises(CScriptTruncatedPushDataError):
+                CScript(bytes([OP_CHECKSIG, 5, 1])).GetSigOpCount(fAccurate=False)
+
+    def test_find_and_delete(self):
+        sig = CScript([b"\x01\x02"])
+        script = CScript([OP_DUP, b"\x01\x02", OP_CHECKSIG, b"\x01\x02"])
+        self.assertEqual(FindAndDelete(script, sig), CScript([OP_DUP, OP_CHECKSIG]))
+        self.assertEqual(FindAndDelete(script, CScript([b"\x03"])), script)
+        with self.assertRaises(CScriptTruncatedPushDataError):
+            FindAndDelete(CScript(bytes([OP_DUP, 5])), sig)
+
+    def test_sighash_cache(self):
+        tx = CTransaction()
+        for i in range(3):
+            tx.vin.append(CTxIn(COutPoint(i + 1, i), nSequence=i))
+            tx.vout.append(CTxOut(1000 * i, CScript([OP_1, bytes([i]) * 32])))
+        spent = [CTxOut(5000 + i, CScript([OP_1, bytes([i + 10]) * 32])) for i in range(3)]
+        script = CScript([OP_TRUE])
+        cache = SighashCache(tx, spent)
+        for hashtype in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE):
+            for hashtype in (hashtype, hashtype | SIGHASH_ANYONECANPAY):
+                for i in range(3):
+                    self.assertEqual(SegwitV0SignatureHash(script, tx, i, hashtype, 5000, cache=cache),
+                                     SegwitV0SignatureHash(script, tx, i, hashtype, 5000))
+                    self.assertEqual(TaprootSignatureHash(tx, spent, hashtype, i, cache=cache),
+                                     TaprootSignatureHash(tx, spent, hashtype, i))
+        # The hashes are computed only once.
+        self.assertIs(cache.sha_outputs, cache.sha_outputs)
+        # The cache may be used with a copy of spent, but not with other outputs.
+        TaprootSignatureHash(tx, list(spent), SIGHASH_ALL, 0, cache=cache)
+        with self.assertRaises(AssertionError):
+            TaprootSignatureHash(tx, spent[::-1], SIGHASH_ALL, 0, cache=cache)
+
+    def test_taproot_construct(self):
+        def merkle_root(leaf):
+            h = leaf.leaf_hash
+            for i in range(0, len(leaf.merklebranch), 32):
+                node = leaf.merklebranch[i:i + 32]
+                h = TaggedHash("TapBranch", min(h, node) + max(h, node))
+            return h
+
+        pubkey = compute_xonly_pubkey(bytes([1] * 32))[0]
+        scripts = [("a", CScript([OP_1])), [("b", CScript([OP_2]), 0xc2), (None, CScript([OP_3]))],
+                   [("c", CScript([OP_4])), lambda h: bytes(32)]]
+        tap = taproot_construct(pubkey, scripts)
+        self.assertEqual(sorted(tap.leaves), ["a", "b", "c"])
+        self.assertEqual([len(tap.leaves[name].merklebranch) for name in "abc"], [32, 96, 96])
+        self.assertEqual(tap.leaves["b"].version, 0xc2)
+        self.assertEqual(tap.leaves["c"].merklebranch[:32], bytes(32))
+        for leaf in tap.leaves.values():
+            self.assertEqual(merkle_root(leaf), tap.merkle_root)
+        self.assertEqual(taproot_construct(pubkey).merkle_root, bytes())
+
+        # Huffman layout: leaf depths follow the weights.
+        weights = [1, 8, 1, 2, 4]
+        tap = taproot_construct(pubkey, taproot_huffman_tree([(w, (str(i), CScript([i]))) for i, w in enumerate(weights)]))
+        self.assertEqual([len(tap.leaves[str(i)].merklebranch) // 32 for i in range(len(weights))], [4, 1, 4, 3, 2])
+        for leaf in tap.leaves.values():
+            self.assertEqual(merkle_root(leaf), tap.merkle_root)
+
+        # Trees deeper than the recursion limit are supported.
+        scripts = [("0", CScript([0]))]
+        for i in range(1, 2000):
+            scripts = [(str(i), CScript([i])), scripts]
+        tap = taproot_construct(pubkey, scripts)
+        self.assertEqual(len(tap.leaves["0"].merklebranch), 1999 * 32)
+        self.assertEqual(merkle_root(tap.leaves["0"]), tap.merkle_root)
+
+    def test_legacy_sighash(self):
+        # Vectors from src/test/data/sighash.json: raw transaction, script, input index, hash type
+        # (as a signed 32-bit integer) and sighash, covering every base type with and without
+        # SIGHASH_ANYONECANPAY.
+        vectors = [
+            ["fe6ddf3a02657e42a7496ef170b4a8caf245b925b91c7840fd28e4a22c03cb459cb498b8d603000000065263656a650071ce6bf8d905106f9f1faf6488164f3decac65bf3c5afe1dcee20e6bc3cb6d052561985a030000000163295b117601343dbb0000000000026563dba521df", "", 1, -1696179931, "d9684685c99ce48f398fb467a91a1a59629a850c429046fb3071f1fa9a5fe816"],
+            ["94083c840288d40a6983faca876d452f7c52a07de9268ad892e70a81e150d602a773c175ad03000000007ec3637d7e1103e2e7e0c61896cbbf8d7e205b2ecc93dd0d6d7527d39cdbf6d335789f660300000000ffffffff019e1f7b03000000000800ac0051acac0053539cb363", "", 1, -183614058, "a17b66d6bb427f42653d08207a22b02353dd19ccf2c7de6a9a3a2bdb7c49c9e7"],
+            ["2f7353dd02e395b0a4d16da0f7472db618857cd3de5b9e2789232952a9b154d249102245fd030000000151617fd88f103280b85b0a198198e438e7cab1a4c92ba58409709997cc7a65a619eb9eec3c0200000003636aabffffffff0397481c0200000000045300636a0dc97803000000000009d389030000000003ac6a53134007bb", "0000536552526a", 0, -1912746174, "30c4cd4bd6b291f7e9489cc4b4440a083f93a7664ea1f93e77a9597dab8ded9c"],
+            ["98ea7eac0313d9fb03573fb2b8e718180c70ce647bebcf49b97a8403837a2556cb8c9377f30000000004ac53ac65ffffffff8caac77a5e52f0d8213ef6ce998bedbb50cfdf108954771031c0e0cd2a78423900000000010066e99a44937ebb37015be3693761078ad5c73aa73ec623ac7300b45375cc8eef36087eb80000000007515352acac5100ffffffff0114a51b02000000000000000000", "6aacab", 0, 243527074, "bad77967f98941af4dd52a8517d5ad1e32307c0d511e15461e86465e1b8b5273"],
+            ["ff5400dd02fec5beb9a396e1cbedc82bedae09ed44bae60ba9bef2ff375a6858212478844b03000000025253ffffffff01e46c203577a79d1172db715e9cc6316b9cfc59b5e5e4d9199fef201c6f9f0f000000000900ab6552656a5165acffffffff02e8ce62040000000002515312ce3e00000000000251513f119316", "", 0, 1541581667, "1e0da47eedbbb381b0e0debbb76e128d042e02e65b11125e17fd127305fc65cd"],
+            ["009046a1023f266d0113556d604931374d7932b4d6a7952d08fbd9c9b87cbd83f4f4c178b4030000000452ac526346e73b438c4516c60edd5488023131f07acb5f9ea1540b3e84de92f4e3c432289781ea4900000000046500655357dfd6da02baef910100000000026a007d101703000000000800516500abacac5100000000", "6aab6553ac", 0, -802456605, "f8757fbb4448ca34e0cd41b997685b37238d331e70316659a9cc9087d116169d"],
+        ]
+        for raw_tx, script, input_index, hashtype, sighash in vectors:
+            tx = tx_from_hex(raw_tx)
+            cache = SighashCache(tx)
+            for c in (None, cache):
+                self.assertEqual(LegacySignatureHash(CScript(bytes.fromhex(script)), tx, input_index, hashtype & 0xffffffff, cache=c),
+                                 (bytes.fromhex(sighash)[::-1], None))
+        # The SIGHASH_SINGLE bug: no output for the input.
+        tx.vout = tx.vout[:1]
+        self.assertEqual(LegacySignatureHash(CScript(), tx, 1, SIGHASH_SINGLE)[0], (1).to_bytes(32, "little"))
 
 def BIP341_sha_prevouts(txTo):
     return sha256(b"".join(i.prevout.serialize() for i in txTo.vin))
@@ -813,9 +1021,12 @@ def BIP341_sha_sequences(txTo):
 def BIP341_sha_outputs(txTo):
     return sha256(b"".join(o.serialize() for o in txTo.vout))
 
-def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index=0, *, scriptpath=False, leaf_script=None, codeseparator_pos=-1, annex=None, leaf_ver=LEAF_VERSION_TAPSCRIPT):
+def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index=0, *, scriptpath=False, leaf_script=None, codeseparator_pos=-1, annex=None, leaf_ver=LEAF_VERSION_TAPSCRIPT, cache=None):
     assert (len(txTo.vin) == len(spent_utxos))
     assert (input_index < len(txTo.vin))
+    if cache is None:
+        cache = SighashCache(txTo, spent_utxos)
+    assert cache.tx is txTo and cache.spent_utxos == spent_utxos
     out_type = SIGHASH_ALL if hash_type == 0 else hash_type & 3
     in_type = hash_type & SIGHASH_ANYONECANPAY
     spk = spent_utxos[input_index].scriptPubKey
@@ -823,12 +1034,12 @@ def TaprootSignatureMsg(txTo, spent_utxos, hash_type, input_index=0, *, scriptpa
     ss += txTo.version.to_bytes(4, "little")
     ss += txTo.nLockTime.to_bytes(4, "little")
     if in_type != SIGHASH_ANYONECANPAY:
-        ss += BIP341_sha_prevouts(txTo)
-        ss += BIP341_sha_amounts(spent_utxos)
-        ss += BIP341_sha_scriptpubkeys(spent_utxos)
-        ss += BIP341_sha_sequences(txTo)
+        ss += cache.sha_prevouts
+        ss += cache.sha_amounts
+        ss += cache.sha_scriptpubkeys
+        ss += cache.sha_sequences
     if out_type == SIGHASH_ALL:
-        ss += BIP341_sha_outputs(txTo)
+        ss += cache.sha_outputs
     spend_type = 0
     if annex is not None:
         spend_type |= 1
@@ -860,43 +1071,108 @@ def TaprootSignatureHash(*args, **kwargs):
     return TaggedHash("TapSighash", TaprootSignatureMsg(*args, **kwargs))
 
 def taproot_tree_helper(scripts):
-    if len(scripts) == 0:
-        return ([], bytes())
-    if len(scripts) == 1:
-        # One entry: treat as a leaf
-        script = scripts[0]
-        assert not callable(script)
-        if isinstance(script, list):
-            return taproot_tree_helper(script)
-        assert isinstance(script, tuple)
-        version = LEAF_VERSION_TAPSCRIPT
-        name = script[0]
-        code = script[1]
-        if len(script) == 3:
-            version = script[2]
-        assert version & 1 == 0
-        assert isinstance(code, bytes)
-        h = TaggedHash("TapLeaf", bytes([version]) + ser_string(code))
-        if name is None:
-            return ([], h)
-        return ([(name, version, code, bytes(), h)], h)
-    elif len(scripts) == 2 and callable(scripts[1]):
-        # Two entries, and the right one is a function
-        left, left_h = taproot_tree_helper(scripts[0:1])
-        right_h = scripts[1](left_h)
-        left = [(name, version, script, control + right_h, leaf) for name, version, script, control, leaf in left]
-        right = []
-    else:
-        # Two or more entries: descend into each side
-        split_pos = len(scripts) // 2
-        left, left_h = taproot_tree_helper(scripts[0:split_pos])
-        right, right_h = taproot_tree_helper(scripts[split_pos:])
-        left = [(name, version, script, control + right_h, leaf) for name, version, script, control, leaf in left]
-        right = [(name, version, script, control + left_h, leaf) for name, version, script, control, leaf in right]
-    if right_h < left_h:
-        right_h, left_h = left_h, right_h
-    h = TaggedHash("TapBranch", left_h + right_h)
-    return (left + right, h)
+    """Compute the leaves and Merkle root of a script tree (see taproot_construct).
+
+    Returns a list of (name, version, script, merkle branch, leaf hash) tuples
+    for all named leaves, and the Merkle root. The tree is walked without
+    recursion, so arbitrarily deep trees are supported, and each Merkle branch
+    is assembled once from the sibling hashes on the path to the root."""
+    # Per node of the tree: its parent node, and the hash it is combined with there.
+    parents = []
+    siblings = []
+    leaves = []
+    # The (node, hash) pairs of nodes without a parent yet, from left to right.
+    done = []
+
+    def add_node(h):
+        done.append((len(parents), h))
+        parents.append(None)
+        siblings.append(bytes())
+
+    def add_branch(left_h, right_h):
+        if right_h < left_h:
+            right_h, left_h = left_h, right_h
+        add_node(TaggedHash("TapBranch", left_h + right_h))
+
+    # Ranges of item lists still to visit, and the branches to create from
+    # the nodes they produce, in reverse order.
+    todo = [("visit", scripts, 0, len(scripts))]
+    while todo:
+        action, *args = todo.pop()
+        if action == "branch":
+            # Combine the last two nodes.
+            right, right_h = done.pop()
+            left, left_h = done.pop()
+            siblings[left], siblings[right] = right_h, left_h
+            parents[left] = parents[right] = len(parents)
+            add_branch(left_h, right_h)
+        elif action == "partner":
+            # Combine the last node with a (fictitious) partner computed from its hash.
+            left, left_h = done.pop()
+            right_h = args[0](left_h)
+            siblings[left] = right_h
+            parents[left] = len(parents)
+            add_branch(left_h, right_h)
+        else:
+            items, start, end = args
+            if end - start == 0:
+                add_node(bytes())
+            elif end - start == 1:
+                # One entry: treat as a leaf
+                script = items[start]
+                assert not callable(script)
+                if isinstance(script, list):
+                    todo.append(("visit", script, 0, len(script)))
+                    continue
+                assert isinstance(script, tuple)
+                version = LEAF_VERSION_TAPSCRIPT
+                name = script[0]
+                code = script[1]
+                if len(script) == 3:
+                    version = script[2]
+                assert version & 1 == 0
+                assert isinstance(code, bytes)
+                h = TaggedHash("TapLeaf", bytes([version]) + ser_string(code))
+                if name is not None:
+                    leaves.append((name, version, code, len(parents), h))
+                add_node(h)
+            elif end - start == 2 and callable(items[start + 1]):
+                # Two entries, and the right one is a function
+                todo.append(("partner", items[start + 1]))
+                todo.append(("visit", items, start, start + 1))
+            else:
+                # Two or more entries: descend into each side
+                split_pos = start + (end - start) // 2
+                todo.append(("branch",))
+                todo.append(("visit", items, split_pos, end))
+                todo.append(("visit", items, start, split_pos))
+    (_, h), = done
+
+    ret = []
+    for name, version, code, node, leaf_h in leaves:
+        branch = []
+        while parents[node] is not None:
+            branch.append(siblings[node])
+            node = parents[node]
+        ret.append((name, version, code, b"".join(branch), leaf_h))
+    return (ret, h)
+
+def taproot_huffman_tree(weighted_scripts):
+    """Arrange script tree items by weight, so that likelier leaves have shorter Merkle branches.
+
+    weighted_scripts: a list of (weight, item) pairs, where an item is anything
+    taproot_construct accepts in its scripts list. Returns a scripts list for
+    taproot_construct, built like a Huffman code, which minimizes the expected
+    Merkle branch length (see BIP341)."""
+    heap = [(weight, i, item) for i, (weight, item) in enumerate(weighted_scripts)]
+    heapq.heapify(heap)
+    counter = len(heap)
+    while len(heap) > 1:
+        weight_left, _, left = heapq.heappop(heap)
+        weight_right, _, right = heapq.heappop(heap)
+        heapq.heappush(heap, (weight_left + weight_right, counter, [left, right]))
+        counter += 1
+    return [item for _, _, item in heap]
 
 # A TaprootInfo object has the following fields:
 # - scriptPubKey: the scriptPubKey (witness v1 CScript)
@@ -924,6 +1200,8 @@ def taproot_construct(pubkey, scripts=None, treat_internal_as_infinity=False):
              - a list of two items; the first of which is an item itself, and the
                second is a function. The function takes as input the Merkle root of the
                first item, and produces a (fictitious) partner to hash with.
+             Lists are split in half, so a flat list gives a balanced tree; use
+             taproot_huffman_tree to lay out leaves by weight instead.
 
     Returns: a TaprootInfo object
     """
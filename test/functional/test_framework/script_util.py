@@ -13,7 +13,7 @@ from test_framework.messages import (
     CTxIn,
     CTxInWitness,
     CTxOut,
-    ser_compact_size,
+    ser_compact_size_len,
     sha256,
 )
 from test_framework.script import (
@@ -133,14 +133,17 @@ def script_to_p2sh_p2wsh_script(script):
     return script_to_p2sh_script(p2shscript)
 
 def bulk_vout(tx, target_vsize):
-    if target_vsize < tx.get_vsize():
-        raise RuntimeError(f"target_vsize {target_vsize} is less than transaction virtual size {tx.get_vsize()}")
+    vsize = tx.get_vsize()
+    if target_vsize < vsize:
+        raise RuntimeError(f"target_vsize {target_vsize} is less than transaction virtual size {vsize}")
     # determine number of needed padding bytes
-    dummy_vbytes = target_vsize - tx.get_vsize()
+    dummy_vbytes = target_vsize - vsize
     # compensate for the increase of the compact-size encoded script length
     # (note that the length encoding of the unpadded output script needs one byte)
-    dummy_vbytes -= len(ser_compact_size(dummy_vbytes)) - 1
-    tx.vout[-1].scriptPubKey = CScript([OP_RETURN] + [OP_1] * dummy_vbytes)
+    dummy_vbytes -= ser_compact_size_len(dummy_vbytes) - 1
+    # Same as CScript([OP_RETURN] + [OP_1] * dummy_vbytes), without encoding
+    # the opcodes one by one.
+    tx.vout[-1].scriptPubKey = CScript(bytes([OP_RETURN]) + bytes([OP_1]) * dummy_vbytes)
     assert_equal(tx.get_vsize(), target_vsize)
 
 def output_key_to_p2tr_script(key):
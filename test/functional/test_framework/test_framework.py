@@ -23,6 +23,8 @@ import time
 from .address import create_deterministic_address_bcrt1_p2tr_op_true
 from .authproxy import JSONRPCException
 from . import coverage
+from .crypto.secp256k1 import FastGEMul
+from .key import load_libsecp256k1
 from .p2p import NetworkThread
 from .test_node import TestNode
 from .util import (
@@ -230,6 +232,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         export_env_build_path(self.config)
 
         self.options.cachedir = os.path.abspath(self.options.cachedir)
+        FastGEMul.cache_dir = self.options.cachedir
 
         # Set up temp directory and start logging
         if self.options.tmpdir:
@@ -239,6 +242,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.options.tmpdir = tempfile.mkdtemp(prefix=TMPDIR_PREFIX)
         self._start_logging()
 
+        libsecp256k1_path = load_libsecp256k1(self.config["environment"]["BUILDDIR"])
+        if libsecp256k1_path is not None:
+            self.log.debug(f"Using libsecp256k1 from {libsecp256k1_path}")
+
         # Seed the PRNG. Note that test runs are reproducible if and only if
         # a single thread accesses the PRNG. For more information, see
         # https://docs.python.org/3/library/random.html#notes-on-reproducibility.
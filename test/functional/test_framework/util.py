@@ -438,10 +438,14 @@ def sha256sum_file(filename):
 
 
 def util_xor(data, key, *, offset):
-    data = bytearray(data)
-    for i in range(len(data)):
-        data[i] ^= key[(i + offset) % len(key)]
-    return bytes(data)
+    """XOR data with key repeated, starting at position offset of the key."""
+    if not data:
+        return b""
+    shift = offset % len(key)
+    key = key[shift:] + key[:shift]
+    stream = (key * (len(data) // len(key) + 1))[:len(data)]
+    # One XOR of two big integers instead of a Python loop over the bytes.
+    return (int.from_bytes(data, "little") ^ int.from_bytes(stream, "little")).to_bytes(len(data), "little")
 
 
 # RPC/P2P connection constants and functions
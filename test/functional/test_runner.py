@@ -394,6 +394,7 @@ ALL_SCRIPTS = EXTENDED_SCRIPTS + BASE_SCRIPTS
 
 NON_SCRIPTS = [
     # These are python files that live in the functional tests directory, but are not test scripts.
+    "bench_framework.py",
     "combine_logs.py",
     "create_cache.py",
     "test_runner.py",
@@ -2,7 +2,7 @@
 # Copyright (c) 2024-present The Bitcoin Core developers
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Test utxo-to-sqlite conversion tool"""
+"""Test utxo-to-sqlite conversion and UTXO set MuHash tools"""
 import os.path
 try:
     import sqlite3
@@ -112,6 +112,12 @@ class UtxoToSqliteTest(BitcoinTestFramework):
         muhash_compact_serialized = node.gettxoutsetinfo('muhash')['muhash']
         assert_equal(muhash_sqlite, muhash_compact_serialized)
 
+        self.log.info('Verify the MuHash computed directly from the compact-serialized UTXO set')
+        utxo_muhash_path = os.path.join(base_dir, "contrib", "utxo-tools", "utxo_muhash.py")
+        output = subprocess.run([sys.executable, utxo_muhash_path, "-j", "2", input_filename],
+                                check=True, stdout=subprocess.PIPE, text=True).stdout
+        assert_equal(output.splitlines()[-1], f"muhash: {muhash_compact_serialized}")
+
 
 if __name__ == "__main__":
     UtxoToSqliteTest(__file__).main()